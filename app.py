@@ -1,33 +1,112 @@
 import tkinter as tk
 from PIL import Image, ImageTk, ImageOps
+import numpy as np
 import os
-import json
+import queue
+import sys
+import threading
+import time
+from bisect import bisect_left
 from functools import partial
+from itertools import zip_longest
+
+from content_index import ContentIndex
+from eligibility import DEFAULT_IMAGE_FILTERS, EligibilityIndex
+from file_index import FileIndex
+from image_cache import ImageCache, Prefetcher
+from tag_store import TagStore
+from thumbnail_cache import THUMBNAIL_SIZE, ThumbnailCache, ThumbnailGenerator
+from tiles import TileCache, render_view
 
 class ImageViewer:
 
     render_mode = "RGB"
 
-    def __init__(self, tkRoot, image_folder):
+    # Eligible images decoded ahead in each direction
+    prefetch_count = 3
+
+    # Quiet time after the last <Configure> event before re-rendering
+    resize_debounce_ms = 50
+
+    # Box reduce down to this multiple of the target size before the final filter
+    reducing_gap = 2.0
+
+    # How often the UI picks up files found by the background scan
+    scan_poll_ms = 50
+
+    # Contact sheet cell size, and screens of thumbnails generated ahead
+    sheet_cell = THUMBNAIL_SIZE + 8
+    sheet_prefetch_screens = 2
+    thumbnail_poll_ms = 100
+
+    # How often the UI checks whether the duplicate scan finished
+    dedup_poll_ms = 100
+
+    # Sibling trees of the image folder shown next to it in zoom mode, when they hold the same file
+    compare_folders = ("edited", "patched")
+    zoom_step = 1.25
+    max_zoom = 32.0
+    tile_poll_ms = 30
+
+    def __init__(self, tkRoot, image_folder, filters=DEFAULT_IMAGE_FILTERS):
         self.tkRoot = tkRoot
         self.image_folder = image_folder
-        self.all_image_files = []
+        self.filters = filters
+        self.start_time = time.perf_counter()
         
         path = os.path.dirname(os.path.abspath(__file__))
         image_folder = os.path.join(path, image_folder)
 
-        self.all_image_files = []
-        for root, dirs, files in os.walk(image_folder):
-            for name in files:
-                if name.lower().endswith(('png', 'jpg', 'jpeg')):
-                    self.all_image_files.append(os.path.relpath(os.path.join(root, name), image_folder))
+        # Start from the file list of the last run, if any, and refresh it in the background
+        self.file_index = FileIndex(image_folder, "image_index.json")
+        cached_files = self.file_index.cached_files()
+        self.warm_start = cached_files is not None
+        self.all_image_files = cached_files or []
+        self.scanning = True
+        self.scan_queue = queue.Queue()
+        self.first_image_shown = False
         
-        self.display_mode = "grid"  # Possible values: "grid" or "single"
+        self.display_mode = "grid"  # Possible values: "grid", "single", "sheet" or "zoom"
+        self.sheet_return_mode = "grid"
+        self.zoom_return_mode = "grid"
+        self.sheet_top_row = 0
+        self.sheet_columns = 1
+        self.thumbnail_cache = None
+        self.thumbnail_generator = None
+        self.thumbnail_job = None
         self.skip_tagged_images = True  # By default, skip images tagged with 'skip'
-        self.tag_history = []
+
+        # Zoom mode: one viewport shared by all panes, the centre as fractions of
+        # the image and the zoom as screen pixels per texel of the first pane
+        self.tile_cache = None
+        self.tile_job = None
+        self.zoom_file = None
+        self.zoom_center = (0.5, 0.5)
+        self.zoom = None
+        self.zoom_panes = []
+        self.zoom_missing = []
+        self.drag_origin = None
+
+        # Show one image per unique content; tags then apply to every duplicate
+        self.unique_only = False
+        self.duplicate_groups = None
+        self.hidden_duplicates = set()
+        self.dedup_queue = queue.Queue()
+        self.dedup_scanning = False
 
         self.current_index = 0
+        self.tag_store = None
         self.tags = {}
+
+        self.image_cache = ImageCache()
+        self.prefetcher = Prefetcher(self.image_cache)
+
+        self.frame_photo = None
+        self.frame_photo_format = None
+        self.last_render_key = None
+        self.last_render_ms = 0.0
+        self.render_job = None
+
         self.tag_panel = tk.Frame(self.tkRoot, bg='lightgray')
         self.tag_panel.pack(side=tk.BOTTOM, fill=tk.X)
 
@@ -51,22 +130,171 @@ class ImageViewer:
         self.tkRoot.bind("1", partial(self.toggle_tag, tag='copy'))
         self.tkRoot.bind("2", partial(self.toggle_tag, tag='skip'))
         self.tkRoot.bind("m", self.toggle_display_mode)
+        self.tkRoot.bind("c", self.toggle_sheet_mode)
+        self.tkRoot.bind("<Return>", self.toggle_sheet_mode)
+        self.tkRoot.bind("<Up>", partial(self.sheet_move, rows=-1))
+        self.tkRoot.bind("<Down>", partial(self.sheet_move, rows=1))
+        self.tkRoot.bind("<Prior>", partial(self.sheet_move, pages=-1))
+        self.tkRoot.bind("<Next>", partial(self.sheet_move, pages=1))
+        self.tkRoot.bind("<MouseWheel>", self.mouse_wheel)
+        self.tkRoot.bind("<Button-4>", partial(self.mouse_wheel, step=-1))
+        self.tkRoot.bind("<Button-5>", partial(self.mouse_wheel, step=1))
+        self.canvas.bind("<Button-1>", self.canvas_click)
+        self.canvas.bind("<B1-Motion>", self.zoom_drag)
+        self.tkRoot.bind("v", self.toggle_zoom_mode)
+        self.tkRoot.bind("<plus>", partial(self.zoom_key, step=-1))
+        self.tkRoot.bind("=", partial(self.zoom_key, step=-1))
+        self.tkRoot.bind("<minus>", partial(self.zoom_key, step=1))
+        self.tkRoot.bind("0", self.zoom_fit)
         self.tkRoot.bind("s", self.toggle_skip_behavior)
         self.tkRoot.bind("z", self.undo_tag)
+        self.tkRoot.bind("u", self.toggle_unique_mode)
         
         self.tkRoot.bind("q", self.quit_viewer)
+        self.tkRoot.protocol("WM_DELETE_WINDOW", partial(self.quit_viewer, None))
 
-        # Bind window resize event to reload the image
-        self.tkRoot.bind("<Configure>", lambda event: self.load_image())
+        # Bind window resize event to reload the image once resizing settles
+        self.tkRoot.bind("<Configure>", self.schedule_render)
         
         self.load_tags()
-        self.load_image()
+        self.eligibility = self.make_eligibility()
+        if self.all_image_files:
+            self.load_image()
+
+        threading.Thread(target=self.scan_files, daemon=True).start()
+        self.tkRoot.after(self.scan_poll_ms, self.poll_scan)
+
+    def scan_files(self):
+        """Background thread: refresh the file index, streaming files on a cold start."""
+        if self.warm_start:
+            self.scan_queue.put(("done", self.file_index.scan()))
+        else:
+            self.file_index.scan(on_batch=lambda batch: self.scan_queue.put(("batch", batch)))
+            self.scan_queue.put(("done", None))
+
+    def poll_scan(self):
+        """Move results of the background scan into the viewer, on the UI thread."""
+        done = False
+        while True:
+            try:
+                kind, files = self.scan_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "batch":
+                self.eligibility.extend(files, self.tags)
+                if not self.first_image_shown and self.eligibility.count():
+                    self.current_index = self.eligibility.next(-1)
+                    self.load_image()
+                continue
+            done = True
+            if files is not None and files != self.all_image_files:
+                self.replace_file_list(files)
+
+        if not done:
+            self.tkRoot.after(self.scan_poll_ms, self.poll_scan)
+            return
+
+        self.scanning = False
+        scan = self.file_index.last_scan
+        print(f"{'Warm' if self.warm_start else 'Cold'} start: indexed {scan['files']} images in {scan['seconds']:.2f} s "
+              f"({scan['dirs_scanned']} directories listed, {scan['dirs_reused']} unchanged)")
+        if self.first_image_shown:
+            self.load_image()  # refresh the title now the count is final
+        elif self.all_image_files:
+            self.load_image()
+        else:
+            self.show_done()
+
+    def make_eligibility(self):
+        hidden = self.hidden_duplicates if self.unique_only else None
+        return EligibilityIndex(self.all_image_files, self.filters, self.tags, self.skip_tagged_images, hidden)
+
+    def replace_file_list(self, files):
+        """Swap in a refreshed file list, staying on the current image if it still exists."""
+        current_path = self.all_image_files[self.current_index] if self.all_image_files else None
+        self.all_image_files = files
+        self.rebuild_eligibility(current_path)
+        if self.unique_only:
+            # Groups of the old list may miss new files
+            self.start_dedup_scan()
+
+    def rebuild_eligibility(self, current_path):
+        """Recompute the eligible images and stay on current_path, or its shown duplicate."""
+        self.eligibility = self.make_eligibility()
+        if self.unique_only and self.duplicate_groups and current_path in self.hidden_duplicates:
+            current_path = self.duplicate_groups[current_path][0]
+        index = self.eligibility.positions.get(current_path)
+        if index is None:
+            index = self.eligibility.next(-1)
+        self.current_index = index or 0
+        if self.all_image_files:
+            self.load_image()
+
+    def toggle_unique_mode(self, event):
+        """Show each unique image once, hiding byte-identical copies at other paths."""
+        self.unique_only = not self.unique_only
+        if self.unique_only and self.duplicate_groups is None:
+            self.start_dedup_scan()
+            return
+        current_path = self.all_image_files[self.current_index] if self.all_image_files else None
+        self.rebuild_eligibility(current_path)
+
+    def start_dedup_scan(self):
+        if self.dedup_scanning:
+            return
+        self.dedup_scanning = True
+        self.info_label.config(text="Finding duplicate images...")
+        files = list(self.all_image_files)
+        threading.Thread(target=self.find_duplicates, args=(files,), daemon=True).start()
+        self.tkRoot.after(self.dedup_poll_ms, self.poll_dedup)
+
+    def find_duplicates(self, files):
+        """Background thread: group the files by content, each group in file list order."""
+        index = ContentIndex("content_index.json")
+        full_paths = {self.image_path_of(file): file for file in files}
+        index.index_files(full_paths)
+        index.save()
+        groups = [[full_paths[path] for path in paths] for paths in index.groups().values()]
+        self.dedup_queue.put(groups)
+
+    def poll_dedup(self):
+        try:
+            groups = self.dedup_queue.get_nowait()
+        except queue.Empty:
+            self.tkRoot.after(self.dedup_poll_ms, self.poll_dedup)
+            return
+        self.dedup_scanning = False
+        positions = {file: index for index, file in enumerate(self.all_image_files)}
+        self.duplicate_groups = {}
+        self.hidden_duplicates = set()
+        for group in groups:
+            group = sorted(group, key=lambda file: positions.get(file, len(positions)))
+            for file in group:
+                self.duplicate_groups[file] = group
+            self.hidden_duplicates.update(group[1:])
+        print(f"{len(groups)} images have duplicates, hiding {len(self.hidden_duplicates)} copies")
+        current_path = self.all_image_files[self.current_index] if self.all_image_files else None
+        self.rebuild_eligibility(current_path)
 
     def load_image(self):
-        image_path = os.path.join(self.image_folder, self.all_image_files[self.current_index])
-        original_image = Image.open(image_path)
-        
-        title_text = f"{self.current_index + 1} / {len(self.all_image_files)} - {image_path}"
+        if not self.all_image_files:
+            self.show_done()
+            return
+        if not self.first_image_shown:
+            self.first_image_shown = True
+            print(f"First image shown after {(time.perf_counter() - self.start_time) * 1000:.0f} ms")
+        if self.display_mode == "sheet":
+            self.render_sheet()
+            return
+        if self.display_mode == "zoom":
+            self.render_zoom()
+            return
+        image_path = self.image_path(self.current_index)
+
+        title_text = f"{self.current_index + 1} / {len(self.all_image_files)} ({self.eligibility.count()} remaining) - {image_path}"
+        copies = len(self.duplicates_of(self.all_image_files[self.current_index])) - 1
+        if copies:
+            title_text += f" (+{copies} duplicates)"
 
         self.tkRoot.title(title_text)
 
@@ -76,10 +304,15 @@ class ImageViewer:
         window_width = self.tkRoot.winfo_width()
         window_height = self.tkRoot.winfo_height()
 
-        if window_width == 0 or window_height == 0:
-            # Window is minimized, don't render the image
+        decode_box = self.decode_box()
+        if decode_box is None:
+            # Not mapped yet, or minimized: without a size the full resolution level would be decoded.
+            # The <Configure> event of the first map renders the image
             return
 
+        original_image = self.image_cache.get(image_path, decode_box)
+        self.prefetch_neighbours()
+
         # Aspect ratio of the image
         image_aspect = original_image.width / original_image.height
 
@@ -99,77 +332,447 @@ class ImageViewer:
             # Window is too small to render the image
             return
 
-        scaled_image = original_image.resize((scaled_width, scaled_height))
+        # Identical renders (e.g. Configure events for other widgets) are free
+        render_key = (image_path, scaled_width, scaled_height, self.display_mode, self.render_mode)
+        if render_key == self.last_render_key:
+            return
+
+        start = time.perf_counter()
+        frame = self.render_frame(original_image, scaled_width, scaled_height)
+        self.show_frame(frame)
+        self.last_render_key = render_key
+
+        self.last_render_ms = (time.perf_counter() - start) * 1000
+        info = f"Render: {self.last_render_ms:.1f} ms"
+        if original_image.info.get("full_size"):
+            full_width, full_height = original_image.info["full_size"]
+            info += f", mipmap {original_image.width}x{original_image.height} of {full_width}x{full_height}"
+        self.info_label.config(text=info)
+
+    def decode_box(self):
+        """
+        The box images are scaled to fit in the current display mode, so
+        textures decode only the mipmap it needs; None while the window has no size.
+        """
+        width = self.tkRoot.winfo_width()
+        height = self.tkRoot.winfo_height()
+        if width <= 1 or height <= 1:
+            return None
+        if self.display_mode == "grid":
+            # Each channel quadrant is half the window in both directions
+            return max(1, width // 2), max(1, height // 2)
+        return width, height
 
-        # Clear the canvas
-        self.canvas.delete("all")
+    def render_frame(self, image, width, height):
+        """
+        Build the displayed frame as a single image.
+
+        Grid mode composes the four channel quadrants into one grayscale buffer;
+        single mode shows one channel, or the colour image for "RGB".
+        """
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
 
         if self.display_mode == "grid":
-            # Render the 2x2 grid
-            channels = scaled_image.split()
-
-            quadrant_width = scaled_width // 2
-            quadrant_height = scaled_height // 2
-
-            for idx, channel in enumerate(channels):
-                img = Image.new("RGB", (quadrant_width, quadrant_height))
-                resized_channel = channel.resize((quadrant_width, quadrant_height))
-                img.paste(resized_channel, (0, 0))
-                quadrant = ImageTk.PhotoImage(img)
-                self.canvas.create_image((idx % 2) * quadrant_width, (idx // 2) * quadrant_height, anchor=tk.NW, image=quadrant)
-                setattr(self, f"quadrant_{idx}_img", quadrant)  # To prevent the image from being garbage collected
+            quadrant_width = width // 2
+            quadrant_height = height // 2
+            # A box reduction first keeps the final filter cheap on large textures
+            scaled = image.convert("RGBA").resize((quadrant_width, quadrant_height), Image.BICUBIC,
+                                                  reducing_gap=self.reducing_gap)
+            pixels = np.asarray(scaled)
+            # (h, w, 4) -> 2x2 grid of channels: R G / B A
+            grid = pixels.transpose(2, 0, 1).reshape(2, 2, quadrant_height, quadrant_width)
+            grid = grid.transpose(0, 2, 1, 3).reshape(quadrant_height * 2, quadrant_width * 2)
+            return Image.fromarray(np.ascontiguousarray(grid), "L")
+
+        scaled = image.resize((width, height), Image.BICUBIC, reducing_gap=self.reducing_gap)
+        if self.render_mode == "RGB":
+            return scaled.convert("RGB")
+        channels = {"R": 0, "G": 1, "B": 2, "A": 3}
+        return scaled.convert("RGBA").split()[channels[self.render_mode]]
+
+    def show_frame(self, frame):
+        """Show a frame, reusing the PhotoImage when size and mode are unchanged."""
+        if self.frame_photo is not None and self.frame_photo_format == (frame.size, frame.mode):
+            self.frame_photo.paste(frame)
+        else:
+            self.frame_photo = ImageTk.PhotoImage(frame)
+            self.frame_photo_format = (frame.size, frame.mode)
+        self.canvas.delete("all")
+        self.canvas.create_image(0, 0, anchor=tk.NW, image=self.frame_photo)
+
+    def toggle_sheet_mode(self, event):
+        """Switch between the contact sheet and the previous display mode."""
+        if self.display_mode == "sheet":
+            self.display_mode = self.sheet_return_mode
         else:
-            channels = {"R": 0, "G": 1, "B": 2, "A": 3}
-            channel_img = scaled_image.split()[channels[self.render_mode]]
-            img = Image.merge("RGB", (channel_img, channel_img, channel_img))
-            self.tk_image = ImageTk.PhotoImage(img)
-            self.canvas.create_image(0, 0, anchor=tk.NW, image=self.tk_image)
+            self.sheet_return_mode = self.display_mode
+            self.display_mode = "sheet"
+            if self.thumbnail_cache is None:
+                self.thumbnail_cache = ThumbnailCache("thumbnails")
+                self.thumbnail_generator = ThumbnailGenerator(self.thumbnail_cache)
+        self.last_render_key = None
+        self.load_image()
+
+    def sheet_layout(self):
+        """Return (columns, rows with a partial last one, fully visible rows) for the window size."""
+        columns = max(1, self.tkRoot.winfo_width() // self.sheet_cell)
+        full_rows = max(1, self.tkRoot.winfo_height() // self.sheet_cell)
+        return columns, full_rows + 1, full_rows
+
+    def sheet_thumbnail_items(self, indices):
+        """Return (path, mtime) for the images at indices, with mtime None for files that vanished."""
+        items = []
+        for index in indices:
+            path = self.image_path(index)
+            try:
+                items.append((path, os.stat(path).st_mtime_ns))
+            except OSError:
+                items.append((path, None))
+        return items
+
+    def render_sheet(self):
+        """
+        Draw the rows of eligible images around the current one as a contact sheet.
+
+        Only the visible rows are composed, into one frame shown through the
+        reused PhotoImage, so the cost does not depend on how many images
+        there are. Missing thumbnails are drawn as placeholders and requested
+        from the generator, together with the next screens.
+        """
+        width = self.tkRoot.winfo_width()
+        height = self.tkRoot.winfo_height()
+        if width <= 1 or height <= 1:
+            return
+
+        active = self.eligibility.active
+        columns, rows, full_rows = self.sheet_layout()
+        self.sheet_columns = columns
+        position = min(bisect_left(active, self.current_index), max(len(active) - 1, 0))
+        row = position // columns
+        if row < self.sheet_top_row:
+            self.sheet_top_row = row
+        elif row >= self.sheet_top_row + full_rows:
+            self.sheet_top_row = row - full_rows + 1
+
+        first = self.sheet_top_row * columns
+        visible = active[first:first + rows * columns]
+        ahead = active[first + rows * columns:first + (rows + self.sheet_prefetch_screens * full_rows) * columns]
+
+        start = time.perf_counter()
+        cell = self.sheet_cell
+        frame = Image.new("RGB", (width, height), (32, 32, 32))
+        missing = []
+        for slot, (path, mtime) in enumerate(self.sheet_thumbnail_items(visible)):
+            x = (slot % columns) * cell
+            y = (slot // columns) * cell
+            thumbnail = self.thumbnail_cache.get(path, mtime) if mtime is not None else None
+            if thumbnail is None:
+                if mtime is not None and not self.thumbnail_generator.has_failed(path, mtime):
+                    missing.append((path, mtime))
+                frame.paste((64, 64, 64), (x + 4, y + 4, x + cell - 4, y + cell - 4))
+                continue
+            frame.paste(thumbnail, (x + (cell - thumbnail.width) // 2, y + (cell - thumbnail.height) // 2))
+
+        self.show_frame(frame)
+        self.last_render_key = None
+
+        # Selection and tags are canvas items on top of the frame
+        for slot, index in enumerate(visible):
+            x = (slot % columns) * cell
+            y = (slot // columns) * cell
+            if index == self.current_index:
+                self.canvas.create_rectangle(x + 1, y + 1, x + cell - 2, y + cell - 2, outline="yellow", width=2)
+            tags = self.tags.get(self.all_image_files[index])
+            if tags:
+                self.canvas.create_text(x + 4, y + cell - 4, anchor=tk.SW, text=",".join(tags), fill="red")
+
+        self.last_render_ms = (time.perf_counter() - start) * 1000
+        self.info_label.config(text=f"Render: {self.last_render_ms:.1f} ms, {len(missing)} thumbnails pending")
+        self.tkRoot.title(f"Sheet {position + 1} / {len(active)} - {self.image_path(self.current_index)}")
+        self.update_tag_panel()
+
+        if missing or ahead:
+            self.thumbnail_generator.request(missing + [item for item in self.sheet_thumbnail_items(ahead) if item[1] is not None])
+        if missing and self.thumbnail_job is None:
+            self.thumbnail_job = self.tkRoot.after(self.thumbnail_poll_ms, self.poll_thumbnails)
+
+    def poll_thumbnails(self):
+        """Redraw the sheet as generated thumbnails arrive."""
+        self.thumbnail_job = None
+        if self.display_mode != "sheet":
+            return
+        if self.thumbnail_generator.take_ready():
+            self.render_sheet()
+        else:
+            self.thumbnail_job = self.tkRoot.after(self.thumbnail_poll_ms, self.poll_thumbnails)
+
+    def sheet_move(self, event, rows=0, pages=0):
+        """Move the sheet selection by whole rows or screens of eligible images."""
+        if self.display_mode != "sheet":
+            return
+        active = self.eligibility.active
+        if not active:
+            return
+        columns, _, full_rows = self.sheet_layout()
+        position = bisect_left(active, self.current_index) + (rows + pages * full_rows) * columns
+        self.current_index = active[min(max(position, 0), len(active) - 1)]
+        self.load_image()
+
+    def mouse_wheel(self, event, step=None):
+        """Zoom at the mouse in zoom mode, scroll the contact sheet otherwise; step -1 is up."""
+        if step is None:
+            step = -1 if event.delta > 0 else 1
+        if self.display_mode == "zoom":
+            self.zoom_at(self.zoom_step ** -step, event.x, event.y)
+        else:
+            self.sheet_move(event, rows=step)
+
+    def canvas_click(self, event):
+        if self.display_mode == "zoom":
+            self.drag_origin = (event.x, event.y)
+        else:
+            self.sheet_click(event)
+
+    def sheet_click(self, event):
+        """Select the thumbnail under the mouse."""
+        if self.display_mode != "sheet":
+            return
+        slot = (self.sheet_top_row + event.y // self.sheet_cell) * self.sheet_columns + event.x // self.sheet_cell
+        if event.x // self.sheet_cell < self.sheet_columns and slot < len(self.eligibility.active):
+            self.current_index = self.eligibility.active[slot]
+            self.load_image()
+
+    def toggle_zoom_mode(self, event):
+        """Switch between zoom mode and the previous display mode."""
+        if self.display_mode == "zoom":
+            self.display_mode = self.zoom_return_mode
+        else:
+            if self.display_mode != "sheet":
+                self.zoom_return_mode = self.display_mode
+            self.display_mode = "zoom"
+            if self.tile_cache is None:
+                self.tile_cache = TileCache(self.image_cache)
+        self.last_render_key = None
+        self.load_image()
+
+    def compare_paths(self, file):
+        """Return (label, path) of file and of its counterparts in the compare folders, for the panes that exist."""
+        folder = os.path.abspath(self.image_folder)
+        parent = os.path.dirname(folder)
+        panes = [(os.path.basename(folder), self.image_path_of(file))]
+        stem = os.path.splitext(file)[0]
+        for name in self.compare_folders:
+            other = os.path.join(parent, name)
+            if other == folder:
+                continue
+            # Converted trees hold .paa where the original has .png, and the other way round
+            for candidate in dict.fromkeys((file, stem + ".png", stem + ".paa")):
+                path = os.path.join(other, candidate)
+                if os.path.isfile(path):
+                    panes.append((name, path))
+                    break
+        return panes
+
+    def render_zoom(self):
+        """
+        Draw the current image and its counterparts side by side, all at the same zoom and centre.
+
+        Each pane shows a fitted backdrop at once and the tiles of the level
+        matching the zoom as they are decoded in the background, so only the
+        tiles in view are ever decoded at full resolution.
+        """
+        width = self.tkRoot.winfo_width()
+        height = self.tkRoot.winfo_height()
+        if width <= 1 or height <= 1:
+            return
+        file = self.all_image_files[self.current_index]
+        if file != self.zoom_file:
+            self.zoom_file = file
+            self.zoom_center = (0.5, 0.5)
+            self.zoom = None
+
+        start = time.perf_counter()
+        self.zoom_panes = []
+        for label, path in self.compare_paths(file):
+            try:
+                self.zoom_panes.append((label, path, self.tile_cache.image(path)))
+            except (OSError, ValueError) as e:
+                print(f"Cannot open {path}: {e}")
+        if not self.zoom_panes:
+            self.show_done()
+            return
+        pane_width = width // len(self.zoom_panes)
+        first = self.zoom_panes[0][2]
+        if self.zoom is None:
+            self.zoom = min(pane_width / first.width, height / first.height)
+
+        frame = Image.new("RGB" if self.render_mode == "RGB" else "L", (width, height))
+        missing = []
+        for slot, (label, path, image) in enumerate(self.zoom_panes):
+            # Panes of other sizes show the same area, so texels map by fraction of the image
+            texels_per_pixel = image.width / (self.zoom * first.width)
+            backdrop = self.image_cache.get(path, (pane_width, height))
+            pane, pane_missing = render_view(image, backdrop, self.tile_cache, self.zoom_center, texels_per_pixel,
+                                             (pane_width, height))
+            if self.render_mode == "RGB":
+                pane = pane.convert("RGB")
+            else:
+                pane = pane.getchannel(self.render_mode)
+            frame.paste(pane, (slot * pane_width, 0))
+            missing.extend(pane_missing)
+        self.show_frame(frame)
+        self.last_render_key = None
+
+        for slot, (label, path, image) in enumerate(self.zoom_panes):
+            x = slot * pane_width
+            if slot:
+                self.canvas.create_line(x, 0, x, height, fill="gray")
+            self.canvas.create_text(x + 4, 4, anchor=tk.NW, text=f"{label} {image.width}x{image.height}", fill="yellow")
+
+        self.last_render_ms = (time.perf_counter() - start) * 1000
+        self.info_label.config(text=f"Render: {self.last_render_ms:.1f} ms, zoom {self.zoom * 100:.0f}%, "
+                                    f"{len(missing)} tiles pending")
+        self.tkRoot.title(f"Zoom {self.current_index + 1} / {len(self.all_image_files)} - {self.zoom_panes[0][1]}")
+        self.update_tag_panel()
+
+        self.zoom_missing = missing
+        self.tile_cache.request(missing)
+        if missing and self.tile_job is None:
+            self.tile_job = self.tkRoot.after(self.tile_poll_ms, self.poll_tiles)
+
+    def poll_tiles(self):
+        """Redraw the zoom view as decoded tiles arrive."""
+        self.tile_job = None
+        if self.display_mode != "zoom" or not self.zoom_missing:
+            return
+        if any(self.tile_cache.tiles.has(key) for key in self.zoom_missing):
+            self.render_zoom()
+        else:
+            self.tile_job = self.tkRoot.after(self.tile_poll_ms, self.poll_tiles)
+
+    def zoom_at(self, factor, x, y):
+        """Scale the zoom by factor, keeping the texel under window position (x, y) in place."""
+        if self.display_mode != "zoom" or not self.zoom_panes or self.zoom is None:
+            return
+        width = self.tkRoot.winfo_width()
+        height = self.tkRoot.winfo_height()
+        pane_width = width // len(self.zoom_panes)
+        first = self.zoom_panes[0][2]
+        fit = min(pane_width / first.width, height / first.height)
+        zoom = min(max(self.zoom * factor, fit / 4), self.max_zoom)
+        # Offset of the mouse from the centre of the pane it is over
+        dx = x % pane_width - pane_width / 2
+        dy = y - height / 2
+        u, v = self.zoom_center
+        u += dx / first.width * (1 / self.zoom - 1 / zoom)
+        v += dy / first.height * (1 / self.zoom - 1 / zoom)
+        self.zoom = zoom
+        self.zoom_center = (min(max(u, 0.0), 1.0), min(max(v, 0.0), 1.0))
+        self.render_zoom()
+
+    def zoom_key(self, event, step):
+        width = self.tkRoot.winfo_width()
+        pane_width = width // max(1, len(self.zoom_panes))
+        self.zoom_at(self.zoom_step ** -step, pane_width // 2, self.tkRoot.winfo_height() // 2)
+
+    def zoom_fit(self, event):
+        if self.display_mode != "zoom":
+            return
+        self.zoom = None
+        self.zoom_center = (0.5, 0.5)
+        self.render_zoom()
+
+    def zoom_drag(self, event):
+        """Pan all panes together with the mouse."""
+        if self.display_mode != "zoom" or self.drag_origin is None or not self.zoom_panes:
+            return
+        first = self.zoom_panes[0][2]
+        u, v = self.zoom_center
+        u -= (event.x - self.drag_origin[0]) / (self.zoom * first.width)
+        v -= (event.y - self.drag_origin[1]) / (self.zoom * first.height)
+        self.drag_origin = (event.x, event.y)
+        self.zoom_center = (min(max(u, 0.0), 1.0), min(max(v, 0.0), 1.0))
+        self.render_zoom()
+
+    def schedule_render(self, event=None):
+        """Coalesce bursts of resize events into one render after they settle."""
+        if self.render_job is not None:
+            self.tkRoot.after_cancel(self.render_job)
+        self.render_job = self.tkRoot.after(self.resize_debounce_ms, self.run_scheduled_render)
+
+    def run_scheduled_render(self):
+        self.render_job = None
+        self.load_image()
+
+    def show_done(self):
+        self.canvas.delete("all")
+        self.last_render_key = None
+        text = "Scanning..." if self.scanning else "Done"
+        self.canvas.create_text(self.tkRoot.winfo_width() // 2, self.tkRoot.winfo_height() // 2, text=text, font=("Arial", 24), fill="red")
+
+    def image_path(self, index):
+        return self.image_path_of(self.all_image_files[index])
+
+    def image_path_of(self, file):
+        return os.path.join(self.image_folder, file)
+
+    def duplicates_of(self, file):
+        """The files tagged together with file: its duplicates in unique mode, else just file."""
+        if self.unique_only and self.duplicate_groups:
+            return self.duplicate_groups.get(file, [file])
+        return [file]
+
+    def is_eligible(self, index):
+        """Whether next_image/prev_image may stop on the image at index."""
+        return self.eligibility.is_eligible(index)
+
+    def neighbour_indices(self, step, count):
+        """Return up to count eligible indices next_image (step 1) or prev_image (step -1) would visit."""
+        advance = self.eligibility.next if step > 0 else self.eligibility.prev
+        indices = []
+        index = advance(self.current_index)
+        while index is not None and index != self.current_index and index not in indices and len(indices) < count:
+            indices.append(index)
+            index = advance(index)
+        return indices
+
+    def prefetch_neighbours(self):
+        """Queue the images around the current one for background decoding, nearest first."""
+        decode_box = self.decode_box()
+        if decode_box is None:
+            return
+        following = self.neighbour_indices(1, self.prefetch_count)
+        preceding = self.neighbour_indices(-1, self.prefetch_count)
+        order = []
+        for pair in zip_longest(following, preceding):
+            for index in pair:
+                if index is not None and index not in order:
+                    order.append(index)
+        self.prefetcher.request([self.image_path(index) for index in order], decode_box)
 
     def is_image_valid(self, image_path):
-        filter_array = [
-            'nohq.png',
-            'co.png',
-            'smdi.png',
-            'ao.png',
-            'as.png',
-            '\\UI\\',
-            '\\ui\\',
-            '\\icons\\',
-            '_body_',
-            'reticle',
-        ]
-        return not any(filter in image_path for filter in filter_array)
+        return self.eligibility.is_path_valid(image_path)
 
     def next_image(self, event):
-        initial_index = self.current_index
-        while True:
-            self.current_index = (self.current_index + 1) % len(self.all_image_files)
-            image_path = self.all_image_files[self.current_index]
-            if (self.is_image_valid(image_path) and
-                not (self.skip_tagged_images and image_path in self.tags and len(self.tags[image_path]) > 0)):
-                break
-            if self.current_index == initial_index:
-                self.canvas.delete("all")
-                self.canvas.create_text(self.tkRoot.winfo_width() // 2, self.tkRoot.winfo_height() // 2, text="Done", font=("Arial", 24), fill="red")
-                return
+        index = self.eligibility.next(self.current_index)
+        if index is None:
+            self.show_done()
+            return
+        self.current_index = index
         self.load_image()
 
     def prev_image(self, event):
-        initial_index = self.current_index
-        while True:
-            self.current_index = (self.current_index - 1) % len(self.all_image_files)
-            image_path = self.all_image_files[self.current_index]
-            if (self.is_image_valid(image_path) and
-                not (self.skip_tagged_images and image_path in self.tags and len(self.tags[image_path]) > 0)):
-                break
-            if self.current_index == initial_index:
-                self.canvas.delete("all")
-                self.canvas.create_text(self.tkRoot.winfo_width() // 2, self.tkRoot.winfo_height() // 2, text="Done", font=("Arial", 24), fill="red")
-                return
+        index = self.eligibility.prev(self.current_index)
+        if index is None:
+            self.show_done()
+            return
+        self.current_index = index
         self.load_image()
 
     def toggle_skip_behavior(self, event):
         self.skip_tagged_images = not self.skip_tagged_images
+        self.eligibility.skip_tagged = self.skip_tagged_images
 
     def show_channel(self, channel, event):
 
@@ -184,9 +787,18 @@ class ImageViewer:
         self.load_image()
 
     def quit_viewer(self, event):
+        self.prefetcher.stop()
+        if self.thumbnail_generator is not None:
+            self.thumbnail_generator.stop()
+        if self.tile_cache is not None:
+            self.tile_cache.stop()
         self.save_tags()
         self.tkRoot.quit()
 
+    @property
+    def tag_history(self):
+        return self.tag_store.history
+
     def tag_image(self, event):
         image_path = os.path.join(self.image_folder, self.all_image_files[self.current_index])
         if image_path in self.tags:
@@ -195,58 +807,45 @@ class ImageViewer:
             self.tags[image_path] = True
 
     def load_tags(self):
-        try:
-            with open("tags.json", "r") as file:
-                self.tags = json.load(file)
-        except (FileNotFoundError, json.JSONDecodeError):
-            self.tags = {}
+        self.tag_store = TagStore("tags.json")
+        # Live view of the store's tags; changes go through the store only
+        self.tags = self.tag_store.tags
 
     def save_tags(self):
-        if os.path.exists("tags.json"):
-            os.remove("tags.json")
-
-        with open("tags.json", "w") as file:
-            # pretty print the json so it's easier to read
-            json.dump(self.tags, file, indent=4)
+        self.tag_store.close()
 
     def toggle_tag(self, event, tag):
+        if not self.all_image_files:
+            return
         current_image = self.all_image_files[self.current_index]
-        if current_image not in self.tags:
-            self.tags[current_image] = []
-
-        action = "added"
-        if tag in self.tags[current_image]:
-            self.tags[current_image].remove(tag)
-            action = "removed"
-        else:
-            self.tags[current_image].append(tag)
+        images = self.duplicates_of(current_image)
+        self.tag_store.toggle_many(images, tag)
+        self.update_tagged(images)
 
-        self.tag_history.append({
-            "image": current_image,
-            "tag": tag,
-            "action": action
-        })
-
-        self.save_tags()
         self.update_tag_panel()
 
         # move to next image
         self.next_image(event)
 
     def undo_tag(self, event):
-        if not self.tag_history:
+        last_action = self.tag_store.undo()
+        if last_action is None:
             return
 
-        last_action = self.tag_history.pop()
-        if last_action["action"] == "added":
-            self.tags[last_action["image"]].remove(last_action["tag"])
-        else:
-            self.tags[last_action["image"]].append(last_action["tag"])
+        self.update_tagged(last_action.get("images", [last_action["image"]]))
 
-        self.save_tags()
         self.update_tag_panel()
 
+    def update_tagged(self, images):
+        """Tell the eligibility index which of images now have tags."""
+        for image in images:
+            index = self.eligibility.positions.get(image)
+            if index is not None:
+                self.eligibility.set_tagged(index, bool(self.tags.get(image)))
+
     def update_tag_panel(self):
+        if not self.all_image_files:
+            return
         current_image = self.all_image_files[self.current_index]
         current_tags = self.tags.get(current_image, [])
 
@@ -272,7 +871,8 @@ class ImageViewer:
 
 if __name__ == "__main__":
     try:
-        image_folder = "extracted"  # Replace with the path to your image folder
+        # Folder of PNGs, or of .paa textures straight from extraction
+        image_folder = sys.argv[1] if len(sys.argv) > 1 else "extracted"
         tkRoot = tk.Tk()
         tkRoot.attributes('-fullscreen', False)
         viewer = ImageViewer(tkRoot, image_folder)
@@ -0,0 +1,271 @@
+"""
+Apply a recipe of channel edits to tagged textures, writing edited/.
+
+    python batch_edit.py lens_alpha.json --tag "copy AND NOT skip"
+
+A recipe is a JSON list of operations applied in order, each to some of
+the channels R, G, B and A (all four when "channels" is left out):
+
+    [
+        {"op": "scale", "channels": "A", "factor": 0.8},
+        {"op": "clamp", "channels": "A", "min": 0, "max": 200},
+        {"op": "levels", "channels": "RGB", "in_low": 16, "in_high": 235, "gamma": 1.2},
+        {"op": "fill", "channels": "RGB", "value": 0},
+        {"op": "swizzle", "order": "BGRA"}
+    ]
+
+"levels" also takes out_low and out_high. Outputs are PNGs at the
+relative path of their original, so process.py picks them up. A file is
+only rewritten when its original or the recipe changed, and never when
+it was edited by hand since.
+"""
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import paa
+import tracing
+from copy_tagged import PathResolver, compile_tag_filter, select_tag_paths
+from manifest import Manifest, cached_file_hash
+from tag_store import load_tags
+
+CHANNELS = "RGBA"
+
+EDIT_MANIFEST_NAME = "edit_manifest.json"
+
+# Pixels edited per step; bounds the temporaries on 8k textures
+CHUNK_PIXELS = 1 << 22
+
+
+def _levels(values, in_low=0, in_high=255, gamma=1.0, out_low=0, out_high=255):
+    scaled = np.clip((values - in_low) / max(in_high - in_low, 1e-6), 0.0, 1.0)
+    return out_low + (out_high - out_low) * scaled ** (1.0 / gamma)
+
+
+_OPERATIONS = {
+    "scale": lambda values, factor: values * factor,
+    "clamp": lambda values, min=0, max=255: np.clip(values, min, max),
+    "fill": lambda values, value: np.full_like(values, value),
+    "levels": _levels,
+}
+
+
+def _channel_indices(channels):
+    indices = [CHANNELS.find(channel) for channel in channels.upper()]
+    if not indices or -1 in indices:
+        raise ValueError(f"bad channels {channels!r}, expected letters of {CHANNELS}")
+    return indices
+
+
+def compile_recipe(recipe):
+    """
+    Reduce a recipe to one (source channel, lookup table) pair per output channel.
+
+    Every operation maps each value of a channel on its own, so any sequence
+    of them amounts to a channel permutation followed by a 256 entry table
+    per channel. Values are rounded once, at the end.
+
+    :return: list of four (source channel index, uint8 table of 256 entries)
+    """
+    sources = [0, 1, 2, 3]
+    tables = [np.arange(256, dtype=np.float64) for _ in CHANNELS]
+    for step in recipe:
+        step = dict(step)
+        name = step.pop("op", None)
+        if name == "swizzle":
+            order = _channel_indices(step.get("order", ""))
+            if len(order) != len(CHANNELS):
+                raise ValueError(f"swizzle order {step['order']!r} must name all four channels")
+            sources = [sources[index] for index in order]
+            tables = [tables[index] for index in order]
+            continue
+        operation = _OPERATIONS.get(name)
+        if operation is None:
+            raise ValueError(f"unknown recipe operation {name!r}")
+        for index in _channel_indices(step.pop("channels", CHANNELS)):
+            try:
+                tables[index] = operation(tables[index], **step)
+            except TypeError as e:
+                raise ValueError(f"bad arguments for {name}: {e}")
+    return [(source, np.clip(np.rint(table), 0, 255).astype(np.uint8)) for source, table in zip(sources, tables)]
+
+
+def recipe_hash(compiled):
+    """Hash of a compiled recipe; recipes that edit pixels the same way share it."""
+    digest = hashlib.sha1()
+    for source, table in compiled:
+        digest.update(bytes([source]))
+        digest.update(table.tobytes())
+    return digest.hexdigest()
+
+
+def load_recipe(path):
+    with open(path, "r") as f:
+        recipe = json.load(f)
+    compile_recipe(recipe)  # report mistakes before any file is touched
+    return recipe
+
+
+def apply_recipe(pixels, compiled, out=None):
+    """
+    Edit an (height, width, 4) uint8 array with a compiled recipe.
+
+    Rows are edited CHUNK_PIXELS at a time, each output channel with one
+    table lookup, so no float copy of the image is ever made.
+    """
+    if out is None:
+        out = np.empty_like(pixels)
+    rows = max(1, CHUNK_PIXELS // max(1, pixels.shape[1]))
+    for top in range(0, pixels.shape[0], rows):
+        band = pixels[top:top + rows]
+        for channel, (source, table) in enumerate(compiled):
+            np.take(table, band[:, :, source], out=out[top:top + rows, :, channel])
+    return out
+
+
+def _keeps_alpha(compiled):
+    source, table = compiled[3]
+    return source != 3 or not np.array_equal(table, np.arange(256))
+
+
+def edit_file(source, output, recipe):
+    """
+    Write the edited version of one texture to output as PNG.
+
+    Images without alpha stay RGB unless the recipe writes the alpha
+    channel. The file is written next to output and renamed over it.
+
+    :return: (size, mtime_ns) of the written output
+    """
+    compiled = compile_recipe(recipe)
+    if source.lower().endswith(".paa"):
+        image = paa.read_paa(source).to_image(0)
+    else:
+        image = Image.open(source)
+        image.load()
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+    pixels = apply_recipe(np.asarray(image.convert("RGBA")), compiled)
+    if not has_alpha and not _keeps_alpha(compiled):
+        edited = Image.fromarray(np.ascontiguousarray(pixels[:, :, :3]), "RGB")
+    else:
+        edited = Image.fromarray(pixels, "RGBA")
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    temp_path = output + ".tmp"
+    edited.save(temp_path, format="PNG")
+    os.replace(temp_path, output)
+    stat = os.stat(output)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class EditReport:
+    """Relative paths edited, up to date, kept as edited by hand, missing from the source, or failed with their error."""
+
+    def __init__(self):
+        self.edited = []
+        self.skipped = []
+        self.kept = []
+        self.missing = []
+        self.failed = []
+
+    def print_summary(self):
+        for rel_path in self.kept:
+            print(f"[kept] {rel_path}: changed since the last batch edit, use --force to overwrite")
+        for rel_path, error in self.failed:
+            print(f"[failed] {rel_path}: {error}")
+        print(f"{len(self.edited)} edited, {len(self.skipped)} up to date, {len(self.kept)} kept, "
+              f"{len(self.missing)} missing from source, {len(self.failed)} failed")
+
+
+def edit_tagged_images(recipe, tags_file, src_dir, dest_dir, manifest, tag="copy", force=False, max_workers=None):
+    """
+    Apply a recipe to every image selected by tag, writing dest_dir with the same relative paths.
+
+    Each output is recorded in the manifest with the hashes of its original
+    and of the compiled recipe, and its size and mtime. Outputs whose record
+    still matches are skipped; outputs changed since they were written, or
+    not written by this tool at all, are kept unless force is given.
+
+    :param recipe: list of operations, see the module docstring
+    :param manifest: Manifest to keep the records in; the caller saves it
+    :param tag: tag or expression selecting the images, see copy_tagged.compile_tag_filter
+    :param max_workers: worker processes, os.cpu_count() by default
+    :return: EditReport
+    """
+    compiled = compile_recipe(recipe)
+    expected_recipe = recipe_hash(compiled)
+    selected = compile_tag_filter(tag)
+    hashes = manifest.get("hashes", {})
+    records = manifest.get("edits", {})
+    report = EditReport()
+
+    with tracing.span("batch_edit", "stage"):
+        tags = load_tags(tags_file)
+        rel_paths = select_tag_paths(tags, selected, report.failed)
+
+        resolver = PathResolver(src_dir)
+        tasks = []
+        for rel_path in rel_paths:
+            source_rel_path = resolver.resolve(rel_path)
+            if source_rel_path is None:
+                report.missing.append(rel_path)
+                continue
+            source = os.path.join(src_dir, source_rel_path)
+            output_rel_path = os.path.splitext(source_rel_path)[0] + ".png"
+            output = os.path.join(dest_dir, output_rel_path)
+            expected = {"source": cached_file_hash(hashes, source), "recipe": expected_recipe}
+            record = records.get(output_rel_path)
+            try:
+                stat = os.stat(output)
+            except FileNotFoundError:
+                stat = None
+            if stat is not None and not force:
+                if record is None or (record["size"], record["mtime"]) != (stat.st_size, stat.st_mtime_ns):
+                    report.kept.append(output_rel_path)
+                    continue
+                if record["source"] == expected["source"] and record["recipe"] == expected["recipe"]:
+                    report.skipped.append(output_rel_path)
+                    continue
+            tasks.append((output_rel_path, source, output, expected))
+
+        if tasks:
+            with ProcessPoolExecutor(max_workers) as executor:
+                futures = [(output_rel_path, expected, executor.submit(edit_file, source, output, recipe))
+                           for output_rel_path, source, output, expected in tasks]
+                for output_rel_path, expected, future in futures:
+                    try:
+                        size, mtime = future.result()
+                    except Exception as e:
+                        report.failed.append((output_rel_path, f"{type(e).__name__}: {e}"))
+                        continue
+                    records[output_rel_path] = dict(expected, size=size, mtime=mtime)
+                    report.edited.append(output_rel_path)
+
+    manifest.set("hashes", hashes)
+    manifest.set("edits", records)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply a recipe of channel edits to the tagged images.")
+    parser.add_argument("recipe", help="JSON file with the list of operations")
+    parser.add_argument("--tags-file", default="tags.json")
+    parser.add_argument("--src", default="original")
+    parser.add_argument("--dest", default="edited")
+    parser.add_argument("--tag", default="copy", help='tag or expression, e.g. "copy AND NOT skip"')
+    parser.add_argument("--force", action="store_true", help="also overwrite outputs changed by hand")
+    parser.add_argument("--workers", type=int, help="worker processes, one per CPU by default")
+    args = parser.parse_args()
+
+    base_dir = os.path.dirname(os.path.realpath(__file__))
+    manifest = Manifest(os.path.join(base_dir, "build", EDIT_MANIFEST_NAME))
+    report = edit_tagged_images(load_recipe(args.recipe), args.tags_file, os.path.join(os.getcwd(), args.src),
+                                os.path.join(os.getcwd(), args.dest), manifest, tag=args.tag, force=args.force,
+                                max_workers=args.workers)
+    manifest.save()
+    report.print_summary()
@@ -0,0 +1,383 @@
+"""
+Benchmark suite for the modding pipeline.
+
+Times every stage against a synthetic tree from synthetic_corpus, writes the
+results as JSON and compares them with a stored baseline:
+
+    python benchmark.py --scale small --output bench_results.json
+    python benchmark.py --baseline bench_baseline.json --save-baseline
+    python benchmark.py --only sync_folders --baseline bench_baseline.json
+
+Each case is run --repeat times after untimed setup, and the median is kept.
+"""
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import types
+
+from conversion_utils import convert_paa_to_png, convert_png_to_paa
+from converter_backends import ToolBackend
+from copy_tagged import copy_tagged_images
+from image_cache import decode_image
+from process import copy_to_patched, sync_folders
+from synthetic_corpus import SCALES, make_corpus
+from tag_store import TagStore
+from tree_scan import TreeSnapshot, scan_tree
+
+STAND_IN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stand_in_converter.py")
+
+# Window size the viewer benchmarks render for
+VIEWER_SIZE = (1280, 960)
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    """Register a benchmark: func(corpus, work_dir, options) returning {case: result}."""
+    BENCHMARKS.append(func)
+    return func
+
+
+def measure(func, setup=None, repeat=3, items=None):
+    """Time func() repeat times, each after an untimed setup(); return the median and all runs."""
+    runs = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    result = {"seconds": statistics.median(runs), "runs": runs}
+    if items:
+        result["items"] = items
+        result["per_item_ms"] = result["seconds"] / items * 1000
+    return result
+
+
+def _reset(path):
+    shutil.rmtree(path, ignore_errors=True)
+
+
+@benchmark
+def bench_convert(corpus, work_dir, options):
+    """convert_* through the stand-in converter (copy mode, persistent workers) and natively."""
+    results = {}
+    count = corpus["textures"]
+    output_dir = os.path.join(work_dir, "converted")
+    stub = ToolBackend([sys.executable, STAND_IN, "--copy"], mode="persistent")
+    try:
+        results["convert_paa_to_png.stub"] = measure(
+            lambda: convert_paa_to_png(corpus["raw"], output_dir, backend=stub, progress=False),
+            setup=lambda: _reset(output_dir), repeat=options.repeat, items=count)
+        results["convert_png_to_paa.stub"] = measure(
+            lambda: convert_png_to_paa(corpus["extracted"], output_dir, backend=stub, progress=False),
+            setup=lambda: _reset(output_dir), repeat=options.repeat, items=count)
+    finally:
+        stub.close()
+    results["convert_paa_to_png.native"] = measure(
+        lambda: convert_paa_to_png(corpus["raw"], output_dir, progress=False),
+        setup=lambda: _reset(output_dir), repeat=options.repeat, items=count)
+    results["convert_png_to_paa.native"] = measure(
+        lambda: convert_png_to_paa(corpus["edited"], output_dir, progress=False),
+        setup=lambda: _reset(output_dir), repeat=options.repeat, items=(count + 3) // 4)
+    _reset(output_dir)
+    return results
+
+
+@benchmark
+def bench_sync(corpus, work_dir, options):
+    """sync_folders into an empty and an up to date tree, and the plain copy_to_patched."""
+    patched_dir = os.path.join(work_dir, "patched")
+    results = {
+        "sync_folders.cold": measure(lambda: sync_folders(corpus["raw"], patched_dir),
+                                     setup=lambda: _reset(patched_dir), repeat=options.repeat),
+        "sync_folders.noop": measure(lambda: sync_folders(corpus["raw"], patched_dir), repeat=options.repeat),
+        "copy_to_patched": measure(lambda: copy_to_patched(corpus["raw"], patched_dir),
+                                   setup=lambda: _reset(patched_dir), repeat=options.repeat),
+    }
+    _reset(patched_dir)
+    return results
+
+
+@benchmark
+def bench_copy_tagged(corpus, work_dir, options):
+    dest_dir = os.path.join(work_dir, "selected")
+    with open(corpus["tags"], "r") as f:
+        tagged = len(json.load(f))
+    results = {
+        "copy_tagged_images": measure(lambda: copy_tagged_images(corpus["tags"], corpus["extracted"], dest_dir),
+                                      setup=lambda: _reset(dest_dir), repeat=options.repeat, items=tagged),
+        "copy_tagged_images.noop": measure(lambda: copy_tagged_images(corpus["tags"], corpus["extracted"], dest_dir),
+                                           repeat=options.repeat, items=tagged),
+    }
+    _reset(dest_dir)
+    return results
+
+
+def _open_viewer(image_folder):
+    """Open a real ImageViewer on image_folder, or return None when there is no display."""
+    import tkinter as tk
+    from app import ImageViewer
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        return None
+    root.geometry(f"{VIEWER_SIZE[0]}x{VIEWER_SIZE[1]}")
+    root.update()
+    viewer = ImageViewer(root, image_folder)
+    while viewer.scanning:
+        root.update()
+        time.sleep(0.01)
+    return viewer
+
+
+def _load_all_with_tk(viewer, display_mode):
+    viewer.display_mode = display_mode
+    for index in range(len(viewer.all_image_files)):
+        viewer.image_cache.clear()
+        viewer.current_index = index
+        viewer.last_render_key = None
+        viewer.load_image()
+        viewer.tkRoot.update_idletasks()
+
+
+def _load_all_headless(paths, display_mode):
+    """Decode and render paths as load_image does, minus the Tk calls."""
+    from app import ImageViewer
+    settings = types.SimpleNamespace(display_mode=display_mode, render_mode="RGB",
+                                     reducing_gap=ImageViewer.reducing_gap)
+    window_width, window_height = VIEWER_SIZE
+    box = (window_width // 2, window_height // 2) if display_mode == "grid" else VIEWER_SIZE
+    for path in paths:
+        image = decode_image(path, box)
+        scale = min(window_width / image.width, window_height / image.height)
+        ImageViewer.render_frame(settings, image, int(image.width * scale), int(image.height * scale))
+
+
+def _files(root):
+    return [entry.path for entry in scan_tree(root)]
+
+
+@benchmark
+def bench_viewer(corpus, work_dir, options):
+    """
+    ImageViewer.load_image for every extracted texture in grid and single mode, cold image cache.
+
+    Without a display the Tk parts are left out and decode plus render_frame,
+    the bulk of load_image, are timed instead; "with_tk" in the results says
+    which was measured.
+    """
+    paths = [path for path in _files(corpus["extracted"]) if path.endswith(".png")]
+
+    # The viewer keeps tags.json and its caches in the working directory
+    previous_dir = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        viewer = _open_viewer(corpus["extracted"])
+        results = {}
+        for display_mode in ("grid", "single"):
+            if viewer is not None:
+                result = measure(lambda: _load_all_with_tk(viewer, display_mode),
+                                 repeat=options.repeat, items=len(viewer.all_image_files))
+            else:
+                result = measure(lambda: _load_all_headless(paths, display_mode),
+                                 repeat=options.repeat, items=len(paths))
+            result["with_tk"] = viewer is not None
+            results[f"viewer.load_image.{display_mode}"] = result
+        # The same textures opened straight from raw/, decoding only the mipmap the window needs
+        textures = [path for path in _files(corpus["raw"]) if path.endswith(".paa")]
+        results["viewer.load_image.paa.single"] = measure(lambda: _load_all_headless(textures, "single"),
+                                                          repeat=options.repeat, items=len(textures))
+        if viewer is not None:
+            viewer.quit_viewer(None)
+            viewer.tkRoot.destroy()
+    finally:
+        os.chdir(previous_dir)
+    return results
+
+
+def _make_tree(root, count):
+    """count empty files, 100 per directory, laid out like extracted mods."""
+    extensions = (".paa", ".p3d", ".rvmat", ".png")
+    for index in range(0, count, 100):
+        directory = os.path.join(root, f"mod_{index // 10_000}", f"addon_{index // 1000 % 10}", f"data_{index // 100 % 10}")
+        os.makedirs(directory, exist_ok=True)
+        for i in range(min(100, count - index)):
+            open(os.path.join(directory, f"file_{i}{extensions[i % 4]}"), "wb").close()
+
+
+def _os_walk_files(root, extension, stat):
+    """The walk the stages used before tree_scan: os.walk, then relpath and maybe os.stat per file."""
+    found = {}
+    for dirpath, dirs, files in os.walk(root):
+        for name in files:
+            if extension and not name.endswith(extension):
+                continue
+            full_path = os.path.join(dirpath, name)
+            found[os.path.relpath(full_path, root)] = os.stat(full_path) if stat else full_path
+    return found
+
+
+@benchmark
+def bench_scan(corpus, work_dir, options):
+    """
+    Walking a tree of 500k empty files (50k with --quick): os.walk as the stages
+    did before, tree_scan.scan_tree, and a second stage reusing a TreeSnapshot.
+    """
+    count = 50_000 if options.quick else 500_000
+    root = os.path.join(work_dir, "scan_tree")
+    _make_tree(root, count)
+    results = {}
+    for extension, label in ((".paa", "paa"), (None, "all")):
+        results[f"scan.os_walk.{label}"] = measure(lambda: _os_walk_files(root, extension, False), repeat=options.repeat)
+        results[f"scan.scan_tree.{label}"] = measure(lambda: sum(1 for _ in scan_tree(root, extension)),
+                                                     repeat=options.repeat)
+    results["scan.os_walk.stat"] = measure(lambda: _os_walk_files(root, None, True), repeat=options.repeat)
+    results["scan.scan_tree.stat"] = measure(lambda: sum(1 for _ in scan_tree(root, stat=True)), repeat=options.repeat)
+    snapshot = TreeSnapshot()
+    snapshot.listings(root)
+    results["scan.snapshot.paa"] = measure(lambda: sum(1 for _ in scan_tree(root, ".paa", snapshot=snapshot)),
+                                           repeat=options.repeat)
+    for result in results.values():
+        result["files"] = count
+    shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def _tags(count):
+    return {f"CUP\\weapons\\mod_{i // 1000}\\data\\texture_{i}_co.png": ["copy"] for i in range(count)}
+
+
+@benchmark
+def bench_tags(corpus, work_dir, options):
+    """
+    Saving tags at 10k, 100k and 1M tagged images.
+
+    "legacy" is the old save_tags, a full indented rewrite of tags.json on
+    every key press. "journal" is one TagStore toggle plus its journal flush,
+    averaged over 100 toggles, and "compact" folds the journal back into
+    tags.json.
+    """
+    results = {}
+    counts = (10_000, 100_000) if options.quick else (10_000, 100_000, 1_000_000)
+    for count in counts:
+        tags = _tags(count)
+        path = os.path.join(work_dir, f"tags_{count}.json")
+
+        def legacy_save():
+            with open(path, "w") as f:
+                json.dump(tags, f, indent=4)
+
+        results[f"save_tags.legacy.{count}"] = measure(legacy_save, repeat=options.repeat)
+        store = TagStore(path, flush_interval=3600, compact_after=10 ** 9)
+        try:
+            images = list(tags)[:100]
+
+            def journal_toggles():
+                for image in images:
+                    store.toggle(image, "skip")
+                    store.flush()
+
+            results[f"save_tags.journal.{count}"] = measure(journal_toggles, repeat=options.repeat, items=len(images))
+            results[f"save_tags.compact.{count}"] = measure(store.compact, repeat=options.repeat)
+        finally:
+            store.close()
+        for name in os.listdir(work_dir):
+            if name.startswith(f"tags_{count}.json"):
+                os.remove(os.path.join(work_dir, name))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print each case against the baseline; return the names that got slower than threshold."""
+    regressions = []
+    print(f"{'case':<36} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, result in sorted(results.items()):
+        current = result["seconds"]
+        before = baseline.get(name, {}).get("seconds")
+        if before is None:
+            print(f"{name:<36} {'-':>10} {current:>10.4f} {'new':>8}")
+            continue
+        change = (current - before) / before if before else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  SLOWER"
+            regressions.append(name)
+        elif change < -threshold:
+            flag = "  faster"
+        print(f"{name:<36} {before:>10.4f} {current:>10.4f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the modding pipeline on a synthetic tree.")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--corpus", help="directory to generate or reuse the synthetic tree in")
+    parser.add_argument("--only", action="append", help="glob of benchmark functions or cases to run")
+    parser.add_argument("--quick", action="store_true", help="skip the 1M tags case")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="also write the results to --baseline")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative slowdown reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    options = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="pipeline_bench_")
+    corpus_dir = options.corpus or os.path.join(work_dir, "corpus")
+    try:
+        start = time.perf_counter()
+        corpus = make_corpus(corpus_dir, options.scale)
+        print(f"Corpus: {corpus['textures']} textures in {corpus_dir} ({time.perf_counter() - start:.1f} s)")
+
+        results = {}
+        for func in BENCHMARKS:
+            if options.only and not any(fnmatch.fnmatch(func.__name__, pattern) for pattern in options.only):
+                continue
+            cases = func(corpus, work_dir, options)
+            for name, result in cases.items():
+                print(f"{name:<36} {result['seconds']:>10.4f} s")
+            results.update(cases)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    document = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "scale": options.scale,
+            "repeat": options.repeat,
+        },
+        "results": results,
+    }
+    with open(options.output, "w") as f:
+        json.dump(document, f, indent=4)
+    print(f"Results written to {options.output}")
+
+    regressions = []
+    if options.baseline and os.path.exists(options.baseline):
+        with open(options.baseline, "r") as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("scale") != options.scale:
+            print(f"Baseline was recorded at scale {baseline.get('meta', {}).get('scale')}, not {options.scale}")
+        regressions = compare(results, baseline.get("results", {}), options.threshold)
+    if options.baseline and options.save_baseline:
+        with open(options.baseline, "w") as f:
+            json.dump(document, f, indent=4)
+        print(f"Baseline written to {options.baseline}")
+
+    if regressions and options.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Measure the per-file overhead of the converter backend modes.
+
+Runs stand_in_converter.py in --copy mode over small files, so the timings
+are almost entirely process launches and protocol round trips:
+
+    python benchmark_backends.py [--files 200] [--threads 1]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from conversion_utils import convert_paa_to_png
+from converter_backends import ToolBackend
+
+STAND_IN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stand_in_converter.py")
+
+
+def run_mode(mode, input_dir, output_dir, threads):
+    """Convert every file of input_dir through one ToolBackend mode; return seconds per file."""
+    shutil.rmtree(output_dir, ignore_errors=True)
+    backend = ToolBackend([sys.executable, STAND_IN, "--copy"], mode=mode)
+    try:
+        start = time.perf_counter()
+        report = convert_paa_to_png(input_dir, output_dir, max_threads=threads, backend=backend, progress=False)
+        elapsed = time.perf_counter() - start
+    finally:
+        backend.close()
+    if report.failed:
+        raise RuntimeError(f"{mode}: {report.failed[0].error}")
+    return elapsed / len(report.results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="backend_bench_")
+    try:
+        input_dir = os.path.join(work_dir, "in")
+        for i in range(args.files):
+            subdir = os.path.join(input_dir, f"dir{i % 10}")
+            os.makedirs(subdir, exist_ok=True)
+            with open(os.path.join(subdir, f"texture{i}_co.paa"), "wb") as f:
+                f.write(os.urandom(1024))
+
+        print(f"{args.files} files, {args.threads} worker threads")
+        for mode in ("single", "batch", "persistent"):
+            per_file = run_mode(mode, input_dir, os.path.join(work_dir, mode), args.threads)
+            print(f"{mode:>10}: {per_file * 1000:7.2f} ms per file")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""Pure Python codecs for the LZO1X and LZSS streams used in PAA and PBO files."""
+
+
+# LZSS back references reach at most this many bytes
+LZSS_WINDOW = 4096
+
+
+class DecompressionError(Exception):
+    """Raised when a compressed stream is truncated or malformed."""
+
+
+def _copy_match(dst, distance, length):
+    """Append `length` bytes starting `distance` bytes back, allowing overlap."""
+    start = len(dst) - distance
+    if start < 0:
+        raise DecompressionError("match points before start of output")
+    if distance >= length:
+        dst += dst[start:start + length]
+        return
+    # Overlapping copy: repeat the pattern until the run is long enough
+    pattern = dst[start:]
+    repeats = length // distance + 1
+    dst += (pattern * repeats)[:length]
+
+
+def _read_run(src, ip, base):
+    """Read an LZO zero-extended length; return (length, new_ip)."""
+    zeros = 0
+    while src[ip] == 0:
+        zeros += 1
+        ip += 1
+    return zeros * 255 + base + src[ip], ip + 1
+
+
+def lzo1x_decompress(src, out_len):
+    """
+    Decompress an LZO1X stream.
+
+    :param src: compressed bytes
+    :param out_len: expected size of the decompressed data
+    :return: decompressed bytes
+    """
+    dst = bytearray()
+    ip = 0
+    state = 0
+
+    try:
+        t = src[ip]
+        if t > 17:
+            # First literal run is encoded directly in the first byte
+            ip += 1
+            t -= 17
+            dst += src[ip:ip + t]
+            ip += t
+            state = 4 if t >= 4 else t
+
+        while True:
+            t = src[ip]
+            ip += 1
+
+            if t < 16:
+                if state == 0:
+                    # Literal run
+                    if t == 0:
+                        t, ip = _read_run(src, ip, 15)
+                    t += 3
+                    dst += src[ip:ip + t]
+                    ip += t
+                    state = 4
+                    continue
+                elif state != 4:
+                    # Two byte match right after a short literal run
+                    distance = 1 + (t >> 2) + (src[ip] << 2)
+                    ip += 1
+                    length = 2
+                else:
+                    # Three byte match right after a long literal run
+                    distance = 1 + 0x0800 + (t >> 2) + (src[ip] << 2)
+                    ip += 1
+                    length = 3
+                nxt = t & 3
+            elif t >= 64:
+                distance = 1 + ((t >> 2) & 7) + (src[ip] << 3)
+                ip += 1
+                length = (t >> 5) + 1
+                nxt = t & 3
+            elif t >= 32:
+                length = t & 31
+                if length == 0:
+                    length, ip = _read_run(src, ip, 31)
+                length += 2
+                ds = src[ip] | (src[ip + 1] << 8)
+                ip += 2
+                distance = 1 + (ds >> 2)
+                nxt = ds & 3
+            else:
+                length = t & 7
+                if length == 0:
+                    length, ip = _read_run(src, ip, 7)
+                length += 2
+                ds = src[ip] | (src[ip + 1] << 8)
+                ip += 2
+                distance = ((t & 8) << 11) + (ds >> 2)
+                if distance == 0:
+                    # End of stream marker
+                    break
+                distance += 0x4000
+                nxt = ds & 3
+
+            _copy_match(dst, distance, length)
+
+            # Up to three literals trail every match
+            state = nxt
+            if nxt:
+                dst += src[ip:ip + nxt]
+                ip += nxt
+    except IndexError:
+        raise DecompressionError("LZO stream is truncated")
+
+    if len(dst) != out_len:
+        raise DecompressionError(f"LZO stream produced {len(dst)} bytes, expected {out_len}")
+    return bytes(dst)
+
+
+def iter_lzss_decompress(src, out_len, offset=0, chunk_size=1 << 16, check=False):
+    """
+    Decompress a Bohemia LZSS stream incrementally.
+
+    Only the 4 KiB sliding window plus one chunk is held in memory, so large
+    entries can be streamed straight to disk.
+
+    :param src: buffer holding the compressed bytes
+    :param out_len: expected size of the decompressed data
+    :param offset: position in `src` where the stream starts
+    :param chunk_size: approximate size of the yielded chunks
+    :param check: verify the trailing checksum against the decompressed bytes
+    :return: generator of decompressed byte chunks
+    """
+    window = bytearray()
+    flushed = 0
+    checksum = 0
+    ip = offset
+
+    try:
+        while flushed + len(window) < out_len:
+            flags = src[ip]
+            ip += 1
+            for bit in range(8):
+                produced = flushed + len(window)
+                if produced >= out_len:
+                    break
+                if flags & (1 << bit):
+                    window.append(src[ip])
+                    ip += 1
+                    continue
+                b1 = src[ip]
+                b2 = src[ip + 1]
+                ip += 2
+                distance = b1 | ((b2 & 0xF0) << 4)
+                length = (b2 & 0x0F) + 3
+                # Positions before the start of the output read as spaces
+                before = distance - produced
+                if before > 0:
+                    pad = min(before, length)
+                    window += b" " * pad
+                    length -= pad
+                if length:
+                    _copy_match(window, distance, length)
+
+            if len(window) >= chunk_size + LZSS_WINDOW:
+                chunk = bytes(window[:-LZSS_WINDOW])
+                del window[:-LZSS_WINDOW]
+                flushed += len(chunk)
+                if check:
+                    checksum += sum(chunk)
+                yield chunk
+    except IndexError:
+        raise DecompressionError("LZSS stream is truncated")
+
+    # Matches may overshoot the expected size by a few bytes
+    del window[out_len - flushed:]
+    if check:
+        checksum += sum(window)
+        expected = int.from_bytes(src[ip:ip + 4], "little")
+        if checksum & 0xFFFFFFFF != expected:
+            raise DecompressionError("LZSS checksum mismatch")
+    if window:
+        yield bytes(window)
+
+
+def lzss_decompress(src, out_len, offset=0, check=False):
+    """
+    Decompress a Bohemia LZSS stream followed by its 4 byte checksum.
+
+    :param src: buffer holding the compressed bytes
+    :param out_len: expected size of the decompressed data
+    :param offset: position in `src` where the stream starts
+    :param check: verify the trailing checksum against the decompressed bytes
+    :return: decompressed bytes
+    """
+    return b"".join(iter_lzss_decompress(src, out_len, offset, check=check))
+
+
+def _emit_length(dst, length):
+    """Append an LZO zero-extended length."""
+    while length > 255:
+        dst.append(0)
+        length -= 255
+    dst.append(length)
+
+
+def _emit_literals(dst, literals):
+    """Append a literal run, merging short runs into the previous match."""
+    count = len(literals)
+    if count == 0:
+        return
+    if not dst and count <= 238:
+        dst.append(count + 17)
+    elif count <= 3:
+        dst[-2] |= count
+    elif count <= 18:
+        dst.append(count - 3)
+    else:
+        dst.append(0)
+        _emit_length(dst, count - 18)
+    dst += literals
+
+
+def _emit_match(dst, length, distance):
+    """Append an LZO1X M2/M3/M4 match instruction."""
+    if length <= 8 and distance <= 0x0800:
+        distance -= 1
+        dst.append(((length - 1) << 5) | ((distance & 7) << 2))
+        dst.append(distance >> 3)
+        return
+
+    if distance <= 0x4000:
+        distance -= 1
+        if length <= 33:
+            dst.append(32 | (length - 2))
+        else:
+            dst.append(32)
+            _emit_length(dst, length - 33)
+    else:
+        distance -= 0x4000
+        high = (distance >> 11) & 8
+        if length <= 9:
+            dst.append(16 | high | (length - 2))
+        else:
+            dst.append(16 | high)
+            _emit_length(dst, length - 9)
+        distance &= 0x3FFF
+    dst.append((distance << 2) & 0xFF)
+    dst.append(distance >> 6)
+
+
+def _match_length(src, a, b, limit):
+    """Return how many bytes match between positions a and b, up to limit."""
+    length = 4
+    step = 32
+    while length < limit:
+        n = min(step, limit - length)
+        if src[a + length:a + length + n] == src[b + length:b + length + n]:
+            length += n
+            continue
+        if step == 1:
+            break
+        step = 1 if step <= 4 else step // 4
+    return length
+
+
+def lzo1x_compress(src):
+    """
+    Compress data into an LZO1X stream readable by lzo1x_decompress.
+
+    Uses a greedy single-candidate matcher, which trades some ratio for speed.
+    """
+    src = bytes(src)
+    n = len(src)
+    dst = bytearray()
+    table = {}
+    ip = 0
+    literal_start = 0
+
+    while ip < n - 4:
+        key = src[ip:ip + 4]
+        candidate = table.get(key)
+        table[key] = ip
+        if candidate is None or ip - candidate > 0xBFFF:
+            ip += 1
+            continue
+
+        length = _match_length(src, candidate, ip, n - ip)
+        _emit_literals(dst, src[literal_start:ip])
+        _emit_match(dst, length, ip - candidate)
+        ip += length
+        literal_start = ip
+
+    _emit_literals(dst, src[literal_start:])
+    dst += b"\x11\x00\x00"
+    return bytes(dst)
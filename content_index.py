@@ -0,0 +1,183 @@
+"""
+Content-addressed index of texture files.
+
+Mods often ship byte-identical textures at different paths, e.g. the same
+glass_ca in every CUP attachment. The index maps each content hash to all
+paths holding those bytes, so converters can handle each unique blob once
+and the viewer can show it once.
+
+    python content_index.py extracted edited
+"""
+import argparse
+import json
+import os
+
+from manifest import cached_file_hash
+from tree_scan import scan_tree
+
+INDEX_EXTENSIONS = ('.png', '.paa', '.jpg', '.jpeg')
+
+
+class ContentIndex:
+    """
+    Maps content hashes to the paths with that content.
+
+    Hashes come from manifest.cached_file_hash, cached by path, size and
+    mtime, and the cache can be kept on disk, so later runs only read new or
+    changed files. Not thread safe; use it from one thread at a time.
+
+    :param path: JSON file to keep the hash cache in, or None to keep it in memory
+    :param cache: existing hash cache dict to share, e.g. the build manifest's
+    """
+
+    def __init__(self, path=None, cache=None):
+        self.path = path
+        self.cache = cache if cache is not None else {}
+        self.paths = {}
+        self.hashes = {}
+        if path is not None and cache is None:
+            self.load()
+        else:
+            self._rebuild()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                self.cache = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.cache = {}
+        self._rebuild()
+
+    def save(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.cache, f, separators=(",", ":"))
+        os.replace(temp_path, self.path)
+
+    def _rebuild(self):
+        self.paths = {}
+        self.hashes = {}
+        for path, entry in self.cache.items():
+            self.hashes[path] = entry["hash"]
+            self.paths.setdefault(entry["hash"], []).append(path)
+
+    def add(self, path, stat=None):
+        """Hash path, or reuse its cached hash, and file it under that hash; returns the hash."""
+        digest = cached_file_hash(self.cache, path, stat)
+        previous = self.hashes.get(path)
+        if previous != digest:
+            if previous is not None:
+                self._unlink(path, previous)
+            self.hashes[path] = digest
+            self.paths.setdefault(digest, []).append(path)
+        return digest
+
+    def remove(self, path):
+        digest = self.hashes.pop(path, None)
+        self.cache.pop(path, None)
+        if digest is not None:
+            self._unlink(path, digest)
+
+    def _unlink(self, path, digest):
+        group = self.paths.get(digest, [])
+        if path in group:
+            group.remove(path)
+        if not group:
+            self.paths.pop(digest, None)
+
+    def index_files(self, paths):
+        """
+        Index a complete set of files, forgetting any other path.
+
+        Files whose size no other file shares cannot have a duplicate, so
+        they are left unhashed; only same-size files are read.
+        """
+        wanted = dict.fromkeys(paths)
+        for path in [path for path in self.hashes if path not in wanted]:
+            self.remove(path)
+
+        by_size = {}
+        for path in wanted:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            by_size.setdefault(stat.st_size, []).append((path, stat))
+        for entries in by_size.values():
+            if len(entries) < 2:
+                path = entries[0][0]
+                if path in self.hashes:
+                    self.remove(path)
+                continue
+            for path, stat in entries:
+                self.add(path, stat)
+
+    def scan(self, roots, extensions=INDEX_EXTENSIONS):
+        """Index the files with the given extensions under the root directories."""
+        paths = [entry.path for root in roots for entry in scan_tree(root)
+                 if entry.rel_path.lower().endswith(extensions)]
+        self.index_files(paths)
+
+    def duplicates(self, path):
+        """Return every indexed path with the same content as path, path included, in index order."""
+        digest = self.hashes.get(path)
+        if digest is None:
+            return [path]
+        return list(self.paths[digest])
+
+    def groups(self):
+        """Return {hash: paths} for the contents found at more than one path."""
+        return {digest: list(paths) for digest, paths in self.paths.items() if len(paths) > 1}
+
+
+def output_variant(output):
+    """
+    The part of an output path that decides its format: the extension and the texture suffix.
+
+    The converters pick the encoding from the name, e.g. DXT5 for any _ca
+    texture, so equal sources only share an output when these agree too.
+    """
+    stem, extension = os.path.splitext(os.path.basename(output).lower())
+    suffix = stem.rsplit("_", 1)[1] if "_" in stem else ""
+    return extension, suffix
+
+
+def dedupe_tasks(tasks, index, duplicates):
+    """
+    Yield the (source, output) pairs whose source content was not seen earlier for the same output_variant.
+
+    The others are collected in duplicates, keyed by the output of the first
+    such pair, for the caller to fill from that output.
+    """
+    firsts = {}
+    for source, output in tasks:
+        key = (index.add(source), output_variant(output))
+        first = firsts.get(key)
+        if first is None:
+            firsts[key] = output
+            yield source, output
+        else:
+            duplicates.setdefault(first, []).append((source, output))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report textures with identical content.")
+    parser.add_argument("roots", nargs="+")
+    parser.add_argument("--index", default="content_index.json", help="hash cache file")
+    parser.add_argument("--verbose", action="store_true", help="list the paths of every group")
+    args = parser.parse_args()
+
+    index = ContentIndex(args.index)
+    index.scan(args.roots)
+    index.save()
+
+    groups = index.groups()
+    redundant = sum(len(paths) - 1 for paths in groups.values())
+    wasted = sum(os.path.getsize(paths[0]) * (len(paths) - 1) for paths in groups.values())
+    if args.verbose:
+        for paths in sorted(groups.values(), key=len, reverse=True):
+            print(f"{len(paths)} copies:")
+            for path in paths:
+                print(f"    {path}")
+    print(f"{len(groups)} contents at more than one path, {redundant} redundant files "
+          f"({wasted / (1024 * 1024):.1f} MiB)")
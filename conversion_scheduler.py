@@ -0,0 +1,373 @@
+"""Streaming scheduler shared by the batch texture converters."""
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import tracing
+from tree_scan import scan_tree
+
+# started is a perf_counter value and worker the (pid, thread id) that ran the task
+ConversionResult = namedtuple(
+    "ConversionResult",
+    ["source", "output", "ok", "duration", "bytes_in", "bytes_out", "attempts", "error", "started", "worker"],
+)
+
+# Marks the end of discovery on the task queue
+_DONE = object()
+
+
+class ConversionError(Exception):
+    """Raised when a converter finishes without writing its output."""
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def run_conversion(func, source, output, args=(), retries=0):
+    """
+    Run func(source, output, *args), retrying failures, and describe the outcome.
+
+    Runs inside the worker, so it must stay a module level function for
+    process pools. A conversion only counts as done once `output` exists.
+
+    :return: ConversionResult
+    """
+    start = time.perf_counter()
+    worker = (os.getpid(), threading.get_ident())
+    error = None
+    attempts = 0
+    for attempts in range(1, retries + 2):
+        try:
+            os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+            func(source, output, *args)
+            if not os.path.exists(output):
+                raise ConversionError(f"{output} was not written")
+            return ConversionResult(source, output, True, time.perf_counter() - start,
+                                    _file_size(source), _file_size(output), attempts, None, start, worker)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+    return ConversionResult(source, output, False, time.perf_counter() - start,
+                            _file_size(source), 0, attempts, error, start, worker)
+
+
+def run_conversion_batch(func, pairs, args=(), retries=0):
+    """
+    Run func(pairs, *args) on a list of (source, output) pairs and describe each outcome.
+
+    Each output is checked on its own, so one bad file does not fail the
+    batch, and only the failed pairs are retried. The batch duration is
+    shared evenly between its files.
+
+    :return: list of ConversionResult, in the order of pairs
+    """
+    start = time.perf_counter()
+    worker = (os.getpid(), threading.get_ident())
+    outcomes = {}
+    remaining = list(pairs)
+    for attempts in range(1, retries + 2):
+        error = None
+        try:
+            for _, output in remaining:
+                os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+            func(remaining, *args)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        failed = []
+        for pair in remaining:
+            if os.path.exists(pair[1]):
+                outcomes[pair] = (True, attempts, None)
+            else:
+                outcomes[pair] = (False, attempts, error or f"ConversionError: {pair[1]} was not written")
+                failed.append(pair)
+        remaining = failed
+        if not remaining:
+            break
+
+    duration = (time.perf_counter() - start) / max(len(pairs), 1)
+    results = []
+    for i, (source, output) in enumerate(pairs):
+        ok, attempts, error = outcomes[(source, output)]
+        results.append(ConversionResult(source, output, ok, duration, _file_size(source),
+                                        _file_size(output) if ok else 0, attempts, error,
+                                        start + i * duration, worker))
+    return results
+
+
+def iter_conversion_tasks(input_dir, output_dir, source_ext, output_ext, existing="replace"):
+    """
+    Yield (source, output) pairs for the files under input_dir as they are found.
+
+    :param existing: "skip" leaves sources whose output already exists alone,
+        "newer" only those whose output is at least as new as the source,
+        "replace" deletes the old output before converting again
+    """
+    # One walk of the outputs instead of an exists check per source
+    newer = existing == "newer"
+    outputs = {entry.rel_path: entry.stat for entry in scan_tree(output_dir, output_ext, stat=newer)}
+    for entry in scan_tree(input_dir, source_ext, stat=newer):
+        output_rel_path = entry.rel_path[:-len(source_ext)] + output_ext
+        output = os.path.join(output_dir, output_rel_path)
+        if output_rel_path in outputs:
+            if existing == "skip":
+                continue
+            if newer:
+                # A stale output is left for the converter to write over
+                if outputs[output_rel_path].st_mtime_ns >= entry.stat.st_mtime_ns:
+                    continue
+            else:
+                os.remove(output)
+        yield entry.path, output
+
+
+def _cpu_saturated():
+    """True when the run queue is longer than the CPU count; unknown (False) where loadavg is missing."""
+    if not hasattr(os, "getloadavg"):
+        return False
+    return os.getloadavg()[0] > (os.cpu_count() or 1)
+
+
+def _failed_results(tasks, error, started):
+    """ConversionResults for tasks whose worker never reported back."""
+    return [ConversionResult(source, output, False, time.perf_counter() - started, _file_size(source), 0, 1, error,
+                             started, (0, 0))
+            for source, output in tasks]
+
+
+class ConversionReport:
+    """Results of one scheduler run."""
+
+    def __init__(self):
+        self.results = []
+        self.discovered = 0
+        # Results filled from the output of an identical source instead of converting
+        self.deduplicated = 0
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+
+    def add(self, result):
+        self.results.append(result)
+
+    @property
+    def succeeded(self):
+        return [r for r in self.results if r.ok]
+
+    @property
+    def failed(self):
+        return [r for r in self.results if not r.ok]
+
+    @property
+    def files_per_sec(self):
+        elapsed = self.elapsed or (time.perf_counter() - self.start)
+        return len(self.results) / elapsed if elapsed > 0 else 0.0
+
+    def progress_line(self, workers):
+        return (f"{len(self.results)}/{self.discovered} files, {self.files_per_sec:.1f} files/s, "
+                f"{len(self.failed)} failed, {workers} workers")
+
+    def print_summary(self):
+        for result in self.failed:
+            print(f"[failed] {result.source}: {result.error} ({result.attempts} attempts)")
+        megabytes = sum(r.bytes_out for r in self.results) / (1024 * 1024)
+        print(f"Converted {len(self.succeeded)} of {len(self.results)} files in {self.elapsed:.1f} s "
+              f"({self.files_per_sec:.1f} files/s, {megabytes:.1f} MiB written)")
+        if self.deduplicated:
+            print(f"{self.deduplicated} files had the same content as another and were linked or copied")
+
+
+class ConversionScheduler:
+    """
+    Converts files as discovery finds them.
+
+    A discovery thread fills a bounded queue, so conversion starts with the
+    first file and a huge tree never sits in memory as one task list. The
+    dispatcher keeps up to `workers` conversions in flight and adjusts that
+    limit by hill climbing on measured throughput: it keeps adding a worker
+    while files/sec improves and the CPUs are not saturated, and backs off
+    once an extra worker makes things slower, e.g. when the disk is the
+    bottleneck.
+
+    :param func: func(source, output, *args) converting one file; must be
+        picklable when executor is "process"
+    :param executor: "process" for CPU bound converters, "thread" for ones
+        that wait on external tools
+    :param retries: extra attempts for a failed file
+    :param progress: print a live progress line, or a callable taking the report
+    :param batch_size: tasks per submission; above 1, func is called as
+        func(pairs, *args) with a list of (source, output) pairs, see
+        run_conversion_batch
+    """
+
+    def __init__(self, func, args=(), executor="process", max_workers=None, min_workers=1,
+                 queue_size=256, retries=1, progress=True, progress_interval=1.0, adapt_interval=1.0,
+                 batch_size=1):
+        self.func = func
+        self.args = tuple(args)
+        self.batch_size = max(1, batch_size)
+        self.executor = executor
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.min_workers = min(min_workers, self.max_workers)
+        self.queue_size = queue_size
+        self.retries = retries
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self.adapt_interval = adapt_interval
+        self.workers = min(self.max_workers, os.cpu_count() or 1)
+
+    def _discover(self, tasks, task_queue, errors, stop):
+        def put(item):
+            # Give up once the dispatcher stopped taking tasks, rather than block on a full queue
+            while not stop.is_set():
+                try:
+                    task_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            with tracing.span("convert.discover", "walk"):
+                for task in tasks:
+                    if not put(task):
+                        return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            put(_DONE)
+
+    def _adapt(self, rate, backlog):
+        """One hill climbing step: rate is the files/sec of the last window."""
+        if not backlog:
+            # Throughput is limited by discovery, not by the workers
+            return
+        if self._last_rate is not None and rate < self._last_rate * 0.95:
+            self._direction = -self._direction
+        elif self._direction > 0 and _cpu_saturated():
+            self._direction = -1
+        self._last_rate = rate
+        self.workers = max(self.min_workers, min(self.max_workers, self.workers + self._direction))
+
+    def _report_progress(self, report, final=False):
+        if callable(self.progress):
+            self.progress(report)
+        elif self.progress:
+            print("\r" + report.progress_line(self.workers), end="\n" if final else "", flush=True)
+
+    def run(self, tasks):
+        """
+        Convert every (source, output) pair produced by the tasks iterable.
+
+        :return: ConversionReport with one ConversionResult per task
+        """
+        with tracing.span("convert", "stage") as stage:
+            report = self._run(tasks)
+            stage.add(files=len(report.results), bytes=sum(r.bytes_in + r.bytes_out for r in report.results))
+        return report
+
+    def _record_spans(self, results, submitted):
+        """Trace the files of a finished future; workers may be other processes, so they are timed there."""
+        for result in results:
+            tracing.record("convert.file", result.started, result.duration, pid=result.worker[0], tid=result.worker[1],
+                           bytes=result.bytes_in + result.bytes_out, queue_wait=max(0.0, result.started - submitted),
+                           ok=result.ok)
+
+    def _run(self, tasks):
+        report = ConversionReport()
+        task_queue = queue.Queue(self.queue_size)
+        errors = []
+        stop = threading.Event()
+        discovery = threading.Thread(target=self._discover, args=(iter(tasks), task_queue, errors, stop), daemon=True)
+        discovery.start()
+
+        self._last_rate = None
+        self._direction = 1
+        window_start = last_progress = time.perf_counter()
+        window_done = 0
+        discovering = True
+        in_flight = set()
+        submitted = {}
+        batch = []
+
+        executor_class = ProcessPoolExecutor if self.executor == "process" else ThreadPoolExecutor
+        executor = executor_class(self.max_workers)
+
+        def submit(tasks):
+            if self.batch_size == 1:
+                source, output = tasks[0]
+                future = executor.submit(run_conversion, self.func, source, output, self.args, self.retries)
+            else:
+                future = executor.submit(run_conversion_batch, self.func, tasks, self.args, self.retries)
+            in_flight.add(future)
+            submitted[future] = (time.perf_counter(), tasks)
+
+        try:
+            while discovering or in_flight or batch:
+                while discovering and len(in_flight) < self.workers:
+                    try:
+                        task = task_queue.get(timeout=0.05 if not in_flight else 0)
+                    except queue.Empty:
+                        break
+                    if task is _DONE:
+                        discovering = False
+                        break
+                    report.discovered += 1
+                    batch.append(tuple(task))
+                    if len(batch) >= self.batch_size:
+                        submit(batch)
+                        batch = []
+                # Send a partial batch rather than leave workers idle
+                if batch and len(in_flight) < self.workers and (not discovering or task_queue.empty()):
+                    submit(batch)
+                    batch = []
+
+                if in_flight:
+                    done, _ = wait(in_flight, timeout=0.1, return_when=FIRST_COMPLETED)
+                    if any(isinstance(future.exception(), BrokenExecutor) for future in done):
+                        # A worker died, e.g. killed for memory or crashed in native code, and took the
+                        # pool with it: every task still in the pool fails, the rest go to a fresh pool
+                        done, _ = wait(in_flight)
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        executor = executor_class(self.max_workers)
+                    in_flight.difference_update(done)
+                    for future in done:
+                        started, future_tasks = submitted.pop(future)
+                        try:
+                            results = future.result()
+                        except Exception as e:
+                            results = _failed_results(future_tasks, f"{type(e).__name__}: {e}", started)
+                        else:
+                            if self.batch_size == 1:
+                                results = [results]
+                        for result in results:
+                            report.add(result)
+                        if tracing.enabled():
+                            self._record_spans(results, started)
+                        window_done += len(results)
+
+                now = time.perf_counter()
+                # Windows with fewer completions than workers are too noisy to compare
+                if now - window_start >= self.adapt_interval and window_done >= self.workers:
+                    backlog = discovering and not task_queue.empty()
+                    self._adapt(window_done / (now - window_start), backlog)
+                    window_start = now
+                    window_done = 0
+                if self.progress and now - last_progress >= self.progress_interval:
+                    self._report_progress(report)
+                    last_progress = now
+        finally:
+            stop.set()
+            executor.shutdown()
+
+        discovery.join()
+        report.elapsed = time.perf_counter() - report.start
+        if self.progress:
+            self._report_progress(report, final=True)
+        if errors:
+            raise errors[0]
+        return report
@@ -1,103 +1,173 @@
 import os
-import subprocess
 import shutil
-from concurrent.futures import ThreadPoolExecutor
 
-def _convert_single_file_paa_to_png(full_path, output_file):
+import paa
+import psd
+from content_index import ContentIndex, dedupe_tasks
+from conversion_scheduler import ConversionResult, ConversionScheduler, iter_conversion_tasks
+from converter_backends import get_backend
+from tree_sync import place_file
+
+def _convert_with_backend(backend, full_path, output_file):
+    """Convert one file through a converter backend, closing it afterwards when it was created here from a name."""
+    converter = get_backend(backend)
+    try:
+        converter.convert(full_path, output_file)
+    finally:
+        if converter is not backend:
+            converter.close()
+
+def _convert_single_file_paa_to_png(full_path, output_file, backend="native"):
     """Convert a single .paa file to .png."""
-    cmd = ["Pal2PacE.exe", full_path, output_file]
-    subprocess.run(cmd)
-
-def convert_paa_to_png(input_dir, output_dir, max_threads=10):
-    """Batch convert .paa files to .png using multiple threads."""
+    if backend == "native":
+        paa.paa_to_png(full_path, output_file)
+        return
+
+    _convert_with_backend(backend, full_path, output_file)
+
+def _place_duplicates(report, duplicates, link):
+    """Fill the outputs of duplicate sources from the output converted for their content."""
+    for result in list(report.results):
+        for source, output in duplicates.get(result.output, ()):
+            if result.ok:
+                try:
+                    place_file(result.output, output, link)
+                    report.add(ConversionResult(source, output, True, 0.0, result.bytes_in, result.bytes_out,
+                                                0, None, result.started, result.worker))
+                    report.deduplicated += 1
+                    continue
+                except OSError as e:
+                    error = f"{type(e).__name__}: {e}"
+            else:
+                error = f"{result.error} (same content as {result.source})"
+            report.add(ConversionResult(source, output, False, 0.0, result.bytes_in, 0, 0, error,
+                                        result.started, result.worker))
+
+def _run_conversions(tasks, native_func, native_args, backend, tool, mode, max_threads, retries, progress,
+                     dedup=False, link="auto"):
+    """
+    Convert tasks natively on a process pool, or through a converter backend on threads.
+
+    Backends created here from a name are closed afterwards; backend objects
+    passed in are left open for the caller to reuse.
+
+    :param dedup: convert each unique source content once per output
+        format and place the result at the outputs of the other sources
+        with that content, see content_index.dedupe_tasks. Pass a
+        content_index.ContentIndex with a persistent cache, e.g.
+        ContentIndex(path) or the build manifest's hashes, so unchanged
+        sources are not hashed again; True hashes into an in-memory index
+        every run
+    :param link: how duplicate outputs are placed, see tree_sync.place_file
+    """
+    duplicates = {}
+    if dedup:
+        index = dedup if isinstance(dedup, ContentIndex) else ContentIndex()
+        tasks = dedupe_tasks(tasks, index, duplicates)
+
+    if backend == "native":
+        scheduler = ConversionScheduler(native_func, native_args, executor="process",
+                                        max_workers=max_threads, retries=retries, progress=progress)
+        report = scheduler.run(tasks)
+    else:
+        converter = get_backend(backend, tool, mode)
+        try:
+            batched = converter.batch_size > 1
+            scheduler = ConversionScheduler(converter.convert_batch if batched else converter.convert,
+                                            executor="thread", max_workers=max_threads, retries=retries,
+                                            progress=progress, batch_size=converter.batch_size)
+            report = scheduler.run(tasks)
+        finally:
+            if converter is not backend:
+                converter.close()
+
+    if duplicates:
+        _place_duplicates(report, duplicates, link)
+    return report
+
+def convert_paa_to_png(input_dir, output_dir, max_threads=10, backend="native", retries=1, progress=True,
+                       tool=None, mode="single", dedup=False):
+    """
+    Batch convert .paa files to .png, skipping ones already converted.
+
+    The native backend decodes in-process on a process pool. "pal2pac" runs
+    an external tool from a thread pool, see converter_backends.ToolBackend;
+    a ConverterBackend object may be passed too. Files are converted as they
+    are found, see conversion_scheduler.ConversionScheduler.
+
+    :param tool: converter path or command line, PAL2PAC_PATH by default
+    :param mode: "single", "batch" or "persistent" tool invocation
+    :param dedup: convert byte-identical sources once, see _run_conversions
+    :return: conversion_scheduler.ConversionReport
+    """
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-    
-    tasks = []
-
-    for root, dirs, files in os.walk(input_dir):
-        for file in files:
-            if file.endswith('.paa'):
-                full_path = os.path.join(root, file)
-                rel_path = os.path.relpath(root, input_dir)
-                output_subdir = os.path.join(output_dir, rel_path)
-                
-                if not os.path.exists(output_subdir):
-                    os.makedirs(output_subdir)
-                
-                output_file = os.path.join(output_subdir, file.replace('.paa', '.png'))
-                if os.path.exists(output_file):
-                    continue
-                
-                tasks.append((full_path, output_file))
 
-    with ThreadPoolExecutor(max_threads) as executor:
-        for task in tasks:
-            executor.submit(_convert_single_file_paa_to_png, task[0], task[1])
+    tasks = iter_conversion_tasks(input_dir, output_dir, '.paa', '.png', existing="skip")
+    return _run_conversions(tasks, _convert_single_file_paa_to_png, ("native",), backend, tool, mode,
+                            max_threads, retries, progress, dedup)
 
-def convert_psd_to_png(input_dir, output_dir, max_threads=10):
-    """Batch convert .png files to .paa using multiple threads."""
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    tasks = []
+def _convert_single_file_psd_to_png(full_path, output_file):
+    """Convert a single .psd file to .png."""
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    psd.psd_to_png(full_path, output_file)
 
-    for root, dirs, files in os.walk(input_dir):
-        for file in files:
-            if file.endswith('.psd'):
-                full_path = os.path.join(root, file)
-                rel_path = os.path.relpath(root, input_dir)
-                output_subdir = os.path.join(output_dir, rel_path)
-                
-                output_file_path = os.path.join(output_subdir, file.replace('.psd', '.png'))
+def convert_psd_to_png(input_dir, output_dir, max_threads=10, retries=1, progress=True, dedup=False):
+    """
+    Batch convert .psd files to .png, skipping ones whose .png is newer than the .psd.
 
-                if os.path.exists(output_file_path):
-                    os.remove(output_file_path)
+    Files are flattened in-process on a process pool, see psd.PsdFile.to_image.
 
-                # Add task to convert the temp png to paa
-                tasks.append((full_path, output_file_path))
+    :param dedup: convert byte-identical sources once, see _run_conversions
+    :return: conversion_scheduler.ConversionReport
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
 
-    with ThreadPoolExecutor(max_threads) as executor:
-        for task in tasks:
-            executor.submit(_convert_single_file_psd_to_png, task[0], task[1])
+    tasks = iter_conversion_tasks(input_dir, output_dir, '.psd', '.png', existing="newer")
+    return _run_conversions(tasks, _convert_single_file_psd_to_png, (), "native", None, "single",
+                            max_threads, retries, progress, dedup)
 
-def _convert_single_file_png_to_paa(full_path, output_file):
+def _convert_single_file_png_to_paa(full_path, output_file, backend="native", fit="range"):
     """Convert a single .png file to .paa."""
 
     # make sure path exists
     if not os.path.exists(os.path.dirname(output_file)):
         os.makedirs(os.path.dirname(output_file))
 
-    cmd = ["Pal2PacE.exe", full_path, output_file]
-    subprocess.run(cmd)
+    if backend == "native":
+        paa.png_to_paa(full_path, output_file, fit=fit)
+        return
 
-def convert_png_to_paa(input_dir, output_dir, max_threads=10):
-    """Batch convert .png files to .paa using multiple threads."""
+    _convert_with_backend(backend, full_path, output_file)
+
+def convert_png_to_paa(input_dir, output_dir, max_threads=10, backend="native", fit="range", retries=1, progress=True,
+                       tool=None, mode="single", dedup=False):
+    """
+    Batch convert .png files to .paa.
+
+    The native backend encodes in-process on a process pool. `fit` trades
+    speed for quality: "range" is fast, "cluster" searches harder for better
+    DXT endpoints. Other backends work as in convert_paa_to_png.
+
+    :return: conversion_scheduler.ConversionReport
+    """
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-    
-    tasks = []
-
-    for root, dirs, files in os.walk(input_dir):
-        for file in files:
-            if file.endswith('.png'):
-                full_path = os.path.join(root, file)
-                rel_path = os.path.relpath(root, input_dir)
-                output_subdir = os.path.join(output_dir, rel_path)
-                output_file_path = os.path.join(output_subdir, file.replace('.png', '.paa'))
-
-                if os.path.exists(output_file_path):
-                    os.remove(output_file_path)
-
-                if not os.path.exists(output_subdir):
-                    os.makedirs(output_subdir)
-                
-                # Add task to convert the temp png to paa
-                tasks.append((full_path, output_file_path))
-
-    with ThreadPoolExecutor(max_threads) as executor:
-        for task in tasks:
-            executor.submit(_convert_single_file_png_to_paa, task[0], task[1])
+
+    tasks = iter_conversion_tasks(input_dir, output_dir, '.png', '.paa', existing="replace")
+    return convert_files_png_to_paa(tasks, max_threads, backend, fit, retries, progress, tool, mode, dedup)
+
+def convert_files_png_to_paa(tasks, max_threads=10, backend="native", fit="range", retries=1, progress=True,
+                             tool=None, mode="single", dedup=False):
+    """
+    Convert (png path, paa path) pairs, see convert_png_to_paa.
+
+    :param tasks: any iterable, consumed while converting
+    :return: conversion_scheduler.ConversionReport
+    """
+    return _run_conversions(tasks, _convert_single_file_png_to_paa, ("native", fit), backend, tool, mode,
+                            max_threads, retries, progress, dedup)
 
 def create_temp_converted_folder(base_dir):
     """Create the temp/converted directory."""
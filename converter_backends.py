@@ -0,0 +1,189 @@
+"""External converter backends: one launch per file, batched launches, or persistent workers."""
+import os
+import queue
+import shlex
+import subprocess
+import tempfile
+import threading
+
+import tracing
+
+# Tool used by the "pal2pac" backend; PAL2PAC_PATH may hold a full command line
+PAL2PAC_PATH = os.environ.get("PAL2PAC_PATH", "Pal2PacE.exe")
+
+
+class ConverterError(Exception):
+    """Raised when an external converter reports a failure."""
+
+
+def _command(tool):
+    """Turn a tool path or command line (string or list) into an argument list."""
+    if isinstance(tool, (list, tuple)):
+        return list(tool)
+    if os.path.exists(tool):
+        return [tool]
+    return shlex.split(tool, posix=os.name != "nt")
+
+
+class ConverterBackend:
+    """
+    Interface of a converter usable by conversion_scheduler.
+
+    `convert` handles one file. Backends with `batch_size` above 1 also take
+    lists of (source, output) pairs through `convert_batch`; the scheduler
+    then submits whole batches and checks each output itself. `close`
+    releases anything the backend keeps running.
+    """
+
+    batch_size = 1
+
+    def convert(self, source, output):
+        raise NotImplementedError
+
+    def convert_batch(self, pairs):
+        for source, output in pairs:
+            self.convert(source, output)
+
+    def close(self):
+        pass
+
+
+class ToolBackend(ConverterBackend):
+    """
+    Runs an external converter such as Pal2PacE.
+
+    Modes:
+
+    - "single": one process per file, `tool source output`
+    - "batch": one process per `batch_size` files, listed one
+      ``source<TAB>output`` per line in a response file passed as
+      ``batch_args`` (``@{list}`` by default)
+    - "persistent": long running ``tool --serve`` processes, one per worker
+      thread, fed ``source<TAB>output`` lines on stdin and answering ``ok``
+      or ``error <message>`` per line, so decoders stay warm between files
+
+    Pal2PacE itself only supports "single"; the other modes are for tools
+    that implement the protocol, see stand_in_converter.py.
+    """
+
+    def __init__(self, tool=PAL2PAC_PATH, mode="single", batch_size=64, batch_args=("@{list}",),
+                 serve_args=("--serve",), timeout=None):
+        if mode not in ("single", "batch", "persistent"):
+            raise ValueError(f"unknown converter mode {mode}")
+        self.command = _command(tool)
+        self.mode = mode
+        self.batch_size = batch_size if mode == "batch" else 1
+        self.batch_args = list(batch_args)
+        self.serve_args = list(serve_args)
+        self.timeout = timeout
+        self._workers = queue.LifoQueue()
+        self._all_workers = []
+        self._lock = threading.Lock()
+
+    def convert(self, source, output):
+        if self.mode == "persistent":
+            self._convert_persistent(source, output)
+        elif self.mode == "batch":
+            self.convert_batch([(source, output)])
+        else:
+            with tracing.span("tool.launch", "subprocess"):
+                process = subprocess.Popen(self.command + [source, output], stdout=subprocess.PIPE,
+                                           stderr=subprocess.PIPE)
+            try:
+                _, stderr = process.communicate(timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.communicate()
+                raise
+            if process.returncode != 0:
+                message = stderr.decode(errors="replace").strip().splitlines()
+                raise ConverterError(f"exit code {process.returncode}" + (f": {message[-1]}" if message else ""))
+
+    def convert_batch(self, pairs):
+        if self.mode != "batch":
+            return super().convert_batch(pairs)
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False, encoding="utf-8") as f:
+            f.write("".join(f"{source}\t{output}\n" for source, output in pairs))
+            list_path = f.name
+        try:
+            args = [arg.replace("{list}", list_path) for arg in self.batch_args]
+            with tracing.span("tool.launch", "subprocess", files=len(pairs)):
+                process = subprocess.Popen(self.command + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            # Outputs are checked one by one, so a partly failed batch still counts its successes
+            try:
+                process.communicate(timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.communicate()
+        finally:
+            os.remove(list_path)
+
+    def _start_worker(self):
+        with tracing.span("tool.launch", "subprocess", persistent=True):
+            worker = subprocess.Popen(self.command + self.serve_args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                      text=True, encoding="utf-8", bufsize=1)
+        # stdout is read on a thread, so a hung worker can be timed out; the
+        # thread ends with an empty line at EOF
+        worker.replies = queue.Queue()
+        threading.Thread(target=self._read_replies, args=(worker,), daemon=True).start()
+        with self._lock:
+            self._all_workers.append(worker)
+        return worker
+
+    @staticmethod
+    def _read_replies(worker):
+        for line in worker.stdout:
+            worker.replies.put(line)
+        worker.replies.put("")
+
+    def _convert_persistent(self, source, output):
+        try:
+            worker = self._workers.get_nowait()
+        except queue.Empty:
+            worker = self._start_worker()
+        try:
+            worker.stdin.write(f"{source}\t{output}\n")
+            worker.stdin.flush()
+            reply = worker.replies.get(timeout=self.timeout).rstrip("\n")
+        except OSError as e:
+            worker.kill()
+            raise ConverterError(f"converter worker died: {e}")
+        except queue.Empty:
+            # A hung worker is not handed out again
+            worker.kill()
+            worker.wait()
+            raise subprocess.TimeoutExpired(worker.args, self.timeout)
+        if not reply:
+            # EOF: the worker exited, so do not hand it out again
+            raise ConverterError(f"converter worker exited with {worker.wait()}")
+        self._workers.put(worker)
+        if reply != "ok":
+            raise ConverterError(reply.partition(" ")[2] or reply)
+
+    def close(self):
+        with self._lock:
+            workers = self._all_workers
+            self._all_workers = []
+        for worker in workers:
+            if worker.poll() is None:
+                worker.stdin.close()
+                try:
+                    worker.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    worker.kill()
+        self._workers = queue.LifoQueue()
+
+
+def get_backend(backend, tool=None, mode="single"):
+    """
+    Resolve a backend argument of the conversion functions.
+
+    :param backend: a ConverterBackend, or "pal2pac" for a ToolBackend
+    :param tool: tool path or command line, PAL2PAC_PATH by default
+    :param mode: ToolBackend mode for "pal2pac"
+    """
+    if isinstance(backend, ConverterBackend):
+        return backend
+    if backend == "pal2pac":
+        return ToolBackend(tool or PAL2PAC_PATH, mode=mode)
+    raise ValueError(f"unknown converter backend {backend}")
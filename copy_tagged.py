@@ -1,44 +1,240 @@
-import json
+import argparse
 import os
-import shutil
+import re
+from concurrent.futures import ThreadPoolExecutor
 
-def copy_tagged_images(tags_file, src_dir, dest_dir, tag='copy'):
+import tracing
+from tag_store import load_tags
+from tree_sync import place_file
+
+_TOKEN_RE = re.compile(r"\s*(\(|\)|[^\s()]+)")
+
+
+def normalize_tag_path(image):
+    """
+    Turn a tag key, stored with either slash style (usually Windows backslashes), into a native relative path.
+
+    Leading slashes are dropped; a key with a ".." component or a drive such
+    as "C:", which would resolve outside the tree, raises ValueError.
+    """
+    parts = [part for part in re.split(r"[\\/]+", image) if part]
+    if not parts:
+        raise ValueError(f"empty tag key {image!r}")
+    if any(part == ".." or ":" in part for part in parts):
+        raise ValueError(f"tag key {image!r} points outside the tree")
+    return os.path.join(*parts)
+
+
+def select_tag_paths(tags, selected, failed):
+    """
+    Native relative paths of the tag keys whose tags match, sorted.
+
+    :param selected: compiled tag filter, see compile_tag_filter
+    :param failed: list that keys rejected by normalize_tag_path are appended to, as (key, error)
     """
-    Copy all files with the specified tag from source directory to destination directory, 
+    rel_paths = set()
+    for image, image_tags in tags.items():
+        if not selected(image_tags) or not image.strip("\\/"):
+            continue
+        try:
+            rel_paths.add(normalize_tag_path(image))
+        except ValueError as e:
+            failed.append((image, str(e)))
+    return sorted(rel_paths)
+
+
+class PathResolver:
+    """
+    Finds tag keys on disk under root, ignoring case where the spelling differs.
+
+    Tags written on Windows may differ in case from the files on disk, so a
+    path component that does not exist as written is matched ignoring case.
+    Each directory is listed once and the listing kept, so resolving many
+    keys costs one listing per directory they pass through.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.listings = {}
+
+    def _listing(self, rel_dir):
+        """(names, {lower cased name: name}) of one directory; empty when it cannot be listed."""
+        listing = self.listings.get(rel_dir)
+        if listing is None:
+            try:
+                names = sorted(os.listdir(os.path.join(self.root, rel_dir)))
+            except OSError:
+                names = []
+            folded = {}
+            for name in names:
+                folded.setdefault(name.lower(), name)
+            listing = self.listings[rel_dir] = (set(names), folded)
+        return listing
+
+    def resolve(self, rel_path):
+        """Return rel_path as it is spelled under root, or None when nothing matches."""
+        resolved = ""
+        for part in rel_path.split(os.sep):
+            names, folded = self._listing(resolved)
+            if part not in names:
+                part = folded.get(part.lower())
+                if part is None:
+                    return None
+            resolved = os.path.join(resolved, part) if resolved else part
+        return resolved
+
+
+def compile_tag_filter(expression):
+    """
+    Compile a tag expression into a predicate taking a list of tags.
+
+    Expressions combine tag names with AND, OR, NOT and parentheses, e.g.
+    "copy AND NOT skip" or "(copy OR review) AND NOT skip"; a lone tag name
+    selects the images carrying it. Operators are case insensitive.
+    """
+    tokens = _TOKEN_RE.findall(expression)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        token = peek()
+        if token is None:
+            raise ValueError(f"unexpected end of tag filter {expression!r}")
+        position += 1
+        return token
+
+    def parse_or():
+        terms = [parse_and()]
+        while (peek() or "").upper() == "OR":
+            take()
+            terms.append(parse_and())
+        return terms[0] if len(terms) == 1 else lambda tags: any(term(tags) for term in terms)
+
+    def parse_and():
+        terms = [parse_not()]
+        while (peek() or "").upper() == "AND":
+            take()
+            terms.append(parse_not())
+        return terms[0] if len(terms) == 1 else lambda tags: all(term(tags) for term in terms)
+
+    def parse_not():
+        if (peek() or "").upper() == "NOT":
+            take()
+            term = parse_not()
+            return lambda tags: not term(tags)
+        token = take()
+        if token == "(":
+            term = parse_or()
+            if take() != ")":
+                raise ValueError(f"missing ) in tag filter {expression!r}")
+            return term
+        if token == ")" or token.upper() in ("AND", "OR"):
+            raise ValueError(f"unexpected {token} in tag filter {expression!r}")
+        return lambda tags: token in tags
+
+    predicate = parse_or()
+    if position != len(tokens):
+        raise ValueError(f"unexpected {tokens[position]} in tag filter {expression!r}")
+    return predicate
+
+
+class CopyReport:
+    """Relative paths copied, skipped as up to date, missing from the source, or failed with their error."""
+
+    def __init__(self):
+        self.copied = []
+        self.skipped = []
+        self.missing = []
+        self.failed = []
+
+    def print_summary(self):
+        for rel_path, error in self.failed:
+            print(f"[failed] {rel_path}: {error}")
+        print(f"{len(self.copied)} copied, {len(self.skipped)} up to date, {len(self.missing)} missing from source, "
+              f"{len(self.failed)} failed")
+
+
+def _copy_if_changed(src_path, dest_path, link):
+    """Copy one file unless dest_path already matches it by size and mtime; returns "copied", "skipped" or "missing"."""
+    try:
+        src_stat = os.stat(src_path)
+    except FileNotFoundError:
+        return "missing"
+    try:
+        dest_stat = os.stat(dest_path)
+        if dest_stat.st_size == src_stat.st_size and dest_stat.st_mtime_ns == src_stat.st_mtime_ns:
+            return "skipped"
+    except FileNotFoundError:
+        pass
+    place_file(src_path, dest_path, link)
+    if tracing.enabled():
+        tracing.annotate(bytes=src_stat.st_size)
+    return "copied"
+
+
+def copy_tagged_images(tags_file, src_dir, dest_dir, tag='copy', link=None, max_threads=16):
+    """
+    Copy all files with the specified tag from source directory to destination directory,
     while preserving the relative directory structure.
 
+    Tag keys are found on disk ignoring case, see PathResolver, and copied
+    under the spelling found there. Copies run on a thread pool and skip
+    destinations whose size and mtime already match the source, so repeated
+    runs only copy what changed.
+
     :param tags_file: path to the tags.json file
     :param src_dir: source directory
     :param dest_dir: destination directory
-    :param tag: tag to filter images
+    :param tag: tag to filter images, or an expression such as "copy AND NOT skip", see compile_tag_filter
+    :param link: "reflink", "hardlink" or "auto" to link instead of copying where possible, see tree_sync.place_file
+    :return: CopyReport
     """
-    
-    # Load tags from the tags.json file
-    with open(tags_file, 'r') as f:
-        tags = json.load(f)
+    selected = compile_tag_filter(tag)
+    report = CopyReport()
 
-    # Filter images with the specified tag and copy them
-    for image, image_tags in tags.items():
-        if tag in image_tags:
-            # Determine the source and destination paths
-            src_path = os.path.join(src_dir, image)
-            dest_path = os.path.join(dest_dir, image)
-            
-            # Ensure the destination directory exists
-            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-            
-            if os.path.exists(src_path) == False:
-                continue
-            
-            # Copy the file
-            shutil.copy2(src_path, dest_path)
+    with tracing.span("copy_tagged", "stage"):
+        # Load tags from the tags.json file, including changes still in the viewer's journal
+        with tracing.span("copy_tagged.load_tags"):
+            tags = load_tags(tags_file)
+
+        # Keys written on Windows use backslashes and may differ in case from the disk
+        rel_paths = select_tag_paths(tags, selected, report.failed)
+        resolver = PathResolver(src_dir)
+
+        with ThreadPoolExecutor(max_threads) as executor:
+            futures = []
+            for rel_path in rel_paths:
+                source_rel_path = resolver.resolve(rel_path)
+                if source_rel_path is None:
+                    report.missing.append(rel_path)
+                    continue
+                futures.append((source_rel_path, tracing.submit(
+                    executor, "copy_tagged.file", _copy_if_changed, os.path.join(src_dir, source_rel_path),
+                    os.path.join(dest_dir, source_rel_path), link)))
+            for rel_path, future in futures:
+                try:
+                    outcome = future.result()
+                except OSError as e:
+                    report.failed.append((rel_path, f"{type(e).__name__}: {e}"))
+                    continue
+                getattr(report, outcome).append(rel_path)
+    return report
 
 if __name__ == "__main__":
-    TAGS_FILE = 'tags.json'
-    SRC_DIR = "extracted"
-    DEST_DIR = "selected"
-    SRC_DIR = os.path.join(os.getcwd(), SRC_DIR)
-    DEST_DIR = os.path.join(os.getcwd(), DEST_DIR)
-    
-    copy_tagged_images(TAGS_FILE, SRC_DIR, DEST_DIR, tag='copy')
-    print(f"Files tagged with 'copy' have been copied from {SRC_DIR} to {DEST_DIR}.")
+    parser = argparse.ArgumentParser(description="Copy the tagged images to another directory.")
+    parser.add_argument("--tags-file", default="tags.json")
+    parser.add_argument("--src", default="extracted")
+    parser.add_argument("--dest", default="selected")
+    parser.add_argument("--tag", default="copy", help='tag or expression, e.g. "copy AND NOT skip"')
+    parser.add_argument("--link", choices=("auto", "reflink", "hardlink"), help="link instead of copying where possible")
+    args = parser.parse_args()
+
+    SRC_DIR = os.path.join(os.getcwd(), args.src)
+    DEST_DIR = os.path.join(os.getcwd(), args.dest)
+
+    report = copy_tagged_images(args.tags_file, SRC_DIR, DEST_DIR, tag=args.tag, link=args.link)
+    report.print_summary()
+    print(f"Files tagged with '{args.tag}' have been copied from {SRC_DIR} to {DEST_DIR}.")
@@ -0,0 +1,117 @@
+"""Precomputed index of the images the viewer may stop on."""
+import re
+from bisect import bisect_left, bisect_right, insort
+
+# Substrings of relative paths the viewer never stops on
+DEFAULT_IMAGE_FILTERS = [
+    'nohq.png',
+    'co.png',
+    'smdi.png',
+    'ao.png',
+    'as.png',
+    'nohq.paa',
+    'co.paa',
+    'smdi.paa',
+    'ao.paa',
+    'as.paa',
+    '\\UI\\',
+    '\\ui\\',
+    '\\icons\\',
+    '_body_',
+    'reticle',
+]
+
+
+def _normalize(path):
+    return path.replace("\\", "/")
+
+
+def compile_filters(filters):
+    """Compile substring filters into one regex; either slash style matches both."""
+    if not filters:
+        return None
+    return re.compile("|".join(re.escape(_normalize(f)) for f in filters))
+
+
+class EligibilityIndex:
+    """
+    Sorted arrays of eligible image indices.
+
+    Paths are matched against the filter regex once. Two sorted index lists
+    are kept, all valid images and valid images without tags, so switching
+    skip behaviour is O(1). Tag changes are a bisect and one list insert or
+    removal, and next/prev/count are O(log n) or better.
+
+    :param hidden: set of paths never stopped on, e.g. duplicates of an image shown elsewhere
+    """
+
+    def __init__(self, paths, filters=DEFAULT_IMAGE_FILTERS, tags=None, skip_tagged=True, hidden=None):
+        self.paths = paths
+        self.filter_re = compile_filters(filters)
+        self.skip_tagged = skip_tagged
+        self.hidden = hidden or set()
+        self.positions = {path: index for index, path in enumerate(paths)}
+        tags = tags or {}
+
+        self.valid = [self.is_path_valid(path) for path in paths]
+        self.valid_indices = [i for i, valid in enumerate(self.valid) if valid]
+        self.untagged_indices = [i for i in self.valid_indices if not tags.get(paths[i])]
+
+    def extend(self, paths, tags=None):
+        """Append newly found paths, extending the shared paths list in place."""
+        tags = tags or {}
+        for path in paths:
+            index = len(self.paths)
+            self.paths.append(path)
+            self.positions[path] = index
+            valid = self.is_path_valid(path)
+            self.valid.append(valid)
+            if valid:
+                self.valid_indices.append(index)
+                if not tags.get(path):
+                    self.untagged_indices.append(index)
+
+    def is_path_valid(self, path):
+        if path in self.hidden:
+            return False
+        return self.filter_re is None or not self.filter_re.search(_normalize(path))
+
+    @property
+    def active(self):
+        return self.untagged_indices if self.skip_tagged else self.valid_indices
+
+    def is_eligible(self, index):
+        active = self.active
+        position = bisect_left(active, index)
+        return position < len(active) and active[position] == index
+
+    def set_tagged(self, index, tagged):
+        """Record whether the image at index now has any tags."""
+        if not self.valid[index]:
+            return
+        position = bisect_left(self.untagged_indices, index)
+        present = position < len(self.untagged_indices) and self.untagged_indices[position] == index
+        if tagged and present:
+            del self.untagged_indices[position]
+        elif not tagged and not present:
+            insort(self.untagged_indices, index)
+
+    def next(self, index):
+        """Return the next eligible index after index, wrapping around, or None."""
+        active = self.active
+        if not active:
+            return None
+        position = bisect_right(active, index)
+        return active[position] if position < len(active) else active[0]
+
+    def prev(self, index):
+        """Return the previous eligible index before index, wrapping around, or None."""
+        active = self.active
+        if not active:
+            return None
+        position = bisect_left(active, index)
+        return active[position - 1] if position > 0 else active[-1]
+
+    def count(self):
+        """Number of images next/prev can currently reach."""
+        return len(self.active)
@@ -1,8 +1,72 @@
 import os
 import subprocess
 import shutil
+import sys
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import tracing
+from manifest import Manifest
+from pbo import PboError, PboReader
+from tree_scan import scan_tree
+
+MANIFEST_NAME = ".extract_manifest.json"
+
+def _file_state(path):
+    """[size, mtime_ns] of path, or None when it does not exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+def _outputs_intact(record, dest_dir):
+    """True when every file a manifest record lists is still in dest_dir as it was written."""
+    outputs = record.get("outputs")
+    if outputs is None:
+        return False
+    return all(_file_state(os.path.join(dest_dir, rel_path)) == state for rel_path, state in outputs.items())
+
+def extract_native(pbo_path, dest_dir, verify=False, include=None, exclude=None, manifest=None):
+    """
+    Extract a PBO straight into dest_dir under its prefix, without ExtractPbo.exe.
+
+    When a manifest is given, archives whose size, mtime, header hash and
+    filters match the last extraction are skipped, as long as the files it
+    wrote are still in dest_dir with the size and mtime they were written
+    with.
+
+    A corrupted or unreadable archive raises PboError or OSError instead of
+    being reported as skipped.
+
+    :return: True if the archive was extracted, False if it was unchanged and skipped
+    """
+    key = os.path.abspath(pbo_path)
+    stat = os.stat(pbo_path)
+    with PboReader(pbo_path) as reader:
+        fingerprint = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "header": reader.header_hash(),
+            "include": list(include or []),
+            "exclude": list(exclude or []),
+        }
+        if manifest is not None:
+            record = manifest.get(key)
+            if record is not None and {name: record.get(name) for name in fingerprint} == fingerprint \
+                    and _outputs_intact(record, dest_dir):
+                return False
+
+        if verify and not reader.verify():
+            raise PboError(f"{pbo_path} has a missing or wrong SHA1 checksum")
+        written = reader.extract_all(dest_dir, check=verify, include=include, exclude=exclude)
+        outputs = {os.path.relpath(path, dest_dir): _file_state(path) for path in written}
+        if tracing.enabled():
+            tracing.annotate(bytes=sum(state[0] for state in outputs.values()), files=len(written))
+
+    if manifest is not None:
+        manifest.set(key, dict(fingerprint, outputs=outputs))
+    return True
+
 def extract_and_move(pbo_path, extractor_path, dest_dir, src_dir):
     # Extract the PBO
     path_without_pbo = pbo_path[:-4]  # Remove the .pbo extension
@@ -13,14 +77,14 @@ def extract_and_move(pbo_path, extractor_path, dest_dir, src_dir):
     # Run the ExtractPbo.exe
     args = [extractor_path, "-P", pbo_path]
 
-    try:
-        subprocess.run(args, check=True)
+    with tracing.span("tool.launch", "subprocess"):
+        process = subprocess.Popen(args)
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, args)
+    with tracing.span("extract.move", "copy"):
         move_folder(path_without_pbo, dest_dir, src_dir)
-        if os.path.exists(path_without_pbo):
-            shutil.rmtree(path_without_pbo)
-    except subprocess.CalledProcessError:
-        # Just return if the PBO is corrupted
-        return
+    if os.path.exists(path_without_pbo):
+        shutil.rmtree(path_without_pbo)
 
 def move_folder(src_path, dest_dir, src_dir):
 
@@ -33,26 +97,59 @@ def move_folder(src_path, dest_dir, src_dir):
             shutil.copytree(full_dir_path, dest_path, dirs_exist_ok=True)
             shutil.rmtree(full_dir_path)
 
-def extract_and_move_pbo_files(src_dir, dest_dir, max_threads=30):
+def extract_and_move_pbo_files(src_dir, dest_dir, max_threads=30, backend="native", verify=False,
+                               include=None, exclude=None, incremental=True, manifest_path=None):
+    """
+    Extract every .pbo under src_dir into dest_dir.
+
+    The native backend streams entries from a memory mapped archive directly
+    to their final paths; backend="extractpbo" runs ExtractPbo.exe into a
+    temporary folder and moves the result.
+
+    :param include: glob patterns of entries to extract, e.g. ["*_ca.paa"]
+    :param exclude: glob patterns of entries to leave out, e.g. ["*/ui/*", "*/icons/*"]
+    :param incremental: skip archives unchanged since the last run, using the
+        manifest at manifest_path (dest_dir/.extract_manifest.json by default)
+    :return: list of (pbo_path, error) for the archives that could not be extracted
+    """
     # Path to the ExtractPbo.exe
     extractor_path = r"C:\Program Files (x86)\Mikero\DePboTools\bin\ExtractPbo.exe"
 
     # First, gather all the pbo files
-    pbo_files = []
-    for root, dirs, files in os.walk(src_dir):
-        for file in files:
-            if file.endswith(".pbo"):
-                pbo_files.append(os.path.join(root, file))
+    with tracing.span("extract.walk", "walk"):
+        pbo_files = [entry.path for entry in scan_tree(src_dir, ".pbo")]
 
-    with ThreadPoolExecutor(max_workers=max_threads) as executor:
-        # Submit tasks to extract and move
-        futures = [executor.submit(extract_and_move, pbo_path, extractor_path, dest_dir, src_dir) for pbo_path in pbo_files]
+    manifest = None
+    if backend == "native" and incremental:
+        manifest = Manifest(manifest_path or os.path.join(dest_dir, MANIFEST_NAME))
+
+    try:
+        with tracing.span("extract", "stage", archives=len(pbo_files)), ThreadPoolExecutor(max_workers=max_threads) as executor:
+            # Submit tasks to extract and move
+            if backend == "native":
+                futures = {tracing.submit(executor, "extract.pbo", extract_native, pbo_path, dest_dir, verify, include,
+                                          exclude, manifest): pbo_path
+                           for pbo_path in pbo_files}
+            else:
+                futures = {tracing.submit(executor, "extract.pbo", extract_and_move, pbo_path, extractor_path, dest_dir,
+                                          src_dir): pbo_path
+                           for pbo_path in pbo_files}
 
-        # Ensure all tasks are completed
-        for future in as_completed(futures):
-            future.result()
+            # Ensure all tasks are completed, reporting the archives that failed
+            failed = []
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except (PboError, OSError, subprocess.CalledProcessError) as e:
+                    failed.append((futures[future], e))
+                    print(f"[failed] {futures[future]}: {type(e).__name__}: {e}")
+    finally:
+        if manifest is not None:
+            manifest.save()
+    return failed
 
 if __name__ == "__main__":
     source_directory = "D:\\modding"
     destination_directory = "P:\\"
-    extract_and_move_pbo_files(source_directory, destination_directory)
+    if extract_and_move_pbo_files(source_directory, destination_directory):
+        sys.exit(1)
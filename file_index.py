@@ -0,0 +1,137 @@
+"""Persistent index of the image files under a directory tree."""
+import json
+import os
+import time
+
+from tree_scan import walk
+
+IMAGE_EXTENSIONS = ('png', 'jpg', 'jpeg', 'paa')
+
+
+class FileIndex:
+    """
+    Image file list of a tree, cached on disk with the mtime of every directory.
+
+    A directory's mtime changes whenever an entry directly inside it is
+    added, removed or renamed, so a rescan only lists the directories whose
+    mtime differs from the cached one and reuses the rest. Each directory
+    still costs one stat, which is far cheaper than listing it. Stats and
+    listings run on tree_scan's threads.
+
+    Paths are relative to the root, in os.walk order with sorted names.
+    """
+
+    def __init__(self, root, index_path, extensions=IMAGE_EXTENSIONS):
+        self.root = root
+        self.index_path = index_path
+        self.extensions = extensions
+        self.dirs = {}
+        self.last_scan = None
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.index_path, "r") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            data = {}
+        if data.get("root") == os.path.abspath(self.root) and data.get("extensions") == list(self.extensions):
+            self.dirs = data.get("dirs", {})
+        else:
+            self.dirs = {}
+
+    def save(self):
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({
+                "root": os.path.abspath(self.root),
+                "extensions": list(self.extensions),
+                "dirs": self.dirs,
+            }, f, separators=(",", ":"))
+        os.replace(temp_path, self.index_path)
+
+    def cached_files(self):
+        """Return the file list as of the last scan without touching the tree, or None if there is none."""
+        if "" not in self.dirs:
+            return None
+        files = []
+        self._walk_cached("", files)
+        return files
+
+    def _walk_cached(self, rel_dir, files):
+        stack = [rel_dir]
+        while stack:
+            rel_dir = stack.pop()
+            record = self.dirs.get(rel_dir)
+            if record is None:
+                continue
+            files.extend(os.path.join(rel_dir, name) for name in record["files"])
+            stack.extend(os.path.join(rel_dir, name) for name in reversed(record["dirs"]))
+
+    def _list_dir(self, path):
+        files = []
+        dirs = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        if not entry.is_symlink():
+                            dirs.append(entry.name)
+                    elif entry.name.lower().endswith(self.extensions):
+                        files.append(entry.name)
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            pass
+        files.sort()
+        dirs.sort()
+        return files, dirs
+
+    def _scan_dir(self, rel_dir):
+        """Return ((record, whether it was listed), subdirectories) for one directory, reusing the cached record."""
+        path = os.path.join(self.root, rel_dir)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return (None, False), []
+        record = self.dirs.get(rel_dir)
+        if record is not None and record["mtime"] == mtime:
+            return (record, False), record["dirs"]
+        names, subdirs = self._list_dir(path)
+        return ({"mtime": mtime, "files": names, "dirs": subdirs}, True), subdirs
+
+    def scan(self, on_batch=None):
+        """
+        Bring the index up to date with the tree and save it.
+
+        :param on_batch: called with the list of new relative paths of each
+            directory as it is reached, in final order
+        :return: the full list of relative paths
+        """
+        start = time.perf_counter()
+        scanned = 0
+        reused = 0
+        dirs = {}
+        files = []
+
+        for rel_dir, (record, listed) in walk(self.root, self._scan_dir):
+            if record is None:
+                continue
+            if listed:
+                scanned += 1
+            else:
+                reused += 1
+            dirs[rel_dir] = record
+
+            batch = [os.path.join(rel_dir, name) for name in record["files"]]
+            files.extend(batch)
+            if batch and on_batch is not None:
+                on_batch(batch)
+
+        self.dirs = dirs
+        self.save()
+        self.last_scan = {
+            "dirs_scanned": scanned,
+            "dirs_reused": reused,
+            "files": len(files),
+            "seconds": time.perf_counter() - start,
+        }
+        return files
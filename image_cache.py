@@ -0,0 +1,204 @@
+"""Memory bounded cache of decoded images and a background prefetcher for the viewer."""
+import math
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+import paa
+
+
+def _fit_size(width, height, fit):
+    """Size of a width x height image scaled to fit the (width, height) box fit."""
+    scale = min(fit[0] / width, fit[1] / height)
+    return math.ceil(width * scale), math.ceil(height * scale)
+
+
+def decode_image(path, fit=None):
+    """
+    Open an image and force its pixel data to be decoded.
+
+    .paa textures are read directly. With fit, a (width, height) box, only
+    the smallest mipmap that still covers the texture scaled to fit the box
+    is read and decompressed; image.info then holds its "mipmap" index and
+    the "full_size" of the top level.
+    """
+    if path.lower().endswith(".paa"):
+        texture = paa.read_paa(path)
+        index = texture.mipmap_for_size(*_fit_size(texture.width, texture.height, fit)) if fit else 0
+        image = texture.to_image(index)
+        image.info["mipmap"] = index
+        image.info["full_size"] = (texture.width, texture.height)
+        return image
+    image = Image.open(path)
+    image.load()
+    return image
+
+
+def covers(image, fit):
+    """Whether a decoded image has enough detail to be shown scaled to fit the box fit."""
+    if fit is None or not image.info.get("mipmap"):
+        return True
+    width, height = _fit_size(*image.info["full_size"], fit)
+    return image.width >= width and image.height >= height
+
+
+def image_size_bytes(image):
+    """Approximate memory held by a decoded image."""
+    return image.width * image.height * len(image.getbands())
+
+
+def file_stamp(path):
+    """(mtime_ns, size) of path, or None when it cannot be read, to tell a rewritten file from the cached one."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class ImageCache:
+    """
+    Thread safe LRU cache of decoded images, bounded by total bytes.
+
+    A path being decoded by one thread is waited on by the others instead of
+    being decoded twice. Textures may be cached at a reduced mipmap; a get
+    for a larger box decodes them again, see covers.
+
+    Keys and values are up to the loader, called as loader(key, fit), and
+    sizer, which returns the bytes a value holds. stamp(key) versions an
+    entry: one whose stamp changed since it was cached is a miss, so a file
+    rewritten on disk is decoded again. Pass stamp=None for keys that carry
+    their own version, such as the tile keys of tiles.TileCache.
+    """
+
+    def __init__(self, max_bytes=512 * 1024 * 1024, loader=decode_image, sizer=image_size_bytes, stamp=file_stamp):
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self.sizer = sizer
+        self.stamp = stamp
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._stamps = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def _stamp(self, path):
+        return self.stamp(path) if self.stamp is not None else None
+
+    def _fresh(self, path, fit, stamp):
+        """Whether path is cached at stamp with enough detail for fit; call with the lock held."""
+        return path in self._items and self._stamps[path] == stamp and covers(self._items[path], fit)
+
+    def __contains__(self, path):
+        stamp = self._stamp(path)
+        with self._lock:
+            return path in self._items and self._stamps[path] == stamp
+
+    def has(self, path, fit=None):
+        stamp = self._stamp(path)
+        with self._lock:
+            return self._fresh(path, fit, stamp)
+
+    def get(self, path, fit=None):
+        """Return the decoded image for path, decoding it on a miss; fit is passed on to the loader."""
+        # Taken before decoding, so a rewrite during the decode is caught by the next get
+        stamp = self._stamp(path)
+        with self._lock:
+            if self._fresh(path, fit, stamp):
+                self._items.move_to_end(path)
+                self.hits += 1
+                return self._items[path]
+            event = self._in_flight.get(path)
+            owner = event is None
+            if owner:
+                event = self._in_flight[path] = threading.Event()
+            self.misses += 1
+
+        if not owner:
+            event.wait()
+            with self._lock:
+                if self._fresh(path, fit, stamp):
+                    return self._items[path]
+            # The other decode failed, was evicted straight away, was for a smaller box or an older version
+            return self.loader(path, fit)
+
+        try:
+            image = self.loader(path, fit)
+            self.put(path, image, stamp)
+            return image
+        finally:
+            with self._lock:
+                del self._in_flight[path]
+            event.set()
+
+    def put(self, path, image, stamp=None):
+        """Cache image for path, as of stamp; the current stamp of path by default."""
+        if stamp is None:
+            stamp = self._stamp(path)
+        size = self.sizer(image)
+        with self._lock:
+            if path in self._items:
+                self.total_bytes -= self.sizer(self._items.pop(path))
+                del self._stamps[path]
+            if size > self.max_bytes:
+                return
+            self._items[path] = image
+            self._stamps[path] = stamp
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                evicted_path, evicted = self._items.popitem(last=False)
+                del self._stamps[evicted_path]
+                self.total_bytes -= self.sizer(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._stamps.clear()
+            self.total_bytes = 0
+
+
+class Prefetcher:
+    """
+    Decodes images into an ImageCache on a background thread.
+
+    Each request replaces the previous one, so after fast navigation the
+    worker moves on to the images around the new position right away.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._pending = []
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def request(self, paths, fit=None):
+        """Decode paths in order, for display in the box fit, replacing any earlier request."""
+        with self._condition:
+            self._pending = [(path, fit) for path in paths if not self.cache.has(path, fit)]
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._pending = []
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                path, fit = self._pending.pop(0)
+            try:
+                self.cache.get(path, fit)
+            except Exception:
+                # Broken files are reported when the viewer actually opens them
+                pass
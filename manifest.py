@@ -0,0 +1,85 @@
+"""Persistent JSON manifests used to skip work whose inputs have not changed."""
+import hashlib
+import json
+import os
+import threading
+
+HASH_CHUNK = 1 << 20
+
+
+def hash_file(path):
+    """Return the SHA1 hex digest of a file's contents."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cached_file_hash(cache, path, stat=None):
+    """
+    Return the content hash of a file, rehashing only when its size or mtime changed.
+
+    :param cache: dict mapping paths to {"size", "mtime", "hash"}, updated in place
+    :param stat: os.stat_result for path if the caller already has one
+    """
+    if stat is None:
+        stat = os.stat(path)
+    entry = cache.get(path)
+    if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+        return entry["hash"]
+    digest = hash_file(path)
+    cache[path] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": digest}
+    return digest
+
+
+class Manifest:
+    """
+    A JSON dictionary on disk, safe to update from several threads.
+
+    Changes are kept in memory until `save`, which replaces the file
+    atomically so an interrupted run never leaves a half written manifest.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with self._lock:
+            with open(temp_path, "w") as f:
+                json.dump(self.entries, f)
+        os.replace(temp_path, self.path)
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self.entries.get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            self.entries[key] = value
+
+    def remove(self, key):
+        with self._lock:
+            self.entries.pop(key, None)
+
+    def keys(self):
+        with self._lock:
+            return list(self.entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self.entries
@@ -0,0 +1,687 @@
+"""Reader and writer for Arma PAA textures, with NumPy DXT block codecs."""
+import struct
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+from compression import lzo1x_compress, lzo1x_decompress, lzss_decompress
+
+PAX_DXT1 = 0xFF01
+PAX_DXT2 = 0xFF02
+PAX_DXT3 = 0xFF03
+PAX_DXT4 = 0xFF04
+PAX_DXT5 = 0xFF05
+PAX_ARGB4444 = 0x4444
+PAX_ARGB1555 = 0x1555
+PAX_ARGB8888 = 0x8888
+PAX_AI88 = 0x8080
+
+DXT_TYPES = (PAX_DXT1, PAX_DXT2, PAX_DXT3, PAX_DXT4, PAX_DXT5)
+
+# Bytes per pixel of the uncompressed formats
+PIXEL_SIZES = {
+    PAX_ARGB4444: 2,
+    PAX_ARGB1555: 2,
+    PAX_ARGB8888: 4,
+    PAX_AI88: 2,
+}
+
+LZO_FLAG = 0x8000
+
+# Mipmaps wider than this are LZO compressed when written
+LZO_MIN_WIDTH = 128
+
+# Channel weights used when measuring DXT endpoint error
+COLOR_WEIGHTS = np.array([1.0, 1.0, 1.0], dtype=np.float32)
+
+# Blocks processed at once by the cluster fit, bounds its memory use
+CLUSTER_CHUNK = 256
+
+Mipmap = namedtuple("Mipmap", ["width", "height", "compressed", "offset", "size"])
+
+
+class PaaError(Exception):
+    """Raised when a file is not a PAA texture this reader understands."""
+
+
+def mipmap_data_size(pax_type, width, height):
+    """Return the size in bytes of an uncompressed mipmap."""
+    if pax_type == PAX_DXT1:
+        return max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * 8
+    if pax_type in DXT_TYPES:
+        return max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * 16
+    return width * height * PIXEL_SIZES[pax_type]
+
+
+class PaaFile:
+    """
+    A parsed PAA texture.
+
+    Only the header and the mipmap table are read on open; pixel data is read
+    and decompressed per mipmap on demand.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tags = {}
+        self.palette = b""
+        self.mipmaps = []
+
+        with open(path, "rb") as f:
+            self._parse(f)
+
+    def _parse(self, f):
+        header = f.read(2)
+        if len(header) != 2:
+            raise PaaError(f"{self.path} is empty")
+        (self.type,) = struct.unpack("<H", header)
+        if self.type not in DXT_TYPES and self.type not in PIXEL_SIZES:
+            raise PaaError(f"{self.path} has unsupported PAA type 0x{self.type:04X}")
+
+        # TAGG sections: "GGAT" + reversed four character name + length + data
+        while True:
+            magic = f.read(4)
+            if magic != b"GGAT":
+                f.seek(-len(magic), 1)
+                break
+            name = f.read(4)[::-1].decode("ascii")
+            (length,) = struct.unpack("<I", f.read(4))
+            self.tags[name] = f.read(length)
+
+        (palette_count,) = struct.unpack("<H", f.read(2))
+        self.palette = f.read(palette_count * 3)
+
+        # Mipmap table: walk the headers and seek over the data
+        while True:
+            raw = f.read(4)
+            if len(raw) < 4:
+                break
+            width, height = struct.unpack("<HH", raw)
+            if width == 0 or height == 0:
+                break
+            size = int.from_bytes(f.read(3), "little")
+            compressed = None
+            if self.type in DXT_TYPES:
+                if width & LZO_FLAG:
+                    width &= ~LZO_FLAG
+                    compressed = "lzo"
+            elif size != mipmap_data_size(self.type, width, height):
+                compressed = "lzss"
+            self.mipmaps.append(Mipmap(width, height, compressed, f.tell(), size))
+            f.seek(size, 1)
+
+        if not self.mipmaps:
+            raise PaaError(f"{self.path} has no mipmaps")
+
+    @property
+    def width(self):
+        return self.mipmaps[0].width
+
+    @property
+    def height(self):
+        return self.mipmaps[0].height
+
+    def mipmap_for_size(self, width, height):
+        """Return the index of the smallest mipmap at least width x height, or 0 when even the top one is smaller."""
+        best = 0
+        for index, mip in enumerate(self.mipmaps):
+            if mip.width >= width and mip.height >= height:
+                best = index
+        return best
+
+    def read_mipmap_data(self, index=0):
+        """Return the decompressed raw data of a mipmap."""
+        mip = self.mipmaps[index]
+        with open(self.path, "rb") as f:
+            f.seek(mip.offset)
+            data = f.read(mip.size)
+
+        expected = mipmap_data_size(self.type, mip.width, mip.height)
+        if mip.compressed == "lzo":
+            data = lzo1x_decompress(data, expected)
+        elif mip.compressed == "lzss":
+            data = lzss_decompress(data, expected)
+        return data
+
+    def decode_region(self, index, x, y, width, height, data=None):
+        """
+        Decode part of a mipmap into a (height, width, 4) uint8 RGBA array.
+
+        The region is clamped to the mipmap. Uncompressed mipmaps are read
+        only for the rows of blocks the region touches; compressed ones must
+        be decompressed whole, so callers decoding several regions may pass
+        the result of read_mipmap_data as data.
+        """
+        mip = self.mipmaps[index]
+        x1 = min(x + width, mip.width)
+        y1 = min(y + height, mip.height)
+        x, y = max(0, x), max(0, y)
+        if x >= x1 or y >= y1:
+            return np.zeros((0, 0, 4), np.uint8)
+
+        if self.type in DXT_TYPES:
+            unit, unit_bytes = 4, 8 if self.type == PAX_DXT1 else 16
+        else:
+            unit, unit_bytes = 1, PIXEL_SIZES[self.type]
+        units_x = max(1, (mip.width + unit - 1) // unit)
+        row_bytes = units_x * unit_bytes
+        ux0, ux1 = x // unit, (x1 + unit - 1) // unit
+        uy0, uy1 = y // unit, (y1 + unit - 1) // unit
+
+        if data is None and mip.compressed is None:
+            with open(self.path, "rb") as f:
+                f.seek(mip.offset + uy0 * row_bytes)
+                rows = f.read((uy1 - uy0) * row_bytes)
+        else:
+            if data is None:
+                data = self.read_mipmap_data(index)
+            rows = data[uy0 * row_bytes:uy1 * row_bytes]
+        rows = np.frombuffer(rows, np.uint8).reshape(uy1 - uy0, row_bytes)
+        region = np.ascontiguousarray(rows[:, ux0 * unit_bytes:ux1 * unit_bytes])
+
+        pixels = decode_pixels(self.type, region.tobytes(), (ux1 - ux0) * unit, (uy1 - uy0) * unit)
+        return pixels[y - uy0 * unit:y1 - uy0 * unit, x - ux0 * unit:x1 - ux0 * unit]
+
+    def decode_mipmap(self, index=0):
+        """Decode a mipmap into a (height, width, 4) uint8 RGBA array."""
+        mip = self.mipmaps[index]
+        data = self.read_mipmap_data(index)
+        return decode_pixels(self.type, data, mip.width, mip.height)
+
+    def to_image(self, index=0):
+        """Decode a mipmap into a PIL RGBA image."""
+        return Image.fromarray(self.decode_mipmap(index), "RGBA")
+
+
+def _expand_565(colors):
+    """Expand an array of RGB565 values into (..., 3) uint16 RGB888."""
+    r = (colors >> 11) & 0x1F
+    g = (colors >> 5) & 0x3F
+    b = colors & 0x1F
+    return np.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], axis=-1)
+
+
+def _decode_color_blocks(blocks, four_color_only):
+    """
+    Decode (N, 8) DXT color blocks into (N, 16, 4) RGBA pixels.
+
+    :param four_color_only: DXT2-5 always interpolate four colors, DXT1 may use
+        the three color plus transparent black mode
+    """
+    c0 = blocks[:, 0].astype(np.uint16) | (blocks[:, 1].astype(np.uint16) << 8)
+    c1 = blocks[:, 2].astype(np.uint16) | (blocks[:, 3].astype(np.uint16) << 8)
+    p0 = _expand_565(c0)
+    p1 = _expand_565(c1)
+
+    palette = np.empty((len(blocks), 4, 4), dtype=np.uint16)
+    palette[:, 0, :3] = p0
+    palette[:, 1, :3] = p1
+    palette[:, :, 3] = 255
+
+    four_color = (c0 > c1)[:, None]
+    if four_color_only:
+        four_color = np.ones_like(four_color)
+    palette[:, 2, :3] = np.where(four_color, (2 * p0 + p1) // 3, (p0 + p1) // 2)
+    palette[:, 3, :3] = np.where(four_color, (p0 + 2 * p1) // 3, 0)
+    palette[:, 3, 3] = np.where(four_color[:, 0], 255, 0)
+
+    bits = blocks[:, 4:8].copy().view("<u4")[:, 0]
+    shifts = np.arange(16, dtype=np.uint32) * 2
+    indices = (bits[:, None] >> shifts) & 3
+    return np.take_along_axis(palette, indices[:, :, None].astype(np.intp), axis=1).astype(np.uint8)
+
+
+def _decode_dxt5_alpha(blocks):
+    """Decode (N, 8) DXT5 alpha blocks into (N, 16) alpha values."""
+    palette = _alpha_palettes(blocks[:, 0], blocks[:, 1])
+
+    # 48 bits of 3-bit indices
+    raw = np.zeros((len(blocks), 8), dtype=np.uint8)
+    raw[:, :6] = blocks[:, 2:8]
+    bits = raw.view("<u8")[:, 0]
+    shifts = np.arange(16, dtype=np.uint64) * 3
+    indices = ((bits[:, None] >> shifts) & 7).astype(np.intp)
+    return np.take_along_axis(palette, indices, axis=1).astype(np.uint8)
+
+
+def _decode_dxt3_alpha(blocks):
+    """Decode (N, 8) DXT3 explicit alpha blocks into (N, 16) alpha values."""
+    low = blocks & 0x0F
+    high = blocks >> 4
+    alpha = np.stack([low, high], axis=-1).reshape(len(blocks), 16)
+    return (alpha * 17).astype(np.uint8)
+
+
+def _blocks_to_image(pixels, width, height, blocks_x, blocks_y):
+    """Rearrange (N, 16, 4) block pixels into a cropped (height, width, 4) image."""
+    image = pixels.reshape(blocks_y, blocks_x, 4, 4, 4).transpose(0, 2, 1, 3, 4)
+    image = image.reshape(blocks_y * 4, blocks_x * 4, 4)
+    return np.ascontiguousarray(image[:height, :width])
+
+
+def decode_pixels(pax_type, data, width, height):
+    """Decode raw mipmap data of a given PAA type into a (height, width, 4) RGBA array."""
+    if pax_type in DXT_TYPES:
+        blocks_x = max(1, (width + 3) // 4)
+        blocks_y = max(1, (height + 3) // 4)
+        block_size = 8 if pax_type == PAX_DXT1 else 16
+        blocks = np.frombuffer(data, dtype=np.uint8, count=blocks_x * blocks_y * block_size)
+        blocks = blocks.reshape(-1, block_size)
+
+        if pax_type == PAX_DXT1:
+            pixels = _decode_color_blocks(blocks, four_color_only=False)
+        else:
+            pixels = _decode_color_blocks(blocks[:, 8:], four_color_only=True)
+            if pax_type in (PAX_DXT2, PAX_DXT3):
+                pixels[:, :, 3] = _decode_dxt3_alpha(blocks[:, :8])
+            else:
+                pixels[:, :, 3] = _decode_dxt5_alpha(blocks[:, :8])
+        return _blocks_to_image(pixels, width, height, blocks_x, blocks_y)
+
+    count = width * height
+    if pax_type == PAX_ARGB8888:
+        # Stored as little endian ARGB words, i.e. B, G, R, A bytes
+        bgra = np.frombuffer(data, dtype=np.uint8, count=count * 4).reshape(height, width, 4)
+        return np.ascontiguousarray(bgra[:, :, [2, 1, 0, 3]])
+
+    if pax_type == PAX_AI88:
+        ia = np.frombuffer(data, dtype=np.uint8, count=count * 2).reshape(height, width, 2)
+        return np.ascontiguousarray(ia[:, :, [0, 0, 0, 1]])
+
+    values = np.frombuffer(data, dtype="<u2", count=count).reshape(height, width)
+    if pax_type == PAX_ARGB4444:
+        channels = [(values >> 8) & 0xF, (values >> 4) & 0xF, values & 0xF, values >> 12]
+        return (np.stack(channels, axis=-1) * 17).astype(np.uint8)
+
+    # ARGB1555
+    r = (values >> 10) & 0x1F
+    g = (values >> 5) & 0x1F
+    b = values & 0x1F
+    a = (values >> 15) * 255
+    return np.stack([(r << 3) | (r >> 2), (g << 3) | (g >> 2), (b << 3) | (b >> 2), a], axis=-1).astype(np.uint8)
+
+
+def read_paa(path):
+    """Open a PAA texture and parse its header and mipmap table."""
+    return PaaFile(path)
+
+
+def paa_to_png(src_path, dst_path):
+    """Decode the top mipmap of a PAA texture and save it as a PNG."""
+    read_paa(src_path).to_image(0).save(dst_path)
+
+
+def _quantize_565(colors):
+    """Round (..., 3) float RGB to the nearest RGB565, returning (packed, expanded)."""
+    colors = np.clip(colors, 0, 255)
+    r = np.rint(colors[..., 0] * 31 / 255).astype(np.uint16)
+    g = np.rint(colors[..., 1] * 63 / 255).astype(np.uint16)
+    b = np.rint(colors[..., 2] * 31 / 255).astype(np.uint16)
+    packed = (r << 11) | (g << 5) | b
+    return packed, _expand_565(packed).astype(np.float32)
+
+
+def _image_to_blocks(rgba):
+    """Split a (height, width, 4) array into (N, 16, 4) blocks, padding by edge replication."""
+    height, width = rgba.shape[:2]
+    blocks_y = max(1, (height + 3) // 4)
+    blocks_x = max(1, (width + 3) // 4)
+    padded = np.pad(rgba, ((0, blocks_y * 4 - height), (0, blocks_x * 4 - width), (0, 0)), mode="edge")
+    blocks = padded.reshape(blocks_y, 4, blocks_x, 4, 4).transpose(0, 2, 1, 3, 4)
+    return blocks.reshape(-1, 16, 4)
+
+
+def _principal_axis(points):
+    """Return the principal axis of each block of (N, 16, 3) points by power iteration."""
+    centered = points - points.mean(axis=1, keepdims=True)
+    covariance = centered.transpose(0, 2, 1) @ centered
+    axis = np.ones((len(points), 3), dtype=np.float32)
+    for _ in range(8):
+        axis = (covariance @ axis[:, :, None])[:, :, 0]
+        norm = np.abs(axis).max(axis=1, keepdims=True)
+        axis = np.where(norm > 0, axis / np.where(norm > 0, norm, 1), 1)
+    return axis
+
+
+def _range_fit(points):
+    """Pick endpoints at the extremes of the principal axis projection."""
+    axis = _principal_axis(points)
+    projection = (points @ axis[:, :, None])[:, :, 0]
+    rows = np.arange(len(points))
+    start = points[rows, projection.argmax(axis=1)]
+    end = points[rows, projection.argmin(axis=1)]
+    return start, end
+
+
+def _partitions():
+    """Return every way of splitting 16 ordered points into four contiguous clusters."""
+    splits = [(i, j, k) for i in range(17) for j in range(i, 17) for k in range(j, 17)]
+    return np.array(splits, dtype=np.intp).T
+
+
+def _cluster_fit(points):
+    """
+    Pick endpoints by least squares over every ordered four-cluster partition.
+
+    Points are ordered along the principal axis, then for each split into the
+    runs that map to palette entries 0, 2, 3 and 1 the optimal endpoints are
+    solved in closed form and the split with the lowest quantized error wins.
+    """
+    weights = COLOR_WEIGHTS
+    axis = _principal_axis(points)
+    order = np.argsort(-(points @ axis[:, :, None])[:, :, 0], axis=1)
+    ordered = np.take_along_axis(points, order[:, :, None], axis=1) * weights
+    prefix = np.concatenate([np.zeros((len(points), 1, 3), np.float32), np.cumsum(ordered, axis=1)], axis=1)
+
+    i, j, k = _partitions()
+    a = i.astype(np.float32)
+    b = (j - i).astype(np.float32)
+    c = (k - j).astype(np.float32)
+    d = (16 - k).astype(np.float32)
+    alpha2 = a + b * 4 / 9 + c / 9
+    beta2 = b / 9 + c * 4 / 9 + d
+    alphabeta = (b + c) * 2 / 9
+    det = alpha2 * beta2 - alphabeta * alphabeta
+    valid = det > 1e-6
+    factor = np.where(valid, 1 / np.where(valid, det, 1), 0)
+
+    starts = np.empty((len(points), 3), np.float32)
+    ends = np.empty((len(points), 3), np.float32)
+    for lo in range(0, len(points), CLUSTER_CHUNK):
+        p = prefix[lo:lo + CLUSTER_CHUNK]
+        total = p[:, 16][:, None]
+        s0 = p[:, i]
+        s1 = p[:, j] - s0
+        s2 = p[:, k] - p[:, j]
+        alphax = s0 + s1 * (2 / 3) + s2 * (1 / 3)
+        betax = total - alphax
+
+        start = (alphax * beta2[None, :, None] - betax * alphabeta[None, :, None]) * factor[None, :, None]
+        end = (betax * alpha2[None, :, None] - alphax * alphabeta[None, :, None]) * factor[None, :, None]
+        _, start = _quantize_565(start / weights)
+        _, end = _quantize_565(end / weights)
+        start *= weights
+        end *= weights
+
+        error = (
+            alpha2[None, :, None] * start * start
+            + beta2[None, :, None] * end * end
+            + 2 * (alphabeta[None, :, None] * start * end - start * alphax - end * betax)
+        ).sum(axis=2)
+        error[:, ~valid] = np.inf
+        best = error.argmin(axis=1)
+        rows = np.arange(len(p))
+        starts[lo:lo + CLUSTER_CHUNK] = start[rows, best] / weights
+        ends[lo:lo + CLUSTER_CHUNK] = end[rows, best] / weights
+
+    # Blocks of a single color have no valid two endpoint split
+    flat = (points.max(axis=1) - points.min(axis=1)).max(axis=1) == 0
+    starts[flat] = points[flat, 0]
+    ends[flat] = points[flat, 0]
+    return starts, ends
+
+
+def _single_color_table(bits):
+    """
+    For every 8 bit value, find the endpoint pair whose 2/3 interpolant is closest.
+
+    Returns a (256, 2) array of quantized endpoint levels for a channel stored
+    with `bits` bits.
+    """
+    levels = np.arange(1 << bits)
+    expanded = (levels << (8 - bits)) | (levels >> (2 * bits - 8))
+    e0 = expanded[:, None]
+    e1 = expanded[None, :]
+    interpolated = (2 * e0 + e1) // 3
+    error = np.abs(interpolated[None, :, :] - np.arange(256)[:, None, None])
+    # Prefer close endpoints so neighbouring blocks stay similar
+    error = error * 256 + np.abs(e0 - e1)[None]
+    best = error.reshape(256, -1).argmin(axis=1)
+    return np.stack([best // (1 << bits), best % (1 << bits)], axis=1)
+
+
+_SINGLE_5 = _single_color_table(5)
+_SINGLE_6 = _single_color_table(6)
+
+
+def _single_color_fit(points):
+    """Pick packed endpoints that reproduce each block's mean color through index 2."""
+    mean = np.clip(np.rint(points.mean(axis=1)), 0, 255).astype(np.intp)
+    r = _SINGLE_5[mean[:, 0]]
+    g = _SINGLE_6[mean[:, 1]]
+    b = _SINGLE_5[mean[:, 2]]
+    c0 = ((r[:, 0] << 11) | (g[:, 0] << 5) | b[:, 0]).astype(np.uint16)
+    c1 = ((r[:, 1] << 11) | (g[:, 1] << 5) | b[:, 1]).astype(np.uint16)
+    return c0, c1
+
+
+def _least_squares_fit(points, indices):
+    """Solve for the endpoints that best reproduce `points` under fixed palette indices."""
+    weight = np.array([1, 0, 2 / 3, 1 / 3], np.float32)[indices]
+    alpha2 = (weight * weight).sum(axis=1)
+    beta2 = ((1 - weight) ** 2).sum(axis=1)
+    alphabeta = (weight * (1 - weight)).sum(axis=1)
+    alphax = (weight[:, :, None] * points).sum(axis=1)
+    betax = ((1 - weight)[:, :, None] * points).sum(axis=1)
+    det = alpha2 * beta2 - alphabeta * alphabeta
+    valid = np.abs(det) > 1e-6
+    factor = np.where(valid, 1 / np.where(valid, det, 1), 0)[:, None]
+    start = (alphax * beta2[:, None] - betax * alphabeta[:, None]) * factor
+    end = (betax * alpha2[:, None] - alphax * alphabeta[:, None]) * factor
+    mean = points.mean(axis=1)
+    return np.where(valid[:, None], start, mean), np.where(valid[:, None], end, mean)
+
+
+def _fit_color_indices(points, c0, c1):
+    """Order packed endpoints for four color mode and pick the nearest palette entries."""
+    swap = c0 < c1
+    c0, c1 = np.where(swap, c1, c0), np.where(swap, c0, c1)
+    p0 = _expand_565(c0).astype(np.float32)
+    p1 = _expand_565(c1).astype(np.float32)
+
+    palette = np.stack([p0, p1, np.floor((2 * p0 + p1) / 3), np.floor((p0 + 2 * p1) / 3)], axis=1)
+    weighted = points * COLOR_WEIGHTS
+    diff = (
+        (weighted * points).sum(axis=2)[:, :, None]
+        - 2 * weighted @ palette.transpose(0, 2, 1)
+        + (palette * palette * COLOR_WEIGHTS).sum(axis=2)[:, None, :]
+    )
+    # Equal endpoints would select the three color mode, so only index 0 is safe
+    diff[c0 == c1, :, 1:] = np.inf
+    indices = diff.argmin(axis=2)
+    error = np.take_along_axis(diff, indices[:, :, None], axis=2).sum(axis=(1, 2))
+    return c0, c1, indices, error
+
+
+def _encode_color_blocks(blocks, fit):
+    """
+    Encode (N, 16, 4) RGBA blocks into (N, 8) four color DXT color blocks.
+
+    Every block tries the principal axis extremes, a least squares refinement of
+    them and the optimal single color endpoints; the cluster fit additionally
+    searches index partitions for blocks that are still poorly approximated.
+    """
+    points = blocks[:, :, :3].astype(np.float32)
+
+    start, end = _range_fit(points)
+    best = _fit_color_indices(points, _quantize_565(start)[0], _quantize_565(end)[0])
+
+    def consider(candidate, rows=slice(None)):
+        nonlocal best
+        better = candidate[3] < best[3][rows]
+        for current, new in zip(best, candidate):
+            view = current[rows]
+            view[better] = new[better]
+            current[rows] = view
+
+    consider(_fit_color_indices(points, *_single_color_fit(points)))
+    start, end = _least_squares_fit(points, best[2])
+    consider(_fit_color_indices(points, _quantize_565(start)[0], _quantize_565(end)[0]))
+
+    if fit == "cluster":
+        # Only blocks noticeably off after the cheap fits pay for the full search
+        rows = np.flatnonzero(best[3] > 48)
+        if len(rows):
+            start, end = _cluster_fit(points[rows])
+            consider(_fit_color_indices(points[rows], _quantize_565(start)[0], _quantize_565(end)[0]), rows)
+
+    c0, c1, indices, _ = best
+    indices = indices.astype(np.uint32)
+    bits = (indices << (np.arange(16, dtype=np.uint32) * 2)).sum(axis=1, dtype=np.uint32)
+    out = np.empty((len(blocks), 8), dtype=np.uint8)
+    out[:, 0:2] = c0.astype("<u2").view(np.uint8).reshape(-1, 2)
+    out[:, 2:4] = c1.astype("<u2").view(np.uint8).reshape(-1, 2)
+    out[:, 4:8] = bits.astype("<u4").view(np.uint8).reshape(-1, 4)
+    return out
+
+
+def _alpha_palettes(a0, a1):
+    """Build the (N, 8) DXT5 alpha palettes for endpoint arrays a0 and a1."""
+    a0 = a0.astype(np.int32)
+    a1 = a1.astype(np.int32)
+    steps = np.arange(1, 7, dtype=np.int32)
+    interp8 = ((7 - steps) * a0[:, None] + steps * a1[:, None]) // 7
+    steps6 = np.arange(1, 5, dtype=np.int32)
+    interp6 = ((5 - steps6) * a0[:, None] + steps6 * a1[:, None]) // 5
+    extremes = np.tile(np.array([0, 255], np.int32), (len(a0), 1))
+    six = np.concatenate([interp6, extremes], axis=1)
+    return np.concatenate([a0[:, None], a1[:, None], np.where((a0 > a1)[:, None], interp8, six)], axis=1)
+
+
+def _fit_alpha(alpha, a0, a1):
+    """Return (indices, squared error) of alpha values against the palettes of a0/a1."""
+    palette = _alpha_palettes(a0, a1)
+    diff = np.abs(alpha[:, :, None] - palette[:, None, :])
+    indices = diff.argmin(axis=2)
+    error = (np.take_along_axis(diff, indices[:, :, None], axis=2)[:, :, 0] ** 2).sum(axis=1)
+    return indices, error
+
+
+def _encode_alpha_blocks(blocks, fit):
+    """Encode the alpha of (N, 16, 4) RGBA blocks into (N, 8) DXT5 alpha blocks."""
+    alpha = blocks[:, :, 3].astype(np.int32)
+    a0 = alpha.max(axis=1)
+    a1 = alpha.min(axis=1)
+    indices, error = _fit_alpha(alpha, a0, a1)
+
+    if fit == "cluster":
+        # Six value mode keeps exact 0 and 255 and spends its ramp on the rest
+        inner = (alpha > 0) & (alpha < 255)
+        lo = np.where(inner, alpha, 255).min(axis=1)
+        hi = np.where(inner, alpha, 0).max(axis=1)
+        lo, hi = np.minimum(lo, hi), np.maximum(lo, hi)
+        six_indices, six_error = _fit_alpha(alpha, lo, hi)
+        better = six_error < error
+        a0 = np.where(better, lo, a0)
+        a1 = np.where(better, hi, a1)
+        indices = np.where(better[:, None], six_indices, indices)
+
+    indices = indices.astype(np.uint64)
+    bits = (indices << (np.arange(16, dtype=np.uint64) * 3)).sum(axis=1, dtype=np.uint64)
+    out = np.empty((len(blocks), 8), dtype=np.uint8)
+    out[:, 0] = a0
+    out[:, 1] = a1
+    out[:, 2:8] = bits.astype("<u8").view(np.uint8).reshape(-1, 8)[:, :6]
+    return out
+
+
+def encode_pixels(pax_type, rgba, fit="range"):
+    """
+    Encode a (height, width, 4) RGBA array as DXT1 or DXT5 mipmap data.
+
+    :param fit: "range" for the fast principal axis endpoints, or "cluster" for
+        the slower least squares search over index partitions
+    """
+    blocks = _image_to_blocks(rgba)
+    color = _encode_color_blocks(blocks, fit)
+    if pax_type == PAX_DXT1:
+        return color.tobytes()
+    if pax_type != PAX_DXT5:
+        raise PaaError(f"Encoding PAA type 0x{pax_type:04X} is not supported")
+    alpha = _encode_alpha_blocks(blocks, fit)
+    return np.concatenate([alpha, color], axis=1).tobytes()
+
+
+def choose_pax_type(path, rgba):
+    """Pick DXT5 for _ca textures or any texture with transparency, DXT1 otherwise."""
+    stem = path.rsplit(".", 1)[0].lower()
+    if stem.endswith("_ca") or (rgba[:, :, 3] < 255).any():
+        return PAX_DXT5
+    return PAX_DXT1
+
+
+def build_mipmaps(image):
+    """Return the mipmap chain of a PIL RGBA image, halving down to 4 pixels."""
+    mipmaps = [image]
+    while min(image.width, image.height) >= 8:
+        image = image.reduce(2)
+        mipmaps.append(image)
+    return mipmaps
+
+
+def _tag(name, data):
+    """Serialize a TAGG section."""
+    return b"GGAT" + name[::-1].encode("ascii") + struct.pack("<I", len(data)) + data
+
+
+def _argb(color):
+    """Pack an RGBA sequence into a little endian ARGB word."""
+    r, g, b, a = (int(v) for v in color)
+    return struct.pack("<I", (a << 24) | (r << 16) | (g << 8) | b)
+
+
+def write_paa(path, image, pax_type=None, fit="range"):
+    """
+    Write a PIL image as a DXT compressed PAA texture with a full mipmap chain.
+
+    :param path: destination .paa path
+    :param image: source PIL image
+    :param pax_type: PAX_DXT1 or PAX_DXT5, picked from the name and alpha when None
+    :param fit: DXT endpoint fit, "range" (fast) or "cluster" (higher quality)
+    """
+    image = image.convert("RGBA")
+    rgba = np.asarray(image)
+    if pax_type is None:
+        pax_type = choose_pax_type(path, rgba)
+
+    mip_records = []
+    for mip in build_mipmaps(image):
+        data = encode_pixels(pax_type, np.asarray(mip), fit)
+        width = mip.width
+        if mip.width > LZO_MIN_WIDTH:
+            packed = lzo1x_compress(data)
+            if len(packed) < len(data):
+                data = packed
+                width |= LZO_FLAG
+        mip_records.append(struct.pack("<HH", width, mip.height) + len(data).to_bytes(3, "little") + data)
+
+    tags = [
+        _tag("AVGC", _argb(rgba.reshape(-1, 4).mean(axis=0).round())),
+        _tag("MAXC", _argb(rgba.reshape(-1, 4).max(axis=0))),
+    ]
+    if (rgba[:, :, 3] < 255).any():
+        tags.append(_tag("FLAG", struct.pack("<I", 1)))
+
+    # OFFS holds the absolute offset of each mipmap, so its size must be known first
+    header_size = 2 + sum(len(t) for t in tags) + len(_tag("OFFS", bytes(64))) + 2
+    offsets = []
+    position = header_size
+    for record in mip_records:
+        offsets.append(position)
+        position += len(record)
+    offsets += [0] * (16 - len(offsets))
+    tags.append(_tag("OFFS", struct.pack("<16I", *offsets[:16])))
+
+    with open(path, "wb") as f:
+        f.write(struct.pack("<H", pax_type))
+        f.write(b"".join(tags))
+        f.write(struct.pack("<H", 0))
+        f.write(b"".join(mip_records))
+        f.write(bytes(6))
+
+
+def png_to_paa(src_path, dst_path, fit="range"):
+    """Encode a PNG as a PAA texture."""
+    with Image.open(src_path) as image:
+        write_paa(dst_path, image, fit=fit)
@@ -0,0 +1,363 @@
+"""Native reader and writer for Arma PBO archives."""
+import fnmatch
+import hashlib
+import mmap
+import os
+import re
+import struct
+from collections import namedtuple
+
+from compression import DecompressionError, iter_lzss_decompress
+from tree_scan import scan_tree
+
+METHOD_STORED = 0x00000000
+METHOD_COMPRESSED = 0x43707273  # "Cprs"
+METHOD_VERSION = 0x56657273  # "Vers"
+
+ENTRY_FIELDS = struct.Struct("<5I")
+
+# File in a source tree that holds the addon prefix, as used by the BI tools
+PREFIX_FILE = "$PBOPREFIX$"
+
+COPY_CHUNK = 1 << 20
+
+PboEntry = namedtuple("PboEntry", ["name", "method", "original_size", "reserved", "timestamp", "data_size", "offset"])
+
+
+class PboError(Exception):
+    """Raised when a PBO archive is truncated or malformed."""
+
+
+def _normalize_name(name):
+    """Lower case an archive path and use forward slashes, for pattern matching."""
+    return name.replace("\\", "/").lower()
+
+
+def compile_entry_filter(include=None, exclude=None):
+    """
+    Build a predicate over archive paths from include/exclude glob patterns.
+
+    Patterns are matched case-insensitively against the full prefixed path, and
+    either slash style may be used, e.g. include ``*_ca.paa`` with exclude
+    ``*/ui/*``. All patterns of a kind are compiled into one regex.
+
+    :return: a function taking a path and returning True when it is wanted, or
+        None when there are no patterns
+    """
+    if not include and not exclude:
+        return None
+
+    def compile_patterns(patterns):
+        if not patterns:
+            return None
+        return re.compile("|".join(fnmatch.translate(_normalize_name(p)) for p in patterns))
+
+    include_re = compile_patterns(include)
+    exclude_re = compile_patterns(exclude)
+
+    def wanted(name):
+        name = _normalize_name(name)
+        if include_re and not include_re.match(name):
+            return False
+        return not (exclude_re and exclude_re.match(name))
+
+    return wanted
+
+
+def _read_cstring(buffer, pos):
+    """Read a NUL terminated string; return (string, position after the NUL)."""
+    end = buffer.find(b"\0", pos)
+    if end < 0:
+        raise PboError("unterminated string in PBO header")
+    return buffer[pos:end].decode("utf-8", errors="replace"), end + 1
+
+
+class PboReader:
+    """
+    Memory mapped view of a PBO archive.
+
+    Opening only parses the header; entry data is read from the mapping on
+    demand, so stored entries are written out without intermediate copies.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.properties = {}
+        self.entries = []
+        self._file = open(path, "rb")
+        try:
+            if os.fstat(self._file.fileno()).st_size == 0:
+                raise PboError(f"{path} is empty")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._parse()
+        except (PboError, ValueError, struct.error):
+            self._file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._map.close()
+        self._file.close()
+
+    @property
+    def prefix(self):
+        """The addon prefix, with backslashes as stored in the archive."""
+        return self.properties.get("prefix", "")
+
+    def _parse(self):
+        buffer = self._map
+        pos = 0
+        headers = []
+        while True:
+            name, pos = _read_cstring(buffer, pos)
+            if pos + ENTRY_FIELDS.size > len(buffer):
+                raise PboError(f"{self.path} has a truncated header")
+            method, original_size, reserved, timestamp, data_size = ENTRY_FIELDS.unpack_from(buffer, pos)
+            pos += ENTRY_FIELDS.size
+
+            if not name and method == METHOD_VERSION:
+                # Product entry: key/value properties up to an empty key
+                while True:
+                    key, pos = _read_cstring(buffer, pos)
+                    if not key:
+                        break
+                    value, pos = _read_cstring(buffer, pos)
+                    self.properties[key] = value
+                continue
+
+            if not name:
+                break
+            headers.append((name, method, original_size, reserved, timestamp, data_size))
+
+        self.data_offset = pos
+        for header in headers:
+            self.entries.append(PboEntry(*header, pos))
+            pos += header[-1]
+        if pos > len(buffer):
+            raise PboError(f"{self.path} is truncated")
+        self.data_end = pos
+
+    def iter_entry(self, entry, check=False):
+        """
+        Yield the contents of an entry in chunks.
+
+        Stored entries yield a single zero-copy memoryview of the mapping;
+        compressed entries are decompressed incrementally.
+        """
+        view = memoryview(self._map)[entry.offset:entry.offset + entry.data_size]
+        try:
+            if entry.method == METHOD_COMPRESSED or (entry.original_size and entry.original_size != entry.data_size):
+                try:
+                    yield from iter_lzss_decompress(view, entry.original_size, check=check)
+                except DecompressionError as e:
+                    raise PboError(f"{entry.name}: {e}")
+            elif entry.data_size:
+                yield view
+        finally:
+            # Views must be released before the mapping can be closed
+            view.release()
+
+    def header_hash(self):
+        """SHA1 of the header, which changes whenever any entry is added, removed or resized."""
+        return hashlib.sha1(self._map[:self.data_offset]).hexdigest()
+
+    def select(self, include=None, exclude=None):
+        """Return the entries whose prefixed paths pass the include/exclude patterns."""
+        wanted = compile_entry_filter(include, exclude)
+        if wanted is None:
+            return list(self.entries)
+        prefix = self.prefix + "\\" if self.prefix else ""
+        return [entry for entry in self.entries if wanted(prefix + entry.name)]
+
+    def read(self, entry):
+        """Return the full contents of an entry."""
+        return b"".join(bytes(chunk) for chunk in self.iter_entry(entry))
+
+    def entry_path(self, entry, dest_dir, use_prefix=True):
+        """Return where an entry lands under `dest_dir`, refusing paths that escape it."""
+        parts = [self.prefix] if use_prefix and self.prefix else []
+        parts.append(entry.name)
+        relative = os.path.normpath("\\".join(parts).replace("\\", os.sep).lstrip(os.sep))
+        if relative.startswith(os.pardir) or os.path.isabs(relative):
+            raise PboError(f"{entry.name} points outside the destination")
+        return os.path.join(dest_dir, relative)
+
+    def extract_entry(self, entry, dest_path, check=False):
+        """Stream one entry to `dest_path`, through a temporary file so an interrupted run leaves no partial file."""
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        temp_path = dest_path + ".tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                for chunk in self.iter_entry(entry, check=check):
+                    f.write(chunk)
+            if entry.timestamp:
+                os.utime(temp_path, (entry.timestamp, entry.timestamp))
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        os.replace(temp_path, dest_path)
+
+    def extract_all(self, dest_dir, use_prefix=True, check=False, include=None, exclude=None):
+        """
+        Extract entries into `dest_dir`, under the archive prefix by default.
+
+        Filtering happens on the entry table, so skipped entries are never read.
+
+        :param include: glob patterns an entry must match, all entries when None
+        :param exclude: glob patterns of entries to leave out
+        :return: list of the written paths
+        """
+        written = []
+        for entry in self.select(include, exclude):
+            dest_path = self.entry_path(entry, dest_dir, use_prefix)
+            self.extract_entry(entry, dest_path, check=check)
+            written.append(dest_path)
+        return written
+
+    def verify(self):
+        """Check the SHA1 trailer; returns False when it is missing or wrong."""
+        trailer = self._map[self.data_end:self.data_end + 21]
+        if len(trailer) != 21 or trailer[0] != 0:
+            return False
+        digest = hashlib.sha1(memoryview(self._map)[:self.data_end]).digest()
+        return digest == trailer[1:]
+
+
+def extract_pbo(pbo_path, dest_dir, verify=False, include=None, exclude=None):
+    """
+    Extract a PBO into `dest_dir` under its prefix.
+
+    :param verify: check the SHA1 trailer and LZSS checksums before trusting the data
+    :param include: glob patterns an entry must match, all entries when None
+    :param exclude: glob patterns of entries to leave out
+    :return: list of the written paths
+    """
+    with PboReader(pbo_path) as reader:
+        if verify and not reader.verify():
+            raise PboError(f"{pbo_path} failed SHA1 verification")
+        return reader.extract_all(dest_dir, check=verify, include=include, exclude=exclude)
+
+
+def _collect_files(src_dir):
+    """List (archive name, path, size, mtime, mtime_ns) for every file under src_dir, in a stable order."""
+    files = []
+    for entry in scan_tree(src_dir, stat=True):
+        if entry.rel_path == PREFIX_FILE:
+            continue
+        archive_name = entry.rel_path.replace(os.sep, "\\")
+        files.append((archive_name, entry.path, entry.stat.st_size, int(entry.stat.st_mtime), entry.stat.st_mtime_ns))
+    return files
+
+
+def _reusable_entries(reader):
+    """Map lower cased names to the stored entries of a previous archive."""
+    reusable = {}
+    for entry in reader.entries:
+        stored = entry.method == METHOD_STORED and entry.original_size in (0, entry.data_size)
+        if stored:
+            reusable[entry.name.lower()] = entry
+    return reusable
+
+
+def pack_pbo(src_dir, output_path, prefix=None, previous=None, properties=None):
+    """
+    Pack a directory tree into a PBO with a SHA1 trailer.
+
+    With `previous`, entries whose size and mtime match a stored entry of that
+    archive are copied as raw byte ranges from it, so only modified files are
+    read from disk. PBO timestamps have whole seconds only, so a file is
+    reused only when it was also last written strictly before the previous
+    archive; an edit of the same size within the same second is read again.
+    `previous` may be the same path as `output_path`.
+
+    :param src_dir: directory whose contents become the archive entries
+    :param output_path: path of the PBO to write
+    :param prefix: addon prefix, read from src_dir/$PBOPREFIX$ when None
+    :param previous: path of an earlier build of the same archive
+    :param properties: extra product properties written after the prefix
+    :return: dict with the counts of "reused" and "read" entries
+    """
+    if prefix is None:
+        prefix_path = os.path.join(src_dir, PREFIX_FILE)
+        prefix = ""
+        if os.path.exists(prefix_path):
+            with open(prefix_path, "r") as f:
+                prefix = f.read().strip()
+
+    files = _collect_files(src_dir)
+
+    old = None
+    reusable = {}
+    if previous and os.path.exists(previous):
+        try:
+            previous_mtime = os.stat(previous).st_mtime_ns
+            old = PboReader(previous)
+            reusable = _reusable_entries(old)
+        except (PboError, OSError, ValueError):
+            old = None
+
+    header = bytearray(b"\0" + ENTRY_FIELDS.pack(METHOD_VERSION, 0, 0, 0, 0))
+    all_properties = {"prefix": prefix} if prefix else {}
+    all_properties.update(properties or {})
+    for key, value in all_properties.items():
+        header += key.encode("utf-8") + b"\0" + value.encode("utf-8") + b"\0"
+    header += b"\0"
+    for archive_name, _, size, mtime, _ in files:
+        header += archive_name.encode("utf-8") + b"\0" + ENTRY_FIELDS.pack(METHOD_STORED, 0, 0, mtime, size)
+    header += b"\0" + bytes(ENTRY_FIELDS.size)
+
+    counts = {"reused": 0, "read": 0}
+    digest = hashlib.sha1()
+    temp_path = output_path + ".tmp"
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    try:
+        with open(temp_path, "wb") as out:
+            def write(data):
+                out.write(data)
+                digest.update(data)
+
+            write(header)
+            for archive_name, full_path, size, mtime, mtime_ns in files:
+                entry = reusable.get(archive_name.lower())
+                if entry is not None and entry.data_size == size and entry.timestamp == mtime \
+                        and mtime_ns < previous_mtime:
+                    for chunk in old.iter_entry(entry):
+                        write(chunk)
+                    counts["reused"] += 1
+                    continue
+
+                written = 0
+                with open(full_path, "rb") as f:
+                    while written < size:
+                        chunk = f.read(min(COPY_CHUNK, size - written))
+                        if not chunk:
+                            break
+                        write(chunk)
+                        written += len(chunk)
+                if written != size:
+                    raise PboError(f"{full_path} changed size while packing")
+                counts["read"] += 1
+
+            out.write(b"\0" + digest.digest())
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    finally:
+        # The previous archive must be closed before it can be replaced
+        if old is not None:
+            old.close()
+
+    os.replace(temp_path, output_path)
+    return counts
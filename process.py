@@ -1,104 +1,352 @@
+import argparse
 import os
 import shutil
-from conversion_utils import convert_png_to_paa
+import sys
+import tracing
+from content_index import ContentIndex
+from conversion_utils import _convert_single_file_png_to_paa, convert_files_png_to_paa
+from manifest import Manifest, cached_file_hash
+from pbo import pack_pbo
+from tree_scan import TreeSnapshot, scan_tree
+from tree_sync import apply_actions, diff_trees, place_file
 
 MAKE_PBO_PATH = "C:\\Program Files (x86)\\Mikero\\DePboTools\\bin\\MakePbo.exe"
 
-def sync_folders(source_dir, patched_dir):
+BUILD_MANIFEST_NAME = "build_manifest.json"
+
+def sync_folders(source_dir, patched_dir, max_threads=16, link="auto", exclude=None, hash_cache=None):
+    """
+    Make patched_dir mirror source_dir.
+
+    Both trees are diffed in a single scandir pass, then deletes and copies
+    run on a thread pool. Unchanged files are detected by size and mtime, with
+    a cached content hash as fallback when hash_cache is given. With link
+    "auto", files are reflinked or hardlinked from source_dir where the
+    filesystem allows; patched files are always replaced by rename, never
+    written in place, so linked sources are never modified.
+
+    :param exclude: relative paths owned by later stages, neither copied nor deleted
+    :param hash_cache: dict for manifest.cached_file_hash, e.g. from the build manifest
+    :return: list of tree_sync.SyncAction that were applied
+    """
     # Ensure the patched directory exists
     if not os.path.exists(patched_dir):
         os.makedirs(patched_dir)
-    
-    # Walk through source directory
-    for root, dirs, files in os.walk(source_dir):
-        for file in files:
-            source_file = os.path.join(root, file)
-            rel_path = os.path.relpath(root, source_dir)
-            patched_subdir = os.path.join(patched_dir, rel_path)
-            
-            # Ensure the corresponding directory exists in patched
-            if not os.path.exists(patched_subdir):
-                os.makedirs(patched_subdir)
-            
-            patched_file = os.path.join(patched_subdir, file)
-
-            # Check if file sizes are different or file doesn't exist in patched
-            if not os.path.exists(patched_file) or os.path.getsize(source_file) != os.path.getsize(patched_file):
-                shutil.copy2(source_file, patched_file)
-
-    # Delete files/folders in patched not present in source
-    for root, dirs, files in os.walk(patched_dir):
-        for file in files:
-            patched_file = os.path.join(root, file)
-            rel_path = os.path.relpath(root, patched_dir)
-            source_subdir = os.path.join(source_dir, rel_path)
-            source_file = os.path.join(source_subdir, file)
-            
-            if not os.path.exists(source_file):
-                os.remove(patched_file)
-                
-        for dir in dirs:
-            patched_subdir = os.path.join(root, dir)
-            rel_path = os.path.relpath(patched_subdir, patched_dir)
-            source_subdir = os.path.join(source_dir, rel_path)
-            
-            if not os.path.exists(source_subdir):
-                shutil.rmtree(patched_subdir)
+
+    with tracing.span("sync") as span:
+        with tracing.span("sync.diff"):
+            actions = diff_trees(source_dir, patched_dir, exclude=exclude, hash_cache=hash_cache)
+        span.add(files=len(actions))
+        apply_actions(source_dir, patched_dir, actions, max_threads=max_threads, link=link)
+    return actions
 
 def copy_to_patched(temp_converted_dir, patched_dir):
     # Copy contents of temp/converted to patched
-    for root, dirs, files in os.walk(temp_converted_dir):
-        for file in files:
-            temp_file = os.path.join(root, file)
-            rel_path = os.path.relpath(root, temp_converted_dir)
-            patched_subdir = os.path.join(patched_dir, rel_path)
-            
-            # Ensure the corresponding directory exists in patched
-            if not os.path.exists(patched_subdir):
-                os.makedirs(patched_subdir)
-            
-            patched_file = os.path.join(patched_subdir, file)
-            shutil.copy2(temp_file, patched_file)
+    created = set()
+    for entry in scan_tree(temp_converted_dir):
+        patched_file = os.path.join(patched_dir, entry.rel_path)
+        patched_subdir = os.path.dirname(patched_file)
+
+        # Ensure the corresponding directory exists in patched, once per directory
+        if patched_subdir not in created:
+            os.makedirs(patched_subdir, exist_ok=True)
+            created.add(patched_subdir)
+
+        shutil.copy2(entry.path, patched_file)
+
+class BuildReport:
+    """Records what an incremental build redid, and why."""
+
+    def __init__(self):
+        self.actions = []
+        self.failed = []
+
+    def add(self, stage, path, reason):
+        self.actions.append((stage, path, reason))
+
+    def fail(self, stage, path, error):
+        self.failed.append((stage, path, error))
+
+    def print_summary(self):
+        for stage, path, error in self.failed:
+            print(f"[failed] {path}: {error}")
+        if not self.actions and not self.failed:
+            print("Nothing to rebuild, everything is up to date.")
+            return
+        counts = {}
+        for stage, path, reason in self.actions:
+            counts[stage] = counts.get(stage, 0) + 1
+            print(f"[{stage}] {path}: {reason}")
+        summary = ", ".join(f"{stage}: {count}" for stage, count in counts.items())
+        if self.failed:
+            summary += (", " if summary else "") + f"failed: {len(self.failed)}"
+        print(summary)
+
+
+def _walk_files(base_dir, extension=None, snapshot=None):
+    """Map relative paths to FileEntry for the files under base_dir; with a snapshot entries carry their stat."""
+    with tracing.span("walk", path=base_dir) as span:
+        found = {entry.rel_path: entry for entry in scan_tree(base_dir, extension, snapshot=snapshot)}
+        span.add(files=len(found))
+    return found
+
+
+def _rebuild_reason(record, expected, output_path, force):
+    """Return why an output must be rebuilt, or None if its record is still valid."""
+    if force:
+        return "forced"
+    if record is None:
+        return "new input"
+    if record.get("stage", expected.get("stage")) != expected.get("stage"):
+        return f"now provided by {expected['stage']}"
+    if record.get("hash") != expected["hash"]:
+        return "input changed"
+    if not os.path.exists(output_path):
+        return "output missing"
+    if "size" in expected and os.path.getsize(output_path) != expected["size"]:
+        return "output modified"
+    return None
+
+
+def convert_stage(edited_dir, temp_paa_dir, manifest, report, force=False, snapshot=None):
+    """
+    Convert the edited PNGs whose content changed since the last build.
+
+    A failed conversion is added to report.failed and its output from any
+    earlier build deleted, so patch_stage falls back to the raw texture.
+
+    :param snapshot: TreeSnapshot shared with patch_stage, so edited/ is walked once
+    """
+    hashes = manifest.get("hashes", {})
+    records = manifest.get("convert", {})
+    sources = _walk_files(edited_dir, ".png", snapshot)
+
+    tasks = []
+    pending = {}
+    for rel_path, entry in sources.items():
+        full_path = entry.path
+        output_path = os.path.join(temp_paa_dir, rel_path[:-len(".png")] + ".paa")
+        expected = {"hash": cached_file_hash(hashes, full_path, entry.stat), "output": output_path}
+        reason = _rebuild_reason(records.get(rel_path), expected, output_path, force)
+        if reason is None:
+            continue
+        report.add("convert", rel_path, reason)
+        tasks.append((full_path, output_path))
+        pending[rel_path] = expected
+
+    # Identical edited textures are converted once, reusing the hashes computed above
+    results = convert_files_png_to_paa(tasks, progress=bool(tasks), dedup=ContentIndex(cache=hashes)).results
+    errors = {result.output: result.error for result in results if not result.ok}
+
+    for rel_path, expected in pending.items():
+        # Only remember conversions that actually produced an output
+        if expected["output"] not in errors:
+            records[rel_path] = expected
+            continue
+        records.pop(rel_path, None)
+        # The texture of the previous build must not reach patched/ in place of the lost edit
+        if os.path.exists(expected["output"]):
+            os.remove(expected["output"])
+        report.fail("convert", rel_path, errors[expected["output"]])
+
+    for rel_path in set(records) - set(sources):
+        output_path = records.pop(rel_path)["output"]
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        report.add("convert", rel_path, "input deleted")
+
+    manifest.set("hashes", hashes)
+    manifest.set("convert", records)
+
+
+def patch_stage(source_dir, temp_paa_dir, edited_dir, patched_dir, manifest, report, force=False, snapshot=None):
+    """
+    Bring patched_dir up to date with raw files, converted textures and edited models.
+
+    Later stages win when several provide the same path, matching the order of
+    a full rebuild: sync from raw, overlay converted .paa files, copy .p3d files.
+
+    :param snapshot: TreeSnapshot holding edited/ from convert_stage; temp/ was just written, so it is walked afresh
+    """
+    hashes = manifest.get("hashes", {})
+    records = manifest.get("outputs", {})
+
+    overrides = {}
+    for stage, files in (
+        ("overlay", _walk_files(temp_paa_dir)),
+        ("p3d", _walk_files(edited_dir, ".p3d", snapshot)),
+    ):
+        for rel_path, entry in files.items():
+            overrides[rel_path] = (stage, entry)
+
+    # Raw files the later stages override are left to them; the mirror also
+    # restores or removes paths whose override went away
+    for action in sync_folders(source_dir, patched_dir, exclude=set(overrides), hash_cache=hashes):
+        report.add("sync", action.rel_path, action.reason)
+
+    for rel_path, (stage, entry) in overrides.items():
+        _place_override(rel_path, stage, entry.path, patched_dir, hashes, records, report, force, entry.stat)
+
+    for rel_path in set(records) - set(overrides):
+        stage = records.pop(rel_path)["stage"]
+        report.add(stage, rel_path, "input deleted")
+
+    manifest.set("hashes", hashes)
+    manifest.set("outputs", records)
+
+
+def _place_override(rel_path, stage, full_path, patched_dir, hashes, records, report, force=False, stat=None):
+    """Put a file of a later stage at rel_path in patched_dir unless its record shows it is already there."""
+    patched_file = os.path.join(patched_dir, rel_path)
+    if stat is None:
+        stat = os.stat(full_path)
+    expected = {"stage": stage, "hash": cached_file_hash(hashes, full_path, stat), "size": stat.st_size}
+    reason = _rebuild_reason(records.get(rel_path), expected, patched_file, force)
+    if reason is None:
+        return
+    place_file(full_path, patched_file)
+    records[rel_path] = expected
+    report.add(stage, rel_path, reason)
+
+
+def _restore_override(rel_path, source_dir, patched_dir, records, report):
+    """Put back the raw file, or nothing, at a patched path whose override went away."""
+    record = records.pop(rel_path, None)
+    if record is None:
+        return
+    raw_file = os.path.join(source_dir, rel_path)
+    patched_file = os.path.join(patched_dir, rel_path)
+    if os.path.exists(raw_file):
+        place_file(raw_file, patched_file)
+    elif os.path.exists(patched_file):
+        os.remove(patched_file)
+    report.add(record["stage"], rel_path, "input deleted")
+
+
+def update_edited_files(base_dir, rel_paths, manifest, report):
+    """
+    Bring patched/ up to date with a few changed files of edited/, without a full build.
+
+    Changed PNGs are converted on their own and .p3d files copied, and the
+    results replace their patched files by rename. Deleted inputs restore
+    the raw file. Manifest records are kept as build() would leave them, so
+    the next build has nothing to redo; the caller saves the manifest.
+
+    :param rel_paths: paths relative to edited/ that were added, changed or deleted
+    """
+    source_dir = os.path.join(base_dir, "raw")
+    patched_dir = os.path.join(base_dir, "patched")
+    edited_dir = os.path.join(base_dir, "edited")
+    temp_dir = os.path.join(base_dir, "temp")
+    temp_paa_dir = os.path.join(temp_dir, "paa")
+
+    hashes = manifest.get("hashes", {})
+    convert_records = manifest.get("convert", {})
+    output_records = manifest.get("outputs", {})
+
+    for rel_path in rel_paths:
+        full_path = os.path.join(edited_dir, rel_path)
+        if rel_path.endswith(".png"):
+            paa_rel_path = rel_path[:-len(".png")] + ".paa"
+            output_path = os.path.join(temp_paa_dir, paa_rel_path)
+            if not os.path.isfile(full_path):
+                record = convert_records.pop(rel_path, None)
+                if record is not None:
+                    if os.path.exists(record["output"]):
+                        os.remove(record["output"])
+                    report.add("convert", rel_path, "input deleted")
+                _restore_override(paa_rel_path, source_dir, patched_dir, output_records, report)
+                continue
+            expected = {"hash": cached_file_hash(hashes, full_path), "output": output_path}
+            reason = _rebuild_reason(convert_records.get(rel_path), expected, output_path, False)
+            if reason is not None:
+                # Convert next to temp/paa and rename, so a failed save never leaves a torn output;
+                # the name is kept since the encoder picks DXT5 from the _ca suffix
+                partial_path = os.path.join(temp_dir, "partial", paa_rel_path)
+                _convert_single_file_png_to_paa(full_path, partial_path)
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                os.replace(partial_path, output_path)
+                convert_records[rel_path] = expected
+                report.add("convert", rel_path, reason)
+            _place_override(paa_rel_path, "overlay", output_path, patched_dir, hashes, output_records, report)
+        elif rel_path.endswith(".p3d"):
+            if os.path.isfile(full_path):
+                _place_override(rel_path, "p3d", full_path, patched_dir, hashes, output_records, report)
+            else:
+                _restore_override(rel_path, source_dir, patched_dir, output_records, report)
+
+    manifest.set("hashes", hashes)
+    manifest.set("convert", convert_records)
+    manifest.set("outputs", output_records)
+
+
+def build(base_dir, force=False, manifest=None):
+    """
+    Incrementally rebuild temp/ and patched/ from raw/ and edited/.
+
+    Input hashes and outputs of each stage are kept in build/build_manifest.json,
+    so only work whose inputs changed is redone. force wipes temp/ and patched/
+    and rebuilds everything.
+
+    :param manifest: the loaded build manifest, for callers that keep it open between builds
+    :return: BuildReport of what was rebuilt and why, and what failed
+    """
+    source_dir = os.path.join(base_dir, "raw")
+    patched_dir = os.path.join(base_dir, "patched")
+    edited_dir = os.path.join(base_dir, "edited")
+    temp_dir = os.path.join(base_dir, "temp")
+    temp_paa_dir = os.path.join(temp_dir, "paa")
+
+    if manifest is None:
+        manifest = Manifest(os.path.join(base_dir, "build", BUILD_MANIFEST_NAME))
+    if force:
+        manifest.entries = {}
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        if os.path.exists(patched_dir):
+            shutil.rmtree(patched_dir)
+    os.makedirs(patched_dir, exist_ok=True)
+
+    report = BuildReport()
+    snapshot = TreeSnapshot()
+    try:
+        with tracing.span("convert_stage"):
+            convert_stage(edited_dir, temp_paa_dir, manifest, report, force, snapshot)
+        with tracing.span("patch_stage"):
+            patch_stage(source_dir, temp_paa_dir, edited_dir, patched_dir, manifest, report, force, snapshot)
+    finally:
+        with tracing.span("manifest.save"):
+            manifest.save()
+    return report
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build patched/ from raw/ and edited/.")
+    parser.add_argument("--force", action="store_true", help="wipe temp/ and patched/ and rebuild everything")
+    parser.add_argument("--trace", metavar="PATH", help="record stage timings and write a Chrome trace to PATH")
+    args = parser.parse_args()
+    if args.trace:
+        tracing.enable()
 
     this_file = os.path.realpath(__file__)
     base_dir = os.path.dirname(this_file)
-    
-    # Define directories
-    SOURCE_DIR = os.path.join(base_dir, "raw")
+
     PATCHED_DIR = os.path.join(base_dir, "patched")
-    EDITED_DIR = os.path.join(base_dir, "edited")
-    
-    TEMP_DIR = os.path.join(base_dir, "temp")
-    TEMP_PAA_DIR = os.path.join(TEMP_DIR, "paa")
-
-    if os.path.exists(TEMP_DIR):
-        shutil.rmtree(TEMP_DIR)
-
-    if os.path.exists(PATCHED_DIR):
-        shutil.rmtree(PATCHED_DIR)
-
-    # # Convert files
-    convert_png_to_paa(EDITED_DIR, TEMP_PAA_DIR)
-    
-    # Sync folders
-    sync_folders(SOURCE_DIR, PATCHED_DIR)
-
-    # Patch with converted files
-    copy_to_patched(TEMP_PAA_DIR, PATCHED_DIR)
-
-    # copy all .p3d files from edited folder to patched
-    for root, dirs, files in os.walk(EDITED_DIR):
-        for file in files:
-            if file.endswith(".p3d"):
-                edited_file = os.path.join(root, file)
-                rel_path = os.path.relpath(root, EDITED_DIR)
-                patched_subdir = os.path.join(PATCHED_DIR, rel_path)
-                
-                # Ensure the corresponding directory exists in patched
-                if not os.path.exists(patched_subdir):
-                    os.makedirs(patched_subdir)
-                
-                patched_file = os.path.join(patched_subdir, file)
-                shutil.copy2(edited_file, patched_file)
+    BUILD_DIR = os.path.join(base_dir, "build")
+    PBO_PATH = os.path.join(BUILD_DIR, "patched.pbo")
+
+    report = build(base_dir, force=args.force)
+    report.print_summary()
+    if report.failed:
+        # Do not pack an archive that is missing edits
+        sys.exit(1)
+
+    # Pack the patched tree, reusing unchanged entries from the previous build
+    with tracing.span("pack_pbo"):
+        pack_pbo(PATCHED_DIR, PBO_PATH, previous=PBO_PATH)
+
+    if args.trace:
+        tracer = tracing.disable()
+        tracer.print_summary()
+        tracer.write_chrome_trace(args.trace)
+        print(f"Trace written to {args.trace}")
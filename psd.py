@@ -0,0 +1,443 @@
+"""Reader for Photoshop PSD and PSB files, flattening them to one image with NumPy."""
+import os
+import struct
+import zlib
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+MODE_GRAYSCALE = 1
+MODE_RGB = 3
+
+COMPRESSION_RAW = 0
+COMPRESSION_RLE = 1
+COMPRESSION_ZIP = 2
+COMPRESSION_ZIP_PREDICTION = 3
+
+# Image resource holding the "has real merged data" flag
+RESOURCE_VERSION_INFO = 1057
+
+# Layer channel ids besides the colour channels 0, 1, 2
+CHANNEL_TRANSPARENCY = -1
+CHANNEL_USER_MASK = -2
+
+# Section divider types of group layers: open and closed folders, and the end marker below a group
+DIVIDER_OPEN = 1
+DIVIDER_CLOSED = 2
+DIVIDER_END = 3
+
+# Layer flags
+FLAG_HIDDEN = 0x02
+
+# Additional layer information keys whose length field is 8 bytes in PSB files
+_PSB_LONG_KEYS = {b"LMsk", b"Lr16", b"Lr32", b"Layr", b"Mt16", b"Mt32", b"Mtrn", b"Alph", b"FMsk", b"lnk2",
+                  b"FEid", b"FXid", b"PxSD"}
+
+# Decoded bytes per step of decode_rle; bounds the size of its index arrays
+RLE_CHUNK_BYTES = 1 << 22
+
+# Pixels blended per step when compositing layers
+BLEND_CHUNK_PIXELS = 1 << 20
+
+Channel = namedtuple("Channel", ["id", "offset", "length"])
+Mask = namedtuple("Mask", ["top", "left", "bottom", "right", "default", "disabled"])
+Layer = namedtuple("Layer", ["name", "top", "left", "bottom", "right", "channels", "blend_mode", "opacity",
+                             "visible", "mask", "divider"])
+
+
+class PsdError(Exception):
+    """Raised when a file is not a PSD this reader understands."""
+
+
+def decode_rle(data, counts, row_bytes):
+    """
+    Decode PackBits rows into a (len(counts), row_bytes) uint8 array.
+
+    Packet headers are parsed for all rows in step, one packet of every
+    row per iteration, and the packets are then expanded with one gather,
+    so the Python loop runs once per packet of the longest row instead of
+    once per packet. Rows are handled RLE_CHUNK_BYTES of output at a time.
+
+    :param counts: compressed size of each row, in order
+    """
+    src = np.frombuffer(data, np.uint8)
+    counts = np.asarray(counts, np.int64)
+    if counts.sum() > src.size:
+        raise PsdError("RLE data is shorter than its row byte counts")
+    starts = np.concatenate(([0], np.cumsum(counts[:-1])))
+    out = np.empty((len(counts), row_bytes), np.uint8)
+    chunk = max(1, RLE_CHUNK_BYTES // max(1, row_bytes))
+    for first in range(0, len(counts), chunk):
+        _decode_rle_rows(src, starts[first:first + chunk], counts[first:first + chunk], out[first:first + chunk])
+    return out
+
+
+def _decode_rle_rows(src, starts, counts, out):
+    rows, row_bytes = out.shape
+    cursor = starts.copy()
+    ends = starts + counts
+    filled = np.zeros(rows, np.int64)
+    sources = []
+    lengths = []
+    literals = []
+    targets = []
+    active = np.nonzero(cursor < ends)[0]
+    while active.size:
+        header = src[cursor[active]].astype(np.int64)
+        header[header > 127] -= 256
+        literal = header >= 0
+        length = np.where(literal, header + 1, 1 - header)
+        length[header == -128] = 0  # no-op packet
+        sources.append(cursor[active] + 1)
+        lengths.append(length)
+        literals.append(literal)
+        targets.append(active * row_bytes + filled[active])
+        filled[active] += length
+        cursor[active] += 1 + np.where(literal, length, np.where(header == -128, 0, 1))
+        active = active[cursor[active] < ends[active]]
+
+    if np.any(filled != row_bytes) or np.any(cursor > ends):
+        raise PsdError("RLE rows do not decode to the image width")
+    if not sources:
+        return
+    # Packets in output order, no-op packets dropped, cover the output exactly
+    order = np.argsort(np.concatenate(targets), kind="stable")
+    sources = np.concatenate(sources)[order]
+    lengths = np.concatenate(lengths)[order]
+    literals = np.concatenate(literals)[order]
+    keep = lengths > 0
+    sources, lengths, literals = sources[keep], lengths[keep], literals[keep]
+
+    # Source index of every output byte as a running sum: literal bytes step
+    # by one, run bytes by zero, and each packet's first byte jumps from the
+    # previous packet's last source byte to its own
+    steps = np.repeat(literals.astype(np.int64), lengths)
+    last = sources + (lengths - 1) * literals
+    starts = np.cumsum(lengths) - lengths
+    steps[starts] = sources - np.concatenate(([0], last[:-1]))
+    np.take(src, np.cumsum(steps, out=steps), out=out.reshape(-1))
+
+
+def _unpredict(rows, depth):
+    """Undo the per row delta encoding of ZIP with prediction."""
+    if depth == 16:
+        values = rows.view(">u2").astype(np.uint16)
+        return np.cumsum(values, axis=1, dtype=np.uint16).astype(">u2").view(np.uint8)
+    return np.cumsum(rows, axis=1, dtype=np.uint8)
+
+
+def _to_8bit(rows, depth, width):
+    """Turn decoded rows of depth bits per sample into (height, width) uint8."""
+    if depth == 16:
+        return (rows.view(">u2") >> 8).astype(np.uint8)[:, :width]
+    return rows[:, :width]
+
+
+class PsdFile:
+    """
+    A parsed PSD or PSB file.
+
+    Only the headers and layer records are read on open; pixel data is read
+    one channel at a time when an image is asked for.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.layers = []
+        self.has_real_merged_data = True
+        with open(path, "rb") as f:
+            self._parse(f)
+
+    def _read_length(self, f, long_in_psb=True):
+        """Read a length field, 8 bytes in PSB files where the format says so."""
+        if self.version == 2 and long_in_psb:
+            return struct.unpack(">Q", f.read(8))[0]
+        return struct.unpack(">I", f.read(4))[0]
+
+    def _parse(self, f):
+        header = f.read(26)
+        if len(header) != 26 or header[:4] != b"8BPS":
+            raise PsdError(f"{self.path} is not a PSD file")
+        self.version, self.channels, self.height, self.width, self.depth, self.mode = struct.unpack(
+            ">H6xHIIHH", header[4:])
+        if self.version not in (1, 2):
+            raise PsdError(f"{self.path} has unknown PSD version {self.version}")
+        if self.depth not in (8, 16):
+            raise PsdError(f"{self.path} has {self.depth} bits per channel, only 8 and 16 are supported")
+        if self.mode not in (MODE_RGB, MODE_GRAYSCALE):
+            raise PsdError(f"{self.path} has colour mode {self.mode}, only RGB and grayscale are supported")
+
+        (color_data,) = struct.unpack(">I", f.read(4))
+        f.seek(color_data, 1)
+
+        (resources,) = struct.unpack(">I", f.read(4))
+        self._parse_resources(f, f.tell() + resources)
+
+        length = self._read_length(f)
+        section_end = f.tell() + length
+        if length:
+            info_length = self._read_length(f)
+            info_end = f.tell() + info_length
+            if info_length:
+                self._parse_layer_info(f)
+            f.seek(info_end)
+            (mask_length,) = struct.unpack(">I", f.read(4))
+            f.seek(mask_length, 1)
+            if not self.layers:
+                # 16 bit documents keep their layers in an "Lr16" block after the global mask
+                self._parse_global_blocks(f, section_end)
+        self.image_data_offset = section_end
+
+    def _parse_resources(self, f, end):
+        while f.tell() + 12 <= end:
+            if f.read(4) != b"8BIM":
+                break
+            (resource_id, name_length) = struct.unpack(">HB", f.read(3))
+            f.seek(name_length + (name_length + 1) % 2, 1)
+            (size,) = struct.unpack(">I", f.read(4))
+            data = f.read(size + size % 2)
+            if resource_id == RESOURCE_VERSION_INFO and size >= 5:
+                self.has_real_merged_data = bool(data[4])
+        f.seek(end)
+
+    def _parse_global_blocks(self, f, end):
+        while f.tell() + 12 <= end:
+            signature = f.read(4)
+            if signature not in (b"8BIM", b"8B64"):
+                break
+            key = f.read(4)
+            length = self._read_length(f, key in _PSB_LONG_KEYS)
+            block_end = f.tell() + length
+            if key == b"Lr16":
+                self._parse_layer_info(f)
+            f.seek(block_end)
+
+    def _parse_layer_info(self, f):
+        (count,) = struct.unpack(">h", f.read(2))
+        records = []
+        for _ in range(abs(count)):
+            top, left, bottom, right, channel_count = struct.unpack(">4iH", f.read(18))
+            channels = [(struct.unpack(">h", f.read(2))[0], self._read_length(f)) for _ in range(channel_count)]
+            signature, blend_mode, opacity, clipping, flags, _, extra = struct.unpack(">4s4sBBBBI", f.read(16))
+            if signature != b"8BIM":
+                raise PsdError(f"{self.path} has a corrupt layer record")
+            extra_end = f.tell() + extra
+
+            (mask_length,) = struct.unpack(">I", f.read(4))
+            mask = None
+            if mask_length >= 18:
+                mask_top, mask_left, mask_bottom, mask_right, default, mask_flags = struct.unpack(">4iBB", f.read(18))
+                mask = Mask(mask_top, mask_left, mask_bottom, mask_right, default, bool(mask_flags & 0x02))
+                f.seek(mask_length - 18, 1)
+            else:
+                f.seek(mask_length, 1)
+            (ranges_length,) = struct.unpack(">I", f.read(4))
+            f.seek(ranges_length, 1)
+            (name_length,) = struct.unpack(">B", f.read(1))
+            name = f.read(name_length).decode("latin-1")
+            f.seek((4 - (name_length + 1) % 4) % 4, 1)
+
+            divider = 0
+            while f.tell() + 12 <= extra_end:
+                if f.read(4) not in (b"8BIM", b"8B64"):
+                    break
+                key = f.read(4)
+                length = self._read_length(f, key in _PSB_LONG_KEYS)
+                block_end = f.tell() + length
+                if key in (b"lsct", b"lsdk") and length >= 4:
+                    (divider,) = struct.unpack(">I", f.read(4))
+                f.seek(block_end)
+            f.seek(extra_end)
+            records.append((name, top, left, bottom, right, channels, blend_mode, opacity,
+                            not flags & FLAG_HIDDEN, mask, divider))
+
+        # Channel data follows all records, layer by layer, channel by channel
+        offset = f.tell()
+        layers = []
+        for record in records:
+            channels = []
+            for channel_id, length in record[5]:
+                channels.append(Channel(channel_id, offset, length))
+                offset += length
+            layers.append(Layer(*record[:5], channels, *record[6:]))
+        f.seek(offset)
+        self.layers = _resolve_group_visibility(layers)
+
+    def _read_plane(self, f, compression, data_length, rows, width, counts=None):
+        """Read and decode rows of one channel at the current position into (rows, width) uint8."""
+        row_bytes = width * self.depth // 8
+        if compression == COMPRESSION_RAW:
+            data = np.frombuffer(f.read(rows * row_bytes), np.uint8).reshape(rows, row_bytes)
+        elif compression == COMPRESSION_RLE:
+            if counts is None:
+                size = 4 if self.version == 2 else 2
+                counts = np.frombuffer(f.read(rows * size), ">u4" if size == 4 else ">u2")
+            data = decode_rle(f.read(int(counts.sum())), counts, row_bytes)
+        elif compression in (COMPRESSION_ZIP, COMPRESSION_ZIP_PREDICTION):
+            data = np.frombuffer(zlib.decompress(f.read(data_length)), np.uint8).reshape(rows, row_bytes)
+            if compression == COMPRESSION_ZIP_PREDICTION:
+                data = _unpredict(data, self.depth)
+        else:
+            raise PsdError(f"{self.path} uses unknown compression {compression}")
+        return _to_8bit(data, self.depth, width)
+
+    @property
+    def color_channels(self):
+        return 3 if self.mode == MODE_RGB else 1
+
+    def merged_image(self):
+        """
+        Decode the merged composite stored after the layers, one channel at a time.
+
+        The first channel after the colour channels is used as alpha; in the
+        textures here that is the alpha of _ca files.
+        """
+        channels = min(self.channels, self.color_channels + 1)
+        pixels = np.empty((self.height, self.width, channels), np.uint8)
+        with open(self.path, "rb") as f:
+            f.seek(self.image_data_offset)
+            (compression,) = struct.unpack(">H", f.read(2))
+            counts = None
+            if compression == COMPRESSION_RLE:
+                size = 4 if self.version == 2 else 2
+                counts = np.frombuffer(f.read(self.channels * self.height * size), ">u4" if size == 4 else ">u2")
+            elif compression != COMPRESSION_RAW:
+                raise PsdError(f"{self.path} has a merged image with compression {compression}")
+            for channel in range(channels):
+                channel_counts = None if counts is None else counts[channel * self.height:(channel + 1) * self.height]
+                pixels[:, :, channel] = self._read_plane(f, compression, None, self.height, self.width, channel_counts)
+        return _to_image(pixels, self.color_channels)
+
+    def _read_layer_channel(self, f, channel, width, height):
+        f.seek(channel.offset)
+        (compression,) = struct.unpack(">H", f.read(2))
+        return self._read_plane(f, compression, channel.length - 2, height, width)
+
+    def composite(self):
+        """
+        Flatten the visible raster layers, bottom to top, into an RGBA image.
+
+        Layers are read one at a time and blended with their opacity and user
+        mask as normal layers; other blend modes, clipping and group opacity
+        are not applied.
+        """
+        canvas = np.zeros((self.height, self.width, 4), np.float32)
+        with open(self.path, "rb") as f:
+            for layer in self.layers:
+                if not layer.visible or layer.divider or layer.opacity == 0:
+                    continue
+                width, height = layer.right - layer.left, layer.bottom - layer.top
+                if width <= 0 or height <= 0:
+                    continue
+                pixels = np.empty((height, width, 4), np.uint8)
+                pixels[:, :, 3] = 255
+                mask = None
+                for channel in layer.channels:
+                    if 0 <= channel.id < self.color_channels:
+                        plane = self._read_layer_channel(f, channel, width, height)
+                        targets = [channel.id] if self.color_channels == 3 else [0, 1, 2]
+                        for target in targets:
+                            pixels[:, :, target] = plane
+                    elif channel.id == CHANNEL_TRANSPARENCY:
+                        pixels[:, :, 3] = self._read_layer_channel(f, channel, width, height)
+                    elif channel.id == CHANNEL_USER_MASK and layer.mask is not None and not layer.mask.disabled:
+                        mask = self._layer_mask(f, layer, channel)
+                _blend_normal(canvas, pixels, mask, layer.top, layer.left, layer.opacity / 255.0)
+
+        result = np.empty((self.height, self.width, 4), np.uint8)
+        rows = _band_rows(self.width)
+        for top in range(0, self.height, rows):
+            band = canvas[top:top + rows]
+            alpha = band[:, :, 3:]
+            rgb = np.divide(band[:, :, :3], alpha, out=np.zeros_like(band[:, :, :3]), where=alpha > 0)
+            result[top:top + rows, :, :3] = np.clip(np.rint(rgb), 0, 255)
+            result[top:top + rows, :, 3:] = np.clip(np.rint(alpha * 255.0), 0, 255)
+        return Image.fromarray(result, "RGBA")
+
+    def _layer_mask(self, f, layer, channel):
+        """The user mask of a layer over the layer's own rectangle, default colour outside the mask's."""
+        mask = layer.mask
+        mask_width, mask_height = mask.right - mask.left, mask.bottom - mask.top
+        result = np.full((layer.bottom - layer.top, layer.right - layer.left), mask.default, np.uint8)
+        if mask_width <= 0 or mask_height <= 0:
+            return result
+        plane = self._read_layer_channel(f, channel, mask_width, mask_height)
+        top, left = max(mask.top, layer.top), max(mask.left, layer.left)
+        bottom, right = min(mask.bottom, layer.bottom), min(mask.right, layer.right)
+        if top < bottom and left < right:
+            result[top - layer.top:bottom - layer.top, left - layer.left:right - layer.left] = \
+                plane[top - mask.top:bottom - mask.top, left - mask.left:right - mask.left]
+        return result
+
+    def to_image(self):
+        """The flattened image: the merged composite when the file has a real one, else the composited layers."""
+        if self.has_real_merged_data or not self.layers:
+            return self.merged_image()
+        return self.composite()
+
+
+def _resolve_group_visibility(layers):
+    """Hide the layers inside hidden groups; records run bottom to top, a group's folder record above its layers."""
+    hidden = []
+    resolved = []
+    for layer in reversed(layers):
+        if layer.divider in (DIVIDER_OPEN, DIVIDER_CLOSED):
+            hidden.append(bool(hidden and hidden[-1]) or not layer.visible)
+        elif layer.divider == DIVIDER_END:
+            if hidden:
+                hidden.pop()
+        elif hidden and hidden[-1]:
+            layer = layer._replace(visible=False)
+        resolved.append(layer)
+    return resolved[::-1]
+
+
+def _band_rows(width):
+    return max(1, BLEND_CHUNK_PIXELS // max(1, width))
+
+
+def _blend_normal(canvas, pixels, mask, top, left, opacity):
+    """
+    Composite uint8 straight alpha pixels at (top, left) over a premultiplied float canvas, clipped to it.
+
+    Canvas colours are 0-255 and its alpha 0-1; mask is an optional uint8
+    plane scaling the alpha of pixels. Blends BLEND_CHUNK_PIXELS at a time,
+    so float copies of the layer stay small.
+    """
+    height, width = canvas.shape[:2]
+    y0, x0 = max(top, 0), max(left, 0)
+    y1, x1 = min(top + pixels.shape[0], height), min(left + pixels.shape[1], width)
+    if y0 >= y1 or x0 >= x1:
+        return
+    rows = _band_rows(x1 - x0)
+    for band_top in range(y0, y1, rows):
+        band_bottom = min(band_top + rows, y1)
+        source = pixels[band_top - top:band_bottom - top, x0 - left:x1 - left]
+        alpha = source[:, :, 3:] * np.float32(opacity / 255.0)
+        if mask is not None:
+            alpha *= mask[band_top - top:band_bottom - top, x0 - left:x1 - left, None] * np.float32(1 / 255.0)
+        region = canvas[band_top:band_bottom, x0:x1]
+        region[:, :, :3] = source[:, :, :3] * alpha + region[:, :, :3] * (1.0 - alpha)
+        region[:, :, 3:] = alpha + region[:, :, 3:] * (1.0 - alpha)
+
+
+def _to_image(pixels, color_channels):
+    if color_channels == 3:
+        return Image.fromarray(pixels, "RGBA" if pixels.shape[2] == 4 else "RGB")
+    if pixels.shape[2] == 2:
+        return Image.fromarray(pixels, "LA")
+    return Image.fromarray(pixels[:, :, 0], "L")
+
+
+def read_psd(path):
+    """Open a PSD or PSB file and parse its headers and layer records."""
+    return PsdFile(path)
+
+
+def psd_to_png(src_path, dst_path):
+    """Flatten a PSD and save it as a PNG, written next to dst_path and renamed over it."""
+    image = read_psd(src_path).to_image()
+    temp_path = dst_path + ".tmp"
+    image.save(temp_path, format="PNG")
+    os.replace(temp_path, dst_path)
@@ -0,0 +1,74 @@
+"""
+Stand-in for an external texture converter such as Pal2PacE, for running and
+benchmarking converter_backends.ToolBackend on any platform.
+
+    python stand_in_converter.py SOURCE OUTPUT    convert one file
+    python stand_in_converter.py @LIST            convert SOURCE<TAB>OUTPUT lines of LIST
+    python stand_in_converter.py --serve          convert SOURCE<TAB>OUTPUT lines from stdin,
+                                                  answering "ok" or "error <message>" per line
+
+.paa files become .png and .png files become .paa through the native paa
+module. With --copy the bytes are copied unchanged instead, which leaves
+only the cost of invoking the tool.
+"""
+import shutil
+import sys
+
+
+def convert(source, output, copy=False):
+    if copy:
+        shutil.copyfile(source, output)
+        return
+    import paa
+    if source.lower().endswith(".paa"):
+        paa.paa_to_png(source, output)
+    elif source.lower().endswith(".png"):
+        paa.png_to_paa(source, output)
+    else:
+        raise ValueError(f"cannot convert {source}")
+
+
+def _pairs(lines):
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line:
+            source, _, output = line.partition("\t")
+            yield source, output
+
+
+def serve(copy=False):
+    for source, output in _pairs(sys.stdin):
+        try:
+            convert(source, output, copy)
+            reply = "ok"
+        except Exception as e:
+            reply = f"error {type(e).__name__}: {e}".replace("\n", " ")
+        sys.stdout.write(reply + "\n")
+        sys.stdout.flush()
+
+
+def main(argv):
+    copy = "--copy" in argv
+    args = [arg for arg in argv if arg != "--copy"]
+    if args == ["--serve"]:
+        serve(copy)
+        return 0
+    if len(args) == 1 and args[0].startswith("@"):
+        failed = 0
+        with open(args[0][1:], "r", encoding="utf-8") as f:
+            for source, output in _pairs(f):
+                try:
+                    convert(source, output, copy)
+                except Exception as e:
+                    print(f"{source}: {e}", file=sys.stderr)
+                    failed += 1
+        return 1 if failed else 0
+    if len(args) == 2:
+        convert(args[0], args[1], copy)
+        return 0
+    print(__doc__, file=sys.stderr)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,133 @@
+"""
+Generate a synthetic modding tree for benchmarks.
+
+The layout mirrors a real project:
+
+    raw/        unpacked addon: .paa textures plus models, materials and configs
+    extracted/  .png conversions of every texture, as the viewer sees them
+    edited/     edited .png textures for a quarter of them
+    patched/    empty, for the build to fill
+    tags.json   every third extracted texture tagged "copy"
+
+Texture paths follow CUP naming, e.g.
+CUP/weapons/cup_weapons_west_attachments_1/optic_3/data/lens_2_ca.paa, with
+_ca, _co, _nohq and _smdi suffixes and sizes from 64 to 512 pixels.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+import paa
+
+SCALES = {
+    # mods, directories per mod, textures per directory
+    "small": (2, 4, 5),
+    "medium": (4, 8, 8),
+    "large": (8, 16, 10),
+}
+
+SUFFIXES = ("_ca", "_co", "_nohq", "_smdi")
+SIZES = (64, 128, 256, 512)
+DIR_NAMES = ("optic", "magazine", "rail", "suppressor", "grip", "sight")
+MARKER = "corpus.json"
+
+
+def _texture(rng, size, suffix):
+    """Smooth gradients with noise, the kind of content DXT encoders see."""
+    width, height = size, size // 2 if rng.random() < 0.25 else size
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = rng.uniform(0, 255, 3)
+    slope = rng.uniform(-1, 1, (2, 3)) * 255 / max(width, height)
+    rgb = base + x[..., None] * slope[0] + y[..., None] * slope[1] + rng.normal(0, 6, (height, width, 3))
+    if suffix == "_nohq":
+        rgb[..., 2] = 255 - np.abs(rgb[..., 2] - 128) / 4
+    rgba = np.empty((height, width, 4), np.uint8)
+    rgba[..., :3] = np.clip(rgb, 0, 255)
+    if suffix == "_ca":
+        rgba[..., 3] = np.clip(128 + 127 * np.sin(x / 7.0 + y / 11.0), 0, 255)
+    else:
+        rgba[..., 3] = 255
+    return Image.fromarray(rgba, "RGBA")
+
+
+def texture_paths(scale="small"):
+    """Return the relative texture paths, without extension, for a scale."""
+    mods, dirs, textures = SCALES[scale]
+    paths = []
+    for m in range(mods):
+        for d in range(dirs):
+            directory = os.path.join("CUP", "weapons", f"cup_weapons_west_attachments_{m}",
+                                     f"{DIR_NAMES[d % len(DIR_NAMES)]}_{d}", "data")
+            for t in range(textures):
+                paths.append(os.path.join(directory, f"texture_{t}{SUFFIXES[t % len(SUFFIXES)]}"))
+    return paths
+
+
+def make_corpus(root, scale="small", seed=0):
+    """
+    Create the tree under root, or reuse it when one of the same scale and seed is there.
+
+    :return: dict with the paths of the tree's parts and its texture count
+    """
+    layout = {name: os.path.join(root, name) for name in ("raw", "extracted", "edited", "patched")}
+    layout["tags"] = os.path.join(root, "tags.json")
+    marker_path = os.path.join(root, MARKER)
+    params = {"scale": scale, "seed": seed}
+    try:
+        with open(marker_path, "r") as f:
+            if json.load(f) == params:
+                layout["textures"] = len(texture_paths(scale))
+                return layout
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+
+    rng = np.random.default_rng(seed)
+    tags = {}
+    rel_paths = texture_paths(scale)
+    for i, rel_path in enumerate(rel_paths):
+        suffix = SUFFIXES[i % len(SUFFIXES)]
+        image = _texture(rng, int(rng.choice(SIZES)), suffix)
+
+        for name in ("raw", "extracted"):
+            os.makedirs(os.path.dirname(os.path.join(layout[name], rel_path)), exist_ok=True)
+        paa.write_paa(os.path.join(layout["raw"], rel_path + ".paa"), image)
+        image.save(os.path.join(layout["extracted"], rel_path + ".png"))
+
+        if i % 4 == 0:
+            edited_path = os.path.join(layout["edited"], rel_path + ".png")
+            os.makedirs(os.path.dirname(edited_path), exist_ok=True)
+            Image.fromarray(255 - np.asarray(image), "RGBA").save(edited_path)
+        if i % 3 == 0:
+            tags[rel_path + ".png"] = ["copy"]
+
+    # Non-texture files the build mirrors from raw/
+    for directory in sorted({os.path.dirname(p) for p in rel_paths}):
+        model_dir = os.path.dirname(os.path.join(layout["raw"], directory))
+        with open(os.path.join(model_dir, "model.p3d"), "wb") as f:
+            f.write(rng.bytes(int(rng.integers(20_000, 200_000))))
+        with open(os.path.join(layout["raw"], directory, "material.rvmat"), "w") as f:
+            f.write("class Stage1 { texture = \"data\\texture_0_nohq.paa\"; };\n")
+    for m in range(SCALES[scale][0]):
+        with open(os.path.join(layout["raw"], "CUP", "weapons", f"cup_weapons_west_attachments_{m}", "config.cpp"), "w") as f:
+            f.write("class CfgPatches {};\n")
+
+    os.makedirs(layout["patched"], exist_ok=True)
+    with open(layout["tags"], "w") as f:
+        json.dump(tags, f, indent=4)
+    with open(marker_path, "w") as f:
+        json.dump(params, f)
+    layout["textures"] = len(rel_paths)
+    return layout
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic modding tree for benchmarks.")
+    parser.add_argument("root")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    corpus = make_corpus(args.root, args.scale, args.seed)
+    print(f"{corpus['textures']} textures under {args.root}")
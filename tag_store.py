@@ -0,0 +1,276 @@
+"""Journaled tag storage for the image viewer."""
+import json
+import os
+import threading
+
+JOURNAL_SUFFIX = ".journal"
+
+
+def _read_snapshot(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _read_journal(path):
+    """Return the decoded journal records, dropping a torn last line."""
+    records = []
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Only the last line can be partial, after a crash mid write
+                    break
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def load_tags(path):
+    """
+    Return {image: [tags]} for a tags.json file plus any journal next to it.
+
+    Use this instead of reading tags.json directly while a viewer may still
+    have changes in its journal.
+    """
+    tags = _read_snapshot(path)
+    for record in _read_journal(path + JOURNAL_SUFFIX):
+        _apply(tags, record)
+    return {image: image_tags for image, image_tags in tags.items() if image_tags}
+
+
+def _apply(tags, record):
+    """Apply one journal record to a tags dict. Records set state, so replaying them twice is harmless."""
+    op = record.get("op")
+    if op not in ("add", "remove"):
+        return
+    image_tags = tags.setdefault(record["image"], [])
+    if op == "add" and record["tag"] not in image_tags:
+        image_tags.append(record["tag"])
+    elif op == "remove" and record["tag"] in image_tags:
+        image_tags.remove(record["tag"])
+
+
+class TagStore:
+    """
+    Image tags kept in tags.json plus an append-only journal.
+
+    Each change is one small JSON line. Lines are batched and appended by a
+    background thread, so tagging never waits on the disk. Once the journal
+    grows past `compact_after` records it is folded back into tags.json, which
+    stays in the original format for other tools. The undo history is kept in
+    the journal too, so undo works across restarts.
+
+    Both files are replaced atomically during compaction, and journal records
+    set state rather than toggle it, so a crash at any point loses at most the
+    last unflushed batch.
+    """
+
+    def __init__(self, path="tags.json", flush_interval=0.5, compact_after=1000, history_limit=1000):
+        self.path = path
+        self.journal_path = path + JOURNAL_SUFFIX
+        self.flush_interval = flush_interval
+        self.compact_after = compact_after
+        self.history_limit = history_limit
+
+        self.tags = {}
+        self.history = []
+        self._by_tag = {}
+        self._journal_records = 0
+        self._pending = []
+        self._lock = threading.RLock()
+        # Serialises journal appends and compaction
+        self._io_lock = threading.RLock()
+        self._condition = threading.Condition(threading.Lock())
+        self._closed = False
+
+        self.load()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def load(self):
+        """Read tags.json and replay the journal on top of it."""
+        with self._lock:
+            self.tags = {image: list(tags) for image, tags in _read_snapshot(self.path).items() if isinstance(tags, list)}
+            self.history = []
+            records = _read_journal(self.journal_path)
+            for record in records:
+                op = record.get("op")
+                if op == "history":
+                    self.history = list(record["entries"])
+                elif op == "undo":
+                    if self.history:
+                        self.history.pop()
+                else:
+                    _apply(self.tags, record)
+                    if record.get("action"):
+                        entry = {"image": record["image"], "tag": record["tag"], "action": record["action"]}
+                        if record.get("images"):
+                            entry["images"] = record["images"]
+                        self.history.append(entry)
+            del self.history[:-self.history_limit]
+            self._journal_records = len(records)
+            self._rebuild_index()
+
+    def _rebuild_index(self):
+        self._by_tag = {}
+        for image, tags in self.tags.items():
+            for tag in tags:
+                self._by_tag.setdefault(tag, set()).add(image)
+
+    def _set(self, image, tag, present, action=None, images=None):
+        """Add or remove one tag, updating the index and queueing a journal record."""
+        image_tags = self.tags.setdefault(image, [])
+        if present and tag not in image_tags:
+            image_tags.append(tag)
+            self._by_tag.setdefault(tag, set()).add(image)
+        elif not present and tag in image_tags:
+            image_tags.remove(tag)
+            self._by_tag.get(tag, set()).discard(image)
+        record = {"op": "add" if present else "remove", "image": image, "tag": tag}
+        if action:
+            record["action"] = action
+        if images:
+            record["images"] = images
+        self._queue(record)
+
+    def _queue(self, record):
+        with self._condition:
+            self._pending.append(record)
+            self._condition.notify()
+
+    def toggle(self, image, tag):
+        """Toggle a tag on an image and record it for undo; returns "added" or "removed"."""
+        return self.toggle_many([image], tag)
+
+    def toggle_many(self, images, tag):
+        """
+        Toggle a tag on a group of images, e.g. identical duplicates, as one undoable change.
+
+        The first image decides whether the tag is added or removed; the
+        others are brought to the same state. Returns "added" or "removed".
+        """
+        with self._lock:
+            action = "removed" if tag in self.tags.get(images[0], ()) else "added"
+            present = action == "added"
+            changed = [image for image in images if (tag in self.tags.get(image, ())) != present]
+            entry = {"image": changed[0], "tag": tag, "action": action}
+            if len(changed) > 1:
+                entry["images"] = changed
+            for image in changed:
+                if image == changed[0]:
+                    self._set(image, tag, present, action, entry.get("images"))
+                else:
+                    self._set(image, tag, present)
+            self.history.append(entry)
+            if len(self.history) > self.history_limit:
+                del self.history[0]
+            return action
+
+    def undo(self):
+        """Revert the last toggle; returns its history entry, or None when there is nothing to undo."""
+        with self._lock:
+            if not self.history:
+                return None
+            last_action = self.history.pop()
+            for image in last_action.get("images", [last_action["image"]]):
+                self._set(image, last_action["tag"], last_action["action"] == "removed")
+            self._queue({"op": "undo"})
+            return last_action
+
+    def tags_for(self, image):
+        with self._lock:
+            return list(self.tags.get(image, ()))
+
+    def images_with(self, tag):
+        """Return the images carrying tag, sorted."""
+        with self._lock:
+            return sorted(self._by_tag.get(tag, ()))
+
+    def tag_names(self):
+        with self._lock:
+            return sorted(tag for tag, images in self._by_tag.items() if images)
+
+    def as_dict(self):
+        """Return a copy of the tags in the tags.json layout, without untagged images."""
+        with self._lock:
+            return {image: list(tags) for image, tags in self.tags.items() if tags}
+
+    def import_json(self, path, replace=False):
+        """Merge the tags of a tags.json file into the store, or replace them all."""
+        imported = _read_snapshot(path)
+        with self._lock:
+            if replace:
+                for image, tags in list(self.tags.items()):
+                    for tag in list(tags):
+                        if tag not in imported.get(image, ()):
+                            self._set(image, tag, False)
+            for image, tags in imported.items():
+                for tag in tags:
+                    self._set(image, tag, True)
+
+    def export_json(self, path):
+        """Write the tags to path in the tags.json format, atomically."""
+        self._write_snapshot(path, self.as_dict())
+
+    def _write_snapshot(self, path, tags):
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            # pretty print the json so it's easier to read
+            json.dump(tags, f, indent=4)
+        os.replace(temp_path, path)
+
+    def flush(self):
+        """Append every queued record to the journal now."""
+        with self._io_lock:
+            with self._condition:
+                records = self._pending
+                self._pending = []
+            if records:
+                with open(self.journal_path, "a") as f:
+                    f.write("".join(json.dumps(record) + "\n" for record in records))
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._journal_records += len(records)
+            if self._journal_records >= self.compact_after:
+                self.compact()
+
+    def compact(self):
+        """Fold the journal into tags.json and start a new journal holding only the undo history."""
+        with self._io_lock:
+            with self._lock:
+                tags = self.as_dict()
+                history = list(self.history)
+                with self._condition:
+                    # Already part of the state captured above
+                    self._pending = []
+            self._write_snapshot(self.path, tags)
+            temp_path = self.journal_path + ".tmp"
+            with open(temp_path, "w") as f:
+                f.write(json.dumps({"op": "history", "entries": history}) + "\n")
+            os.replace(temp_path, self.journal_path)
+            self._journal_records = 1
+
+    def close(self):
+        """Stop the writer thread, then flush and compact."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self.flush()
+        self.compact()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                # Let further key presses join this batch
+                self._condition.wait(self.flush_interval)
+            self.flush()
@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+from compression import DecompressionError, iter_lzss_decompress, lzo1x_compress, lzo1x_decompress, lzss_decompress
+
+
+def _lzss_compress(data):
+    """Greedy Bohemia LZSS encoder with checksum, enough to produce both literals and matches."""
+    out = bytearray()
+    pos = 0
+    while pos < len(data):
+        flags_at = len(out)
+        out.append(0)
+        for bit in range(8):
+            if pos >= len(data):
+                break
+            best_length, best_distance = 0, 0
+            for distance in range(1, min(pos, 0xFFF) + 1):
+                length = 0
+                while length < 18 and pos + length < len(data) and data[pos + length - distance] == data[pos + length]:
+                    length += 1
+                if length > best_length:
+                    best_length, best_distance = length, distance
+            if best_length >= 3:
+                out += bytes([best_distance & 0xFF, ((best_distance >> 4) & 0xF0) | (best_length - 3)])
+                pos += best_length
+            else:
+                out[flags_at] |= 1 << bit
+                out.append(data[pos])
+                pos += 1
+    return bytes(out) + (sum(data) & 0xFFFFFFFF).to_bytes(4, "little")
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    b"a",
+    b"abcabcabcabcabcabcabc" * 50,
+    bytes(range(256)) * 8,
+    os.urandom(3000),
+    b"\0" * 10000 + os.urandom(500) + b"\0" * 10000,
+])
+def test_lzo_round_trip(data):
+    assert lzo1x_decompress(lzo1x_compress(data), len(data)) == data
+
+
+def test_lzo_compresses_repetitive_data():
+    data = b"DXT block " * 1000
+    assert len(lzo1x_compress(data)) < len(data) // 10
+
+
+def test_lzo_rejects_wrong_length():
+    data = b"hello world " * 20
+    with pytest.raises(DecompressionError):
+        lzo1x_decompress(lzo1x_compress(data), len(data) + 1)
+
+
+@pytest.mark.parametrize("data", [
+    b"abcdefgh",
+    b"abcabcabcabcabcabcabcabc" * 30,
+    bytes(range(256)) * 20,
+])
+def test_lzss_round_trip(data):
+    packed = _lzss_compress(data)
+    assert lzss_decompress(packed, len(data), check=True) == data
+
+
+def test_lzss_streams_in_chunks():
+    data = bytes(range(256)) * 40 + b"xyz" * 3000
+    chunks = list(iter_lzss_decompress(_lzss_compress(data), len(data), chunk_size=1024, check=True))
+    assert len(chunks) > 1
+    assert b"".join(chunks) == data
+
+
+def test_lzss_match_before_start_reads_spaces():
+    # One match of length 3 reaching 5 bytes before the start of the output
+    packed = bytes([0x00, 0x05, 0x00])
+    assert lzss_decompress(packed, 3) == b"   "
+
+
+def test_lzss_checksum_mismatch():
+    data = b"checksum me " * 10
+    packed = bytearray(_lzss_compress(data))
+    packed[-1] ^= 0xFF
+    with pytest.raises(DecompressionError):
+        lzss_decompress(bytes(packed), len(data), check=True)
+
+
+def test_lzss_truncated():
+    data = bytes(range(200))
+    with pytest.raises(DecompressionError):
+        lzss_decompress(_lzss_compress(data)[:50], len(data))
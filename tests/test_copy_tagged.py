@@ -0,0 +1,86 @@
+import json
+import os
+
+import pytest
+
+from copy_tagged import PathResolver, compile_tag_filter, copy_tagged_images, normalize_tag_path
+
+
+@pytest.mark.parametrize("expression, tags, expected", [
+    ("copy", ["copy"], True),
+    ("copy", ["skip"], False),
+    # NOT binds tighter than AND, AND tighter than OR
+    ("copy AND NOT skip", ["copy", "skip"], False),
+    ("copy AND NOT skip", ["copy"], True),
+    ("NOT copy AND skip", ["skip"], True),
+    ("review OR copy AND NOT skip", ["review", "skip"], True),
+    ("review OR copy AND NOT skip", ["copy", "skip"], False),
+    ("(review OR copy) AND NOT skip", ["review", "skip"], False),
+    ("NOT NOT copy", ["copy"], True),
+    ("copy and not skip", ["copy"], True),
+])
+def test_tag_filter_precedence(expression, tags, expected):
+    assert compile_tag_filter(expression)(tags) is expected
+
+
+@pytest.mark.parametrize("expression", ["", "copy AND", "(copy", "copy)", "AND copy", "copy skip"])
+def test_tag_filter_errors(expression):
+    with pytest.raises(ValueError):
+        compile_tag_filter(expression)
+
+
+def test_normalize_tag_path():
+    assert normalize_tag_path("a\\b\\c.png") == os.path.join("a", "b", "c.png")
+    assert normalize_tag_path("/a//b/c.png") == os.path.join("a", "b", "c.png")
+
+
+@pytest.mark.parametrize("key", ["..\\..\\x.png", "a/../../x.png", "C:\\Windows\\x.png", "c:x.png", "\\"])
+def test_normalize_tag_path_rejects_keys_outside_the_tree(key):
+    with pytest.raises(ValueError):
+        normalize_tag_path(key)
+
+
+def test_copy_tagged_images_skips_keys_outside_the_tree(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    (tmp_path / "secret.png").write_bytes(b"secret")
+    tags_file = tmp_path / "tags.json"
+    tags_file.write_text(json.dumps({"..\\secret.png": ["copy"]}))
+    dest = tmp_path / "out" / "dest"
+
+    report = copy_tagged_images(str(tags_file), str(src), str(dest))
+    assert report.copied == []
+    assert [key for key, error in report.failed] == ["..\\secret.png"]
+    assert not (tmp_path / "out" / "secret.png").exists()
+
+
+def test_resolver_ignores_case(tmp_path):
+    (tmp_path / "CUP" / "Data").mkdir(parents=True)
+    (tmp_path / "CUP" / "Data" / "Glass_CA.png").write_bytes(b"x")
+    resolver = PathResolver(str(tmp_path))
+    assert resolver.resolve(os.path.join("cup", "data", "glass_ca.png")) == os.path.join("CUP", "Data", "Glass_CA.png")
+    assert resolver.resolve(os.path.join("cup", "data", "missing.png")) is None
+    assert resolver.resolve(os.path.join("nope", "glass_ca.png")) is None
+
+
+def test_copy_tagged_images(tmp_path):
+    src = tmp_path / "src"
+    (src / "Weapons" / "Data").mkdir(parents=True)
+    (src / "Weapons" / "Data" / "lens_CA.png").write_bytes(b"lens")
+    (src / "Weapons" / "Data" / "body_co.png").write_bytes(b"body")
+    tags_file = tmp_path / "tags.json"
+    tags_file.write_text(json.dumps({
+        "weapons\\data\\lens_ca.png": ["copy"],
+        "weapons\\data\\body_co.png": ["copy", "skip"],
+        "weapons\\data\\gone_ca.png": ["copy"],
+    }))
+    dest = tmp_path / "dest"
+
+    report = copy_tagged_images(str(tags_file), str(src), str(dest), tag="copy AND NOT skip")
+    assert report.copied == [os.path.join("Weapons", "Data", "lens_CA.png")]
+    assert report.missing == [os.path.join("weapons", "data", "gone_ca.png")]
+    assert (dest / "Weapons" / "Data" / "lens_CA.png").read_bytes() == b"lens"
+
+    report = copy_tagged_images(str(tags_file), str(src), str(dest), tag="copy AND NOT skip")
+    assert report.copied == []
+    assert report.skipped == [os.path.join("Weapons", "Data", "lens_CA.png")]
@@ -0,0 +1,30 @@
+import os
+
+from PIL import Image
+
+from image_cache import ImageCache
+
+
+def test_rewritten_file_is_decoded_again(tmp_path):
+    path = str(tmp_path / "glass_ca.png")
+    Image.new("RGBA", (4, 4), (255, 0, 0, 255)).save(path)
+    cache = ImageCache()
+    assert cache.get(path).getpixel((0, 0)) == (255, 0, 0, 255)
+    assert cache.get(path).getpixel((0, 0)) == (255, 0, 0, 255)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    before = os.stat(path)
+    Image.new("RGBA", (8, 8), (0, 0, 255, 255)).save(path)
+    # Keep the old mtime, as a coarse clock could; the size still tells them apart
+    os.utime(path, ns=(before.st_atime_ns, before.st_mtime_ns))
+    assert not cache.has(path)
+    assert cache.get(path).getpixel((0, 0)) == (0, 0, 255, 255)
+    assert cache.misses == 2
+
+
+def test_keys_without_stamp():
+    loads = []
+    cache = ImageCache(loader=lambda key, fit: loads.append(key) or b"data", sizer=len, stamp=None)
+    assert cache.get(("a", 1)) == b"data"
+    assert cache.get(("a", 1)) == b"data"
+    assert loads == [("a", 1)]
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import paa
+
+
+def _texture(size, alpha=True):
+    y, x = np.mgrid[:size, :size]
+    rgba = np.stack([x * 255 // size, y * 255 // size, (x + y) * 127 // size,
+                     (x * 255 // size) if alpha else np.full_like(x, 255)], axis=2)
+    return rgba.astype(np.uint8)
+
+
+@pytest.mark.parametrize("fit", ["range", "cluster"])
+def test_dxt5_round_trip(tmp_path, fit):
+    rgba = _texture(256)
+    path = str(tmp_path / "gradient_ca.paa")
+    paa.write_paa(path, Image.fromarray(rgba, "RGBA"), fit=fit)
+
+    texture = paa.read_paa(path)
+    assert texture.type == paa.PAX_DXT5
+    assert (texture.mipmaps[0].width, texture.mipmaps[0].height) == (256, 256)
+    # 256 wide mipmaps are LZO compressed
+    assert texture.mipmaps[0].compressed == "lzo"
+    decoded = texture.decode_mipmap(0).astype(int)
+    # DXT keeps colours to 5/6 bits plus interpolation, alpha to 3 bit indices
+    assert np.abs(decoded[:, :, :3] - rgba[:, :, :3]).max() <= 16
+    assert np.abs(decoded[:, :, 3] - rgba[:, :, 3]).max() <= 8
+
+
+def test_dxt1_round_trip_and_mipmaps(tmp_path):
+    rgba = _texture(64, alpha=False)
+    path = str(tmp_path / "gradient_co.paa")
+    paa.write_paa(path, Image.fromarray(rgba, "RGBA"))
+
+    texture = paa.read_paa(path)
+    assert texture.type == paa.PAX_DXT1
+    assert [(mip.width, mip.height) for mip in texture.mipmaps] == [(64, 64), (32, 32), (16, 16), (8, 8), (4, 4)]
+    decoded = texture.decode_mipmap(0).astype(int)
+    assert np.abs(decoded[:, :, :3] - rgba[:, :, :3]).max() <= 16
+    assert (decoded[:, :, 3] == 255).all()
+    # Each level is the box reduced level above it; steeper gradients per block cost DXT more
+    small = np.asarray(Image.fromarray(rgba, "RGBA").reduce(2)).astype(int)
+    assert np.abs(texture.decode_mipmap(1).astype(int)[:, :, :3] - small[:, :, :3]).mean() <= 6
+
+
+def test_choose_pax_type():
+    opaque = _texture(8, alpha=False)
+    assert paa.choose_pax_type("x/glass_ca.paa", opaque) == paa.PAX_DXT5
+    assert paa.choose_pax_type("x/glass_co.paa", opaque) == paa.PAX_DXT1
+    assert paa.choose_pax_type("x/glass_co.paa", _texture(8)) == paa.PAX_DXT5
+
+
+def test_decode_region_matches_full_decode(tmp_path):
+    rgba = _texture(128)
+    path = str(tmp_path / "region_ca.paa")
+    paa.write_paa(path, Image.fromarray(rgba, "RGBA"))
+    texture = paa.read_paa(path)
+    full = texture.decode_mipmap(0)
+    assert np.array_equal(texture.decode_region(0, 20, 36, 50, 40), full[36:76, 20:70])
+
+
+def test_paa_to_png(tmp_path):
+    rgba = _texture(32)
+    paa.write_paa(str(tmp_path / "t_ca.paa"), Image.fromarray(rgba, "RGBA"))
+    paa.paa_to_png(str(tmp_path / "t_ca.paa"), str(tmp_path / "t_ca.png"))
+    with Image.open(tmp_path / "t_ca.png") as image:
+        assert image.size == (32, 32)
+        assert image.mode == "RGBA"
+
+
+def test_rejects_unknown_type(tmp_path):
+    path = tmp_path / "bad.paa"
+    path.write_bytes(b"\x34\x12" + bytes(16))
+    with pytest.raises(paa.PaaError):
+        paa.read_paa(str(path))
@@ -0,0 +1,121 @@
+import os
+import time
+
+import pytest
+
+from extract import extract_and_move_pbo_files
+from pbo import PREFIX_FILE, PboError, PboReader, extract_pbo, pack_pbo
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    src = tmp_path / "src"
+    _write(str(src / PREFIX_FILE), b"my\\addon\n")
+    _write(str(src / "config.cpp"), b"class CfgPatches {};\n")
+    _write(str(src / "data" / "glass_ca.paa"), os.urandom(5000))
+    _write(str(src / "data" / "empty.txt"), b"")
+    _write(str(src / "data" / "big.bin"), os.urandom(3 << 20))
+    return src
+
+
+def test_pack_then_read(tree, tmp_path):
+    output = str(tmp_path / "addon.pbo")
+    counts = pack_pbo(str(tree), output)
+    assert counts == {"reused": 0, "read": 4}
+
+    with PboReader(output) as reader:
+        assert reader.verify()
+        assert reader.prefix == "my\\addon"
+        names = sorted(entry.name for entry in reader.entries)
+        assert names == ["config.cpp", "data\\big.bin", "data\\empty.txt", "data\\glass_ca.paa"]
+        for entry in reader.entries:
+            with open(os.path.join(str(tree), *entry.name.split("\\")), "rb") as f:
+                assert reader.read(entry) == f.read()
+
+
+def test_extract_round_trip(tree, tmp_path):
+    output = str(tmp_path / "addon.pbo")
+    pack_pbo(str(tree), output)
+    dest = tmp_path / "dest"
+    written = extract_pbo(output, str(dest), verify=True, include=["*.paa"])
+    assert written == [str(dest / "my" / "addon" / "data" / "glass_ca.paa")]
+    assert (dest / "my" / "addon" / "data" / "glass_ca.paa").read_bytes() == (tree / "data" / "glass_ca.paa").read_bytes()
+    assert not [name for name in os.listdir(dest / "my" / "addon" / "data") if name.endswith(".tmp")]
+
+
+def test_verify_detects_corruption(tree, tmp_path):
+    output = str(tmp_path / "addon.pbo")
+    pack_pbo(str(tree), output)
+    with open(output, "r+b") as f:
+        f.seek(-30, os.SEEK_END)
+        byte = f.read(1)
+        f.seek(-30, os.SEEK_END)
+        f.write(bytes([byte[0] ^ 0xFF]))
+    with PboReader(output) as reader:
+        assert not reader.verify()
+    with pytest.raises(PboError):
+        extract_pbo(output, str(tmp_path / "dest"), verify=True)
+
+
+def test_repack_reuses_unchanged_entries(tree, tmp_path):
+    output = str(tmp_path / "addon.pbo")
+    pack_pbo(str(tree), output)
+    # Sources written before the archive are reused; a resized one is read again
+    later = time.time() + 10
+    os.utime(output, (later, later))
+    _write(str(tree / "data" / "glass_ca.paa"), os.urandom(5001))
+
+    counts = pack_pbo(str(tree), output, previous=output)
+    assert counts == {"reused": 3, "read": 1}
+    with PboReader(output) as reader:
+        assert reader.verify()
+        entry = next(entry for entry in reader.entries if entry.name == "data\\glass_ca.paa")
+        assert reader.read(entry) == (tree / "data" / "glass_ca.paa").read_bytes()
+
+
+def test_same_second_edit_is_not_reused(tree, tmp_path):
+    output = str(tmp_path / "addon.pbo")
+    pack_pbo(str(tree), output)
+    # Same size, and the same whole-second timestamp as the packed entry
+    stat = os.stat(str(tree / "config.cpp"))
+    _write(str(tree / "config.cpp"), b"class CfgPatches {X};\n"[:stat.st_size])
+    os.utime(str(tree / "config.cpp"), ns=(stat.st_atime_ns, int(stat.st_mtime) * 10 ** 9 + 900_000_000))
+    os.utime(output, ns=(stat.st_atime_ns, int(stat.st_mtime) * 10 ** 9 + 500_000_000))
+
+    pack_pbo(str(tree), output, previous=output)
+    with PboReader(output) as reader:
+        entry = next(entry for entry in reader.entries if entry.name == "config.cpp")
+        assert reader.read(entry) == (tree / "config.cpp").read_bytes()
+
+
+def test_rejects_entries_outside_destination(tmp_path):
+    src = tmp_path / "src"
+    _write(str(src / "a.txt"), b"a")
+    output = str(tmp_path / "evil.pbo")
+    pack_pbo(str(src), output)
+    with PboReader(output) as reader:
+        entry = reader.entries[0]._replace(name="..\\..\\escape.txt")
+        with pytest.raises(PboError):
+            reader.entry_path(entry, str(tmp_path / "dest"))
+
+
+def test_extract_reports_corrupt_archives(tree, tmp_path):
+    archives = tmp_path / "archives"
+    archives.mkdir()
+    good = str(archives / "good.pbo")
+    pack_pbo(str(tree), good)
+    with open(good, "rb") as f:
+        _write(str(archives / "bad.pbo"), f.read(30))
+
+    dest = str(tmp_path / "dest")
+    failed = extract_and_move_pbo_files(str(archives), dest, max_threads=2)
+    assert [(path, type(error)) for path, error in failed] == [(str(archives / "bad.pbo"), PboError)]
+    assert os.path.exists(os.path.join(dest, "my", "addon", "config.cpp"))
+    # A corrupt archive is not mistaken for an unchanged one on the next run
+    assert len(extract_and_move_pbo_files(str(archives), dest, max_threads=2)) == 1
@@ -0,0 +1,152 @@
+import os
+import struct
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import psd
+
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      "edited", "CUP", "weapons", "CUP_Weapons_West_Attachments", "data", "glass_ca.psd")
+
+
+def _packbits(row):
+    """Reference PackBits decoder, one byte at a time."""
+    out = bytearray()
+    i = 0
+    while i < len(row):
+        header = row[i] - 256 if row[i] > 127 else row[i]
+        i += 1
+        if header >= 0:
+            out += row[i:i + header + 1]
+            i += header + 1
+        elif header != -128:
+            out += bytes([row[i]]) * (1 - header)
+            i += 1
+    return bytes(out)
+
+
+def _encode_row(values):
+    """Encode a row as alternating literal and run packets, with a no-op packet in between."""
+    out = bytearray()
+    i = 0
+    while i < len(values):
+        j = i
+        while j + 1 < len(values) and values[j + 1] == values[i] and j - i < 127:
+            j += 1
+        if j > i:
+            out += bytes([257 - (j - i + 1), values[i]])
+        else:
+            out += bytes([0, values[i]])
+        out.append(0x80)
+        i = j + 1
+    return bytes(out)
+
+
+@pytest.mark.skipif(not os.path.exists(SAMPLE), reason="sample PSD not present")
+def test_merged_image_matches_pil():
+    texture = psd.read_psd(SAMPLE)
+    assert (texture.width, texture.height, texture.depth) == (1024, 512, 8)
+    with Image.open(SAMPLE) as reference:
+        expected = np.asarray(reference.convert("RGBA"))
+    assert np.array_equal(np.asarray(texture.merged_image()), expected)
+
+
+@pytest.mark.skipif(not os.path.exists(SAMPLE), reason="sample PSD not present")
+def test_sample_rle_rows_match_reference_decoder():
+    texture = psd.read_psd(SAMPLE)
+    with open(SAMPLE, "rb") as f:
+        f.seek(texture.image_data_offset)
+        assert struct.unpack(">H", f.read(2))[0] == psd.COMPRESSION_RLE
+        counts = np.frombuffer(f.read(texture.channels * texture.height * 2), ">u2")
+        data = f.read(int(counts.sum()))
+    rows = psd.decode_rle(data, counts, texture.width)
+    offset = 0
+    for index, count in enumerate(counts.tolist()):
+        assert rows[index].tobytes() == _packbits(data[offset:offset + count])
+        offset += count
+
+
+def test_decode_rle_random_rows():
+    rng = np.random.default_rng(0)
+    width = 300
+    rows = []
+    for _ in range(64):
+        values = rng.integers(0, 4, width).astype(np.uint8)
+        values[rng.integers(0, width, 20)] = rng.integers(0, 256, 20)
+        rows.append(values)
+    encoded = [_encode_row(row.tobytes()) for row in rows]
+    decoded = psd.decode_rle(b"".join(encoded), [len(row) for row in encoded], width)
+    assert np.array_equal(decoded, np.stack(rows))
+
+
+def test_decode_rle_rejects_bad_rows():
+    row = _encode_row(bytes(10))
+    with pytest.raises(psd.PsdError):
+        psd.decode_rle(row, [len(row)], 12)
+    with pytest.raises(psd.PsdError):
+        psd.decode_rle(row, [len(row) + 5], 10)
+
+
+def _write_layered_psd(path, width, height, layers):
+    """Write a raw-compressed RGB PSD with the given (top, left, rgba, opacity, hidden) layers and no merged data."""
+    records = b""
+    data = b""
+    for top, left, rgba, opacity, hidden in layers:
+        channels = [(channel_id, struct.pack(">H", 0) + np.ascontiguousarray(rgba[:, :, index]).tobytes())
+                    for channel_id, index in ((-1, 3), (0, 0), (1, 1), (2, 2))]
+        records += struct.pack(">4iH", top, left, top + rgba.shape[0], left + rgba.shape[1], len(channels))
+        for channel_id, channel_data in channels:
+            records += struct.pack(">hI", channel_id, len(channel_data))
+        extra = struct.pack(">II", 0, 0) + b"\x01L\0\0"
+        records += b"8BIMnorm" + struct.pack(">BBBBI", opacity, 0, 0x02 if hidden else 0, 0, len(extra)) + extra
+        data += b"".join(channel_data for _, channel_data in channels)
+    info = struct.pack(">h", len(layers)) + records + data
+    info += b"\0" * (len(info) % 2)
+    section = struct.pack(">I", len(info)) + info + struct.pack(">I", 0)
+    version_info = struct.pack(">IB", 1, 0) + bytes(3)
+    resources = b"8BIM" + struct.pack(">HBBI", psd.RESOURCE_VERSION_INFO, 0, 0, len(version_info)) + version_info
+    with open(path, "wb") as f:
+        f.write(b"8BPS" + struct.pack(">H6xHIIHH", 1, 4, height, width, 8, psd.MODE_RGB))
+        f.write(struct.pack(">I", 0) + struct.pack(">I", len(resources)) + resources)
+        f.write(struct.pack(">I", len(section)) + section)
+        f.write(struct.pack(">H", 0) + bytes(width * height * 4))
+
+
+def test_composite_visible_layers(tmp_path):
+    background = np.zeros((8, 8, 4), np.uint8)
+    background[:, :] = (200, 100, 50, 255)
+    overlay = np.zeros((4, 4, 4), np.uint8)
+    overlay[:, :] = (0, 0, 250, 255)
+    hidden = np.full((8, 8, 4), 255, np.uint8)
+    path = str(tmp_path / "layers.psd")
+    _write_layered_psd(path, 8, 8, [(0, 0, background, 255, False), (2, 6, overlay, 128, False),
+                                    (0, 0, hidden, 255, True)])
+
+    texture = psd.read_psd(path)
+    assert not texture.has_real_merged_data
+    pixels = np.asarray(texture.to_image()).astype(int)
+    assert (pixels[0, 0] == (200, 100, 50, 255)).all()
+    # Half opacity overlay, clipped at the right edge of the canvas
+    blended = np.rint(np.array([200, 100, 50]) * (1 - 128 / 255) + np.array([0, 0, 250]) * 128 / 255)
+    assert np.abs(pixels[3, 7, :3] - blended).max() <= 1
+    assert (pixels[3, 5] == (200, 100, 50, 255)).all()
+
+
+def test_psd_to_png(tmp_path):
+    layer = np.zeros((4, 6, 4), np.uint8)
+    layer[:, :] = (10, 20, 30, 128)
+    src = str(tmp_path / "a.psd")
+    _write_layered_psd(src, 6, 4, [(0, 0, layer, 255, False)])
+    dst = str(tmp_path / "a.png")
+    psd.psd_to_png(src, dst)
+    with Image.open(dst) as image:
+        assert np.array_equal(np.asarray(image), layer)
+
+
+def test_rejects_non_psd(tmp_path):
+    path = tmp_path / "bad.psd"
+    path.write_bytes(b"not a psd at all, just bytes")
+    with pytest.raises(psd.PsdError):
+        psd.read_psd(str(path))
@@ -0,0 +1,71 @@
+import json
+
+from tag_store import JOURNAL_SUFFIX, TagStore, load_tags
+
+
+def _crash(store):
+    """Stop the writer thread without the flush and compaction close() does."""
+    with store._condition:
+        store._closed = True
+        store._condition.notify()
+    store._thread.join()
+
+
+def test_journal_replay_after_crash(tmp_path):
+    path = str(tmp_path / "tags.json")
+    with open(path, "w") as f:
+        json.dump({"a.png": ["copy"]}, f)
+
+    store = TagStore(path, flush_interval=60)
+    store.toggle("b.png", "copy")
+    store.toggle("a.png", "copy")
+    store.toggle_many(["c.png", "d.png"], "skip")
+    store.flush()
+    # Queued but never written, then a write torn half way by the crash
+    store.toggle("e.png", "copy")
+    _crash(store)
+    with open(path + JOURNAL_SUFFIX, "a") as f:
+        f.write('{"op": "add", "image": "f.p')
+
+    # tags.json itself was never rewritten
+    with open(path) as f:
+        assert json.load(f) == {"a.png": ["copy"]}
+    expected = {"b.png": ["copy"], "c.png": ["skip"], "d.png": ["skip"]}
+    assert load_tags(path) == expected
+
+    reopened = TagStore(path, flush_interval=60)
+    try:
+        assert reopened.as_dict() == expected
+        assert reopened.images_with("skip") == ["c.png", "d.png"]
+        # The undo history survives the restart; the group toggle undoes as one
+        assert reopened.undo()["images"] == ["c.png", "d.png"]
+        assert reopened.tags_for("c.png") == []
+        reopened.undo()
+        assert reopened.tags_for("a.png") == ["copy"]
+    finally:
+        reopened.close()
+
+    assert load_tags(path) == {"a.png": ["copy"], "b.png": ["copy"]}
+
+
+def test_compaction_keeps_state_and_history(tmp_path):
+    path = str(tmp_path / "tags.json")
+    store = TagStore(path, flush_interval=60, compact_after=5)
+    for index in range(12):
+        store.toggle(f"{index}.png", "copy")
+    store.flush()
+    _crash(store)
+
+    with open(path) as f:
+        snapshot = json.load(f)
+    assert len(snapshot) >= 5
+    assert len(load_tags(path)) == 12
+
+    reopened = TagStore(path, flush_interval=60)
+    try:
+        assert len(reopened.as_dict()) == 12
+        assert reopened.undo()["image"] == "11.png"
+        assert "11.png" not in reopened.as_dict()
+    finally:
+        reopened.close()
+    assert len(load_tags(path)) == 11
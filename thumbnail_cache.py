@@ -0,0 +1,200 @@
+"""Persistent thumbnail cache in one packed, memory mapped file."""
+import json
+import mmap
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from image_cache import decode_image
+
+THUMBNAIL_SIZE = 96
+
+
+def make_thumbnail(path, size=THUMBNAIL_SIZE):
+    """Return (width, height, RGB bytes) of a thumbnail fitting in size x size. Runs in worker processes."""
+    # Textures only decode the smallest mipmap covering the thumbnail
+    image = decode_image(path, (size, size))
+    image.thumbnail((size, size), Image.BICUBIC, reducing_gap=2.0)
+    image = image.convert("RGB")
+    return image.width, image.height, image.tobytes()
+
+
+class ThumbnailCache:
+    """
+    Raw RGB thumbnails appended to `<base>.pack`, indexed by `<base>.json`.
+
+    Entries are keyed by path and mtime, so an edited texture gets a new
+    thumbnail and its old bytes become garbage; `compact` rewrites the pack
+    without them. Reads slice the pack through a memory map, so opening the
+    cache costs one small JSON load however many thumbnails it holds.
+    """
+
+    def __init__(self, base_path, size=THUMBNAIL_SIZE):
+        self.pack_path = base_path + ".pack"
+        self.index_path = base_path + ".json"
+        self.size = size
+        self.entries = {}
+        self.garbage = 0
+        self._map = None
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.index_path, "r") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            data = {}
+        pack_size = os.path.getsize(self.pack_path) if os.path.exists(self.pack_path) else 0
+        if data.get("size") != self.size or data.get("pack_size", -1) > pack_size:
+            # Different thumbnail size, or the pack was lost: start over
+            self.entries = {}
+            self.garbage = 0
+            open(self.pack_path, "wb").close()
+        else:
+            self.entries = data.get("entries", {})
+            self.garbage = data.get("garbage", 0)
+
+    def save(self):
+        with self._lock:
+            data = {
+                "size": self.size,
+                "pack_size": os.path.getsize(self.pack_path),
+                "garbage": self.garbage,
+                "entries": dict(self.entries),
+            }
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(temp_path, self.index_path)
+
+    def _view(self, end):
+        """Return a memory map covering at least `end` bytes of the pack."""
+        if self._map is None or len(self._map) < end:
+            with open(self.pack_path, "rb") as f:
+                # The previous map is released once no slice refers to it
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def has(self, path, mtime):
+        entry = self.entries.get(path)
+        return entry is not None and entry[0] == mtime
+
+    def get(self, path, mtime):
+        """Return the cached thumbnail as an RGB image, or None when missing or stale."""
+        with self._lock:
+            entry = self.entries.get(path)
+            if entry is None or entry[0] != mtime:
+                return None
+            _, offset, width, height = entry
+            end = offset + width * height * 3
+            data = self._view(end)[offset:end]
+        return Image.frombytes("RGB", (width, height), data)
+
+    def put(self, path, mtime, width, height, data):
+        with self._lock:
+            with open(self.pack_path, "ab") as f:
+                offset = f.tell()
+                f.write(data)
+            old = self.entries.get(path)
+            if old is not None:
+                self.garbage += old[2] * old[3] * 3
+            self.entries[path] = [mtime, offset, width, height]
+
+    def needs_compaction(self):
+        """True once stale thumbnails take up more than half of the pack."""
+        return self.garbage > os.path.getsize(self.pack_path) // 2
+
+    def compact(self):
+        """Rewrite the pack with only the live thumbnails."""
+        with self._lock:
+            temp_path = self.pack_path + ".tmp"
+            entries = {}
+            with open(temp_path, "wb") as out:
+                for path, (mtime, offset, width, height) in self.entries.items():
+                    end = offset + width * height * 3
+                    entries[path] = [mtime, out.tell(), width, height]
+                    out.write(self._view(end)[offset:end])
+            self._map = None
+            os.replace(temp_path, self.pack_path)
+            self.entries = entries
+            self.garbage = 0
+        self.save()
+
+
+class ThumbnailGenerator:
+    """
+    Fills a ThumbnailCache from a process pool on a background thread.
+
+    Like image_cache.Prefetcher, each request replaces the pending work, so
+    scrolling away from a region stops generating its thumbnails. Paths are
+    put on `ready` as their thumbnails land.
+    """
+
+    def __init__(self, cache, max_workers=None, batch_size=32):
+        self.cache = cache
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.ready = []
+        self.failed = set()
+        self._pending = []
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def request(self, items):
+        """Queue (path, mtime) pairs, most urgent first, replacing earlier requests."""
+        with self._condition:
+            self._pending = [item for item in items if not self.cache.has(*item) and item not in self.failed]
+            self._condition.notify()
+
+    def has_failed(self, path, mtime):
+        return (path, mtime) in self.failed
+
+    def take_ready(self):
+        with self._condition:
+            ready = self.ready
+            self.ready = []
+        return ready
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._pending = []
+            self._condition.notify()
+
+    def _run(self):
+        with ProcessPoolExecutor(self.max_workers) as executor:
+            while True:
+                with self._condition:
+                    while not self._pending and not self._stopped:
+                        self._condition.wait()
+                    if self._stopped:
+                        break
+                    batch = self._pending[:self.batch_size]
+                    del self._pending[:self.batch_size]
+
+                futures = [(path, mtime, executor.submit(make_thumbnail, path, self.cache.size)) for path, mtime in batch]
+                for path, mtime, future in futures:
+                    try:
+                        width, height, data = future.result()
+                    except Exception:
+                        # Unreadable images keep their placeholder until they change
+                        with self._condition:
+                            self.failed.add((path, mtime))
+                        continue
+                    self.cache.put(path, mtime, width, height, data)
+                    with self._condition:
+                        self.ready.append(path)
+
+                with self._condition:
+                    idle = not self._pending
+                if idle:
+                    if self.cache.needs_compaction():
+                        self.cache.compact()
+                    else:
+                        self.cache.save()
+        self.cache.save()
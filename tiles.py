@@ -0,0 +1,188 @@
+"""Tiled, multi-resolution access to textures for the viewer's zoom mode."""
+import math
+import os
+
+import numpy as np
+from PIL import Image
+
+import paa
+from image_cache import ImageCache, Prefetcher
+
+TILE_SIZE = 256
+
+
+class TiledImage:
+    """
+    One image as a pyramid of TILE_SIZE tiles.
+
+    The levels of a .paa texture are its mipmaps, and a tile is decoded from
+    the blocks it covers only. Other images are decoded whole through the
+    viewer's image cache and reduced per tile.
+    """
+
+    def __init__(self, path, image_cache):
+        self.path = path
+        self.image_cache = image_cache
+        self.mtime = os.stat(path).st_mtime_ns
+        if path.lower().endswith(".paa"):
+            self.texture = paa.read_paa(path)
+            self.levels = [(mip.width, mip.height) for mip in self.texture.mipmaps]
+        else:
+            self.texture = None
+            with Image.open(path) as image:
+                width, height = image.size
+            self.levels = [(width, height)]
+            while min(width, height) > TILE_SIZE:
+                width, height = max(1, width // 2), max(1, height // 2)
+                self.levels.append((width, height))
+
+    @property
+    def width(self):
+        return self.levels[0][0]
+
+    @property
+    def height(self):
+        return self.levels[0][1]
+
+    def level_for_scale(self, texels_per_pixel):
+        """The coarsest level still holding at least one texel per screen pixel."""
+        level = 0
+        for index, (width, height) in enumerate(self.levels):
+            if self.width / width <= texels_per_pixel:
+                level = index
+        return level
+
+    def tile(self, level, tx, ty, mip_data=None):
+        """Decode tile (tx, ty) of a level into an RGBA image; mip_data is the level's decompressed .paa data."""
+        x, y = tx * TILE_SIZE, ty * TILE_SIZE
+        if self.texture is not None:
+            pixels = self.texture.decode_region(level, x, y, TILE_SIZE, TILE_SIZE, mip_data)
+            return Image.fromarray(np.ascontiguousarray(pixels), "RGBA")
+        image = self.image_cache.get(self.path)
+        factor = image.width / self.levels[level][0]
+        box = (round(x * factor), round(y * factor),
+               min(image.width, round((x + TILE_SIZE) * factor)), min(image.height, round((y + TILE_SIZE) * factor)))
+        level_width, level_height = self.levels[level]
+        size = (min(TILE_SIZE, level_width - x), min(TILE_SIZE, level_height - y))
+        return image.convert("RGBA").resize(size, Image.BOX, box=box)
+
+
+class TileCache:
+    """
+    Decoded tiles of the images in zoom mode, least recently used first out.
+
+    Tiles are keyed by (path, mtime, level, tx, ty), so a file rewritten
+    while it is shown gets fresh tiles. Missing tiles are decoded on a
+    background thread; each request replaces the previous one, so panning
+    only decodes what is currently in view. Decompressed .paa mipmaps are
+    kept in a second, smaller cache so neighbouring tiles share one
+    decompression.
+    """
+
+    def __init__(self, image_cache, max_bytes=256 * 1024 * 1024, mip_bytes=128 * 1024 * 1024):
+        self.image_cache = image_cache
+        self.images = {}
+        self.tiles = ImageCache(max_bytes, loader=self._load_tile, stamp=None)
+        self.mip_data = ImageCache(mip_bytes, loader=self._load_mip_data, sizer=len, stamp=None)
+        self.prefetcher = Prefetcher(self.tiles)
+
+    def image(self, path):
+        """The TiledImage for path, reopened when the file changed."""
+        image = self.images.get(path)
+        if image is None or image.mtime != os.stat(path).st_mtime_ns:
+            image = self.images[path] = TiledImage(path, self.image_cache)
+        return image
+
+    def _load_mip_data(self, key, fit=None):
+        path, mtime, level = key
+        return self.images[path].texture.read_mipmap_data(level)
+
+    def _load_tile(self, key, fit=None):
+        path, mtime, level, tx, ty = key
+        image = self.images[path]
+        mip_data = None
+        if image.texture is not None and image.texture.mipmaps[level].compressed:
+            mip_data = self.mip_data.get((path, mtime, level))
+        return image.tile(level, tx, ty, mip_data)
+
+    def cached(self, key):
+        """The tile for key if it is decoded already, else None."""
+        return self.tiles.get(key) if self.tiles.has(key) else None
+
+    def request(self, keys):
+        self.prefetcher.request(keys)
+
+    def stop(self):
+        self.prefetcher.stop()
+
+
+def _draw(frame, source, origin, left, top, scale):
+    """
+    Paste the part of source that is in view into frame.
+
+    source sits at origin in level coordinates; the view starts at (left,
+    top) and covers scale level pixels per screen pixel. Screen edges are
+    rounded from level coordinates, so adjacent tiles meet without gaps.
+    """
+    x0 = max(origin[0], left)
+    y0 = max(origin[1], top)
+    x1 = min(origin[0] + source.width, left + frame.width * scale)
+    y1 = min(origin[1] + source.height, top + frame.height * scale)
+    sx0, sy0 = round((x0 - left) / scale), round((y0 - top) / scale)
+    sx1, sy1 = round((x1 - left) / scale), round((y1 - top) / scale)
+    if sx1 <= sx0 or sy1 <= sy0:
+        return
+    # Magnified texels stay sharp squares; reductions are below 2x, so bilinear is enough
+    resample = Image.NEAREST if scale < 1 else Image.BILINEAR
+    box = (x0 - origin[0], y0 - origin[1], x1 - origin[0], y1 - origin[1])
+    # Crop first: resize converts the whole source to premultiplied alpha, whatever the box
+    crop = (math.floor(box[0]), math.floor(box[1]), math.ceil(box[2]), math.ceil(box[3]))
+    region = source.crop(crop)
+    box = (box[0] - crop[0], box[1] - crop[1], box[2] - crop[0], box[3] - crop[1])
+    frame.paste(region.resize((sx1 - sx0, sy1 - sy0), resample, box=box), (sx0, sy0))
+
+
+def render_view(image, backdrop, tile_cache, center, texels_per_pixel, size, background=(32, 32, 32, 255)):
+    """
+    Render the part of image around center into an RGBA frame of size.
+
+    The whole-image backdrop, usually a small mipmap, is drawn first, and
+    the cached tiles of the level matching the zoom on top of it, so the
+    view sharpens as tiles arrive.
+
+    :param center: (u, v) in view, as fractions of the image width and height
+    :param texels_per_pixel: texels of the top level per screen pixel
+    :return: (frame, keys of tiles in view that are not decoded yet)
+    """
+    frame = Image.new("RGBA", size, background)
+    u, v = center
+    if backdrop.mode not in ("RGB", "RGBA", "L"):
+        backdrop = backdrop.convert("RGBA")
+
+    backdrop_scale = texels_per_pixel * backdrop.width / image.width
+    _draw(frame, backdrop, (0, 0), u * backdrop.width - size[0] / 2 * backdrop_scale,
+          v * backdrop.height - size[1] / 2 * backdrop_scale, backdrop_scale)
+    if backdrop_scale >= 1:
+        # The backdrop already has a texel for every screen pixel
+        return frame, []
+
+    level = image.level_for_scale(texels_per_pixel)
+    level_width, level_height = image.levels[level]
+    scale = texels_per_pixel * level_width / image.width
+    left = u * level_width - size[0] / 2 * scale
+    top = v * level_height - size[1] / 2 * scale
+    tx0 = max(0, math.floor(left / TILE_SIZE))
+    ty0 = max(0, math.floor(top / TILE_SIZE))
+    tx1 = min(math.ceil(level_width / TILE_SIZE), math.ceil((left + size[0] * scale) / TILE_SIZE))
+    ty1 = min(math.ceil(level_height / TILE_SIZE), math.ceil((top + size[1] * scale) / TILE_SIZE))
+
+    missing = []
+    for ty in range(ty0, ty1):
+        for tx in range(tx0, tx1):
+            key = (image.path, image.mtime, level, tx, ty)
+            tile = tile_cache.cached(key)
+            if tile is None:
+                missing.append(key)
+                continue
+            _draw(frame, tile, (tx * TILE_SIZE, ty * TILE_SIZE), left, top, scale)
+    return frame, missing
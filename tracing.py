@@ -0,0 +1,223 @@
+"""
+Opt-in tracing of pipeline stages and per-file work.
+
+Disabled by default: every hook then costs one global lookup. Enable it with
+`enable()`, or for any script by setting PIPELINE_TRACE to the path of the
+Chrome trace to write at exit:
+
+    PIPELINE_TRACE=trace.json python process.py
+
+The trace loads in chrome://tracing or https://ui.perfetto.dev, and a
+per-span summary table (files/s, MB/s, p50/p95 latency, queue wait) is
+printed at exit.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+
+_tracer = None
+_local = threading.local()
+
+
+class _NullSpan:
+    """Returned by span() while tracing is disabled."""
+
+    def add(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """A timed region; attach metrics such as bytes with `add`."""
+
+    __slots__ = ("tracer", "name", "category", "args", "start")
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = None
+
+    def add(self, **args):
+        self.args.update(args)
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.start
+        _local.stack.pop()
+        if exc[0] is not None:
+            self.args["error"] = exc[0].__name__
+        self.tracer.record(self.name, self.start, duration, self.category, **self.args)
+        return False
+
+
+class Tracer:
+    """Collects finished spans; safe to use from several threads."""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.events = []
+
+    def record(self, name, start, duration, category="file", pid=None, tid=None, **args):
+        """Add a span measured elsewhere, e.g. in a worker process; start is a perf_counter value."""
+        # list.append is atomic, so no lock is needed
+        self.events.append((name, category, start, duration, pid or os.getpid(), tid or threading.get_ident(), args))
+
+    def summary(self):
+        """Return one row per span name: count, busy wall time, throughput and latency percentiles."""
+        groups = {}
+        for name, category, start, duration, pid, tid, args in self.events:
+            groups.setdefault(name, []).append((start, duration, args))
+
+        rows = []
+        for name, spans in groups.items():
+            durations = sorted(duration for _, duration, _ in spans)
+            wall = _busy_time(spans)
+            moved = sum(args.get("bytes", 0) for _, _, args in spans)
+            waits = [args["queue_wait"] for _, _, args in spans if "queue_wait" in args]
+            rows.append({
+                "name": name,
+                "count": len(spans),
+                "wall": wall,
+                "total": sum(durations),
+                "per_sec": len(spans) / wall if wall > 0 else 0.0,
+                "mb_per_sec": moved / (1024 * 1024) / wall if wall > 0 else 0.0,
+                "p50": _percentile(durations, 0.50),
+                "p95": _percentile(durations, 0.95),
+                "queue_wait": sum(waits) / len(waits) if waits else None,
+            })
+        rows.sort(key=lambda row: -row["wall"])
+        return rows
+
+    def print_summary(self):
+        print(f"{'span':<24} {'count':>7} {'wall s':>8} {'/s':>9} {'MB/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'wait ms':>9}")
+        for row in self.summary():
+            wait = f"{row['queue_wait'] * 1000:9.1f}" if row["queue_wait"] is not None else f"{'-':>9}"
+            print(f"{row['name']:<24} {row['count']:>7} {row['wall']:>8.2f} {row['per_sec']:>9.1f} "
+                  f"{row['mb_per_sec']:>8.1f} {row['p50'] * 1000:>9.1f} {row['p95'] * 1000:>9.1f} {wait}")
+
+    def write_chrome_trace(self, path):
+        """Write the spans in the Chrome trace event format."""
+        events = []
+        for name, category, start, duration, pid, tid, args in self.events:
+            events.append({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": (start - self.origin) * 1e6,
+                "dur": duration * 1e6,
+                "pid": pid,
+                "tid": tid,
+                "args": args,
+            })
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def _busy_time(spans):
+    """Wall time covered by at least one of the spans, so separate calls do not count the gaps between them."""
+    busy = 0.0
+    end = None
+    for start, duration, _ in sorted(spans, key=lambda span: span[0]):
+        if end is None or start > end:
+            busy += duration
+            end = start + duration
+        elif start + duration > end:
+            busy += start + duration - end
+            end = start + duration
+    return busy
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def enable():
+    """Start recording spans; returns the Tracer."""
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def disable():
+    """Stop recording; returns the Tracer that was active, if any."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def enabled():
+    return _tracer is not None
+
+
+def span(name, category="stage", **args):
+    """Context manager timing a region while tracing is enabled."""
+    if _tracer is None:
+        return _NULL_SPAN
+    return Span(_tracer, name, category, args)
+
+
+def annotate(**args):
+    """Attach metrics, e.g. bytes=..., to the innermost open span of this thread."""
+    if _tracer is None:
+        return
+    stack = getattr(_local, "stack", None)
+    if stack:
+        stack[-1].args.update(args)
+
+
+def record(name, start, duration, category="file", **args):
+    """Add a span timed elsewhere, see Tracer.record."""
+    if _tracer is not None:
+        _tracer.record(name, start, duration, category, **args)
+
+
+def submit(executor, name, fn, *args):
+    """
+    executor.submit(fn, *args), recording a per-file span with the time spent queued.
+
+    Only for thread pools: the wrapper is not picklable.
+    """
+    if _tracer is None:
+        return executor.submit(fn, *args)
+    submitted = time.perf_counter()
+
+    def run():
+        with span(name, "file", queue_wait=time.perf_counter() - submitted):
+            return fn(*args)
+
+    return executor.submit(run)
+
+
+def _write_at_exit(path, pid):
+    # Worker processes inherit or re-import this module; only the main one writes
+    if _tracer is None or not _tracer.events or os.getpid() != pid:
+        return
+    _tracer.print_summary()
+    _tracer.write_chrome_trace(path)
+    print(f"Trace written to {path}")
+
+
+if os.environ.get("PIPELINE_TRACE"):
+    enable()
+    atexit.register(_write_at_exit, os.environ["PIPELINE_TRACE"], os.getpid())
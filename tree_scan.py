@@ -0,0 +1,205 @@
+"""
+Parallel scandir walks shared by the pipeline stages.
+
+Directories are listed on a small thread pool, always the pending one that
+comes first in walk order, so results stream in the same order as a
+sorted os.walk while the directories after them are listed ahead. scandir
+and stat release the GIL while they wait on the filesystem.
+
+A TreeSnapshot lets several stages of one run share a single walk.
+"""
+import fnmatch
+import itertools
+import os
+import queue
+import re
+import threading
+from collections import namedtuple
+
+# Listing threads per walk. They overlap a slow filesystem's latency, but on a
+# single CPU with a warm cache the handoffs cost more than they save
+SCAN_THREADS = min(8, os.cpu_count() or 1)
+
+FileEntry = namedtuple("FileEntry", ["rel_path", "path", "stat"])
+
+
+def read_dir(path, stat=False):
+    """
+    List one directory as (files, subdirectory names), both sorted.
+
+    files holds (name, os.stat_result or None without stat) pairs; a missing
+    or unreadable directory lists as empty, and entries that vanish while
+    listed are left out. As with os.walk, links to directories are neither
+    files nor entered.
+    """
+    files = []
+    dirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir():
+                        if not entry.is_symlink():
+                            dirs.append(entry.name)
+                    else:
+                        files.append((entry.name, entry.stat() if stat else None))
+                except FileNotFoundError:
+                    continue
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        pass
+    files.sort()
+    dirs.sort()
+    return files, dirs
+
+
+def walk(root, list_dir, max_threads=SCAN_THREADS):
+    """
+    Call list_dir(rel_dir) for every directory under root and yield (rel_dir, result) in walk order.
+
+    list_dir returns (result, sorted names of the subdirectories to enter)
+    and runs on the pool; the order is that of os.walk with sorted names,
+    root first as "". Exceptions from list_dir are raised here.
+    """
+    if max_threads <= 1:
+        stack = [""]
+        while stack:
+            rel_dir = stack.pop()
+            result, subdirs = list_dir(rel_dir)
+            stack.extend(os.path.join(rel_dir, name) for name in reversed(subdirs))
+            yield rel_dir, result
+        return
+
+    # Keys are the path components, which sort in walk order; a stop item's () sorts first
+    tasks = queue.PriorityQueue()
+    sequence = itertools.count()
+    done = {}
+    condition = threading.Condition()
+
+    def worker():
+        while True:
+            key, _, rel_dir = tasks.get()
+            if rel_dir is None:
+                return
+            try:
+                outcome = True, list_dir(rel_dir)
+            except Exception as e:
+                outcome = False, e
+            if outcome[0]:
+                for name in outcome[1][1]:
+                    tasks.put((key + (name,), next(sequence), os.path.join(rel_dir, name)))
+            with condition:
+                done[rel_dir] = outcome
+                condition.notify_all()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max_threads)]
+    for thread in threads:
+        thread.start()
+    tasks.put(((root,), next(sequence), ""))
+    try:
+        stack = [""]
+        while stack:
+            rel_dir = stack.pop()
+            with condition:
+                while rel_dir not in done:
+                    condition.wait()
+                ok, value = done.pop(rel_dir)
+            if not ok:
+                raise value
+            result, subdirs = value
+            stack.extend(os.path.join(rel_dir, name) for name in reversed(subdirs))
+            yield rel_dir, result
+    finally:
+        for _ in threads:
+            tasks.put(((), next(sequence), None))
+
+
+def _compile_patterns(patterns):
+    """One regex matching any of the glob patterns, or None for no patterns."""
+    if not patterns:
+        return None
+    return re.compile("|".join(fnmatch.translate(pattern) for pattern in patterns))
+
+
+class TreeSnapshot:
+    """
+    Full listings of trees, taken once and shared by the scans of one run.
+
+    Pass the same snapshot to several scan_tree calls and each tree is walked
+    only once, with the stat results of every file. Only for trees nothing
+    writes to in between; invalidate a tree after writing to it.
+    """
+
+    def __init__(self, max_threads=SCAN_THREADS):
+        self.max_threads = max_threads
+        self.trees = {}
+
+    def listings(self, root):
+        """Return {rel_dir: (files, subdirectory names)} for root, walking it on first use."""
+        key = os.path.abspath(root)
+        listings = self.trees.get(key)
+        if listings is None:
+            def list_dir(rel_dir):
+                listing = read_dir(os.path.join(root, rel_dir), stat=True)
+                return listing, listing[1]
+
+            listings = self.trees[key] = dict(walk(root, list_dir, self.max_threads))
+        return listings
+
+    def invalidate(self, root=None):
+        """Forget one tree, or all of them."""
+        if root is None:
+            self.trees = {}
+        else:
+            self.trees.pop(os.path.abspath(root), None)
+
+
+def scan_tree(root, extensions=None, exclude=None, stat=False, max_threads=SCAN_THREADS, snapshot=None):
+    """
+    Yield a FileEntry for every file under root, in os.walk order with sorted names, as directories are listed.
+
+    :param extensions: file name endings to keep, e.g. (".png", ".paa"), matched as with str.endswith
+    :param exclude: glob patterns of relative paths to leave out, with "/" separators; a directory
+        whose path plus "/" matches, e.g. "*/ui/", is not entered at all
+    :param stat: also take the os.stat_result of each file, on the listing threads
+    :param snapshot: TreeSnapshot to take the listing from, filled by the first scan of root; entries
+        then always carry a stat result
+    """
+    excluded = _compile_patterns(exclude)
+    if isinstance(extensions, str):
+        extensions = (extensions,)
+
+    def wanted_dirs(rel_dir, names):
+        if excluded is None:
+            return names
+        return [name for name in names if not excluded.match(_pattern_path(os.path.join(rel_dir, name)) + "/")]
+
+    if snapshot is not None:
+        listings = snapshot.listings(root)
+        listed = walk(root, lambda rel_dir: (listings[rel_dir], wanted_dirs(rel_dir, listings[rel_dir][1])), 1)
+    else:
+        def list_dir(rel_dir):
+            listing = read_dir(os.path.join(root, rel_dir), stat)
+            return listing, wanted_dirs(rel_dir, listing[1])
+
+        listed = walk(root, list_dir, max_threads)
+
+    for rel_dir, (files, _) in listed:
+        # Plain concatenation; os.path.join per file costs more than the listing
+        rel_prefix = rel_dir + os.sep if rel_dir else ""
+        path_prefix = os.path.join(root, rel_prefix)
+        for name, file_stat in files:
+            if extensions is not None and not name.endswith(extensions):
+                continue
+            rel_path = rel_prefix + name
+            if excluded is not None and excluded.match(_pattern_path(rel_path)):
+                continue
+            yield FileEntry(rel_path, path_prefix + name, file_stat)
+
+
+def _pattern_path(rel_path):
+    return rel_path if os.sep == "/" else rel_path.replace(os.sep, "/")
+
+
+def scan_files(root, extensions=None, **options):
+    """Map relative paths to full paths for the files under root; options as for scan_tree."""
+    return {entry.rel_path: entry.path for entry in scan_tree(root, extensions, **options)}
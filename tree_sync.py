@@ -0,0 +1,200 @@
+"""Single pass tree diff and parallel mirroring, used by process.sync_folders."""
+import os
+import shutil
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+from manifest import cached_file_hash
+from tree_scan import walk
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where reflinks are skipped
+    fcntl = None
+
+# ioctl request number of Linux FICLONE
+FICLONE = 0x40049409
+
+SyncAction = namedtuple("SyncAction", ["kind", "rel_path", "reason"])
+
+
+def _scan(path):
+    """Return {name: DirEntry} for a directory, or {} if it does not exist."""
+    try:
+        with os.scandir(path) as it:
+            return {entry.name: entry for entry in it}
+    except (FileNotFoundError, NotADirectoryError):
+        return {}
+
+
+def _ancestors(rel_paths):
+    """Return every parent directory of the given relative paths."""
+    parents = set()
+    for rel_path in rel_paths:
+        parent = os.path.dirname(rel_path)
+        while parent and parent not in parents:
+            parents.add(parent)
+            parent = os.path.dirname(parent)
+    return parents
+
+
+def _same_file(src_entry, dst_entry, hash_cache):
+    """Decide from cached stats, and content hashes as a fallback, whether two files match."""
+    src_stat = src_entry.stat()
+    dst_stat = dst_entry.stat()
+    if src_stat.st_size != dst_stat.st_size:
+        return False, "size changed"
+    if src_stat.st_mtime_ns == dst_stat.st_mtime_ns:
+        return True, None
+    if hash_cache is None:
+        return False, "modified time changed"
+    if cached_file_hash(hash_cache, src_entry.path, src_stat) == cached_file_hash(hash_cache, dst_entry.path, dst_stat):
+        return True, None
+    return False, "content changed"
+
+
+def diff_trees(source_dir, dest_dir, exclude=None, hash_cache=None):
+    """
+    Compare two trees in one pass and list what makes dest_dir mirror source_dir.
+
+    Both trees are walked together with scandir, one directory pair at a time
+    on tree_scan's listing threads, and files are compared from the cached stat
+    results: size, then mtime, then the content hash when a hash cache is given.
+
+    :param exclude: relative file paths in dest_dir to leave alone, e.g. outputs
+        owned by a later stage
+    :param hash_cache: dict for manifest.cached_file_hash, or None to treat any
+        mtime difference as a change
+    :return: list of SyncAction, deletes first
+    """
+    exclude = set(exclude or ())
+    protected_dirs = _ancestors(exclude)
+
+    def diff_dir(rel_dir):
+        deletes = []
+        copies = []
+        subdirs = []
+        src_entries = _scan(os.path.join(source_dir, rel_dir))
+        dst_entries = _scan(os.path.join(dest_dir, rel_dir))
+
+        for name, entry in src_entries.items():
+            rel_path = os.path.join(rel_dir, name)
+            other = dst_entries.get(name)
+            if entry.is_dir():
+                if other is not None and not other.is_dir():
+                    deletes.append(SyncAction("delete", rel_path, "replaced by a directory"))
+                subdirs.append(name)
+                continue
+            if rel_path in exclude:
+                continue
+            if other is None:
+                copies.append(SyncAction("copy", rel_path, "new file"))
+            elif other.is_dir():
+                copies.append(SyncAction("copy", rel_path, "replaces a directory"))
+            else:
+                same, reason = _same_file(entry, other, hash_cache)
+                if not same:
+                    copies.append(SyncAction("copy", rel_path, reason))
+
+        for name, other in dst_entries.items():
+            if name in src_entries:
+                continue
+            rel_path = os.path.join(rel_dir, name)
+            if rel_path in exclude:
+                continue
+            if other.is_dir() and rel_path in protected_dirs:
+                # Holds excluded files, so only clear out what is around them
+                subdirs.append(name)
+                continue
+            deletes.append(SyncAction("delete", rel_path, "not in source"))
+        return (deletes, copies), sorted(subdirs)
+
+    deletes = []
+    copies = []
+    for rel_dir, (dir_deletes, dir_copies) in walk(source_dir, diff_dir):
+        deletes.extend(dir_deletes)
+        copies.extend(dir_copies)
+    return deletes + copies
+
+
+def _reflink(src, dst):
+    """Clone src into dst with FICLONE, raising OSError where unsupported."""
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+    shutil.copystat(src, dst)
+
+
+def place_file(src, dst, link=None):
+    """
+    Put a copy of src at dst through a temporary file and an atomic rename.
+
+    Existing files are replaced, never written in place, so a dst that is a
+    hardlink of some other file never changes that file.
+
+    :param link: "reflink", "hardlink", "auto" (reflink, then hardlink) or None
+        to always copy bytes; falls back to copying where linking fails
+    :return: how the file was placed: "reflink", "hardlink" or "copy"
+    """
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    temp_path = dst + ".sync-tmp"
+    if os.path.lexists(temp_path):
+        os.remove(temp_path)
+
+    method = "copy"
+    if link in ("auto", "reflink"):
+        try:
+            _reflink(src, temp_path)
+            method = "reflink"
+        except OSError:
+            if os.path.lexists(temp_path):
+                os.remove(temp_path)
+    if method == "copy" and link in ("auto", "hardlink"):
+        try:
+            os.link(src, temp_path)
+            method = "hardlink"
+        except OSError:
+            pass
+    if method == "copy":
+        shutil.copy2(src, temp_path)
+
+    if os.path.isdir(dst) and not os.path.islink(dst):
+        shutil.rmtree(dst)
+    os.replace(temp_path, dst)
+    return method
+
+
+def _delete(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _copy(src, dst, link):
+    place_file(src, dst, link)
+    if tracing.enabled():
+        tracing.annotate(bytes=os.path.getsize(dst))
+
+
+def apply_actions(source_dir, dest_dir, actions, max_threads=16, link=None):
+    """Run the deletes, then the copies, of a diff_trees plan on a thread pool."""
+    deletes = [a for a in actions if a.kind == "delete"]
+    copies = [a for a in actions if a.kind == "copy"]
+
+    with ThreadPoolExecutor(max_threads) as executor:
+        futures = [tracing.submit(executor, "sync.delete", _delete, os.path.join(dest_dir, a.rel_path))
+                   for a in deletes]
+        for future in futures:
+            future.result()
+
+        futures = [
+            tracing.submit(executor, "sync.copy", _copy, os.path.join(source_dir, a.rel_path),
+                           os.path.join(dest_dir, a.rel_path), link)
+            for a in copies
+        ]
+        for future in futures:
+            future.result()
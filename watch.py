@@ -0,0 +1,259 @@
+"""
+Watch edited/ and raw/ and keep patched/ up to date between full builds.
+
+    python watch.py [--pack]
+
+Saved PNGs in edited/ are converted on their own and .p3d files copied,
+straight into patched/; only a change under raw/ runs the incremental
+build, with its full sync. Uses inotify on Linux and polls elsewhere.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+
+import tracing
+from manifest import Manifest
+from tree_scan import read_dir, scan_tree, walk
+from pbo import pack_pbo
+from process import BUILD_MANIFEST_NAME, BuildReport, build, update_edited_files
+
+# inotify event masks, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+_EVENT = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """
+    Reports changed paths under some directory trees through inotify.
+
+    Every directory gets its own watch, and directories created later are
+    added as they appear. After a queue overflow the whole root is reported
+    as changed.
+    """
+
+    def __init__(self, roots):
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError(errno.ENOSYS, "libc not found")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.roots = list(roots)
+        self.dirs = {}
+        try:
+            for root in self.roots:
+                self._add_tree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_dir(self, path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return
+            # ENOSPC: out of watches, see fs.inotify.max_user_watches
+            raise OSError(error, f"cannot watch {path}: {os.strerror(error)}")
+        self.dirs[wd] = path
+
+    def _add_tree(self, path, found=None):
+        """Watch path and every directory below it; files already there are added to found."""
+        for rel_dir, files in walk(path, lambda rel_dir: read_dir(os.path.join(path, rel_dir))):
+            directory = os.path.join(path, rel_dir) if rel_dir else path
+            self._add_dir(directory)
+            if found is not None:
+                found.update(os.path.join(directory, name) for name, _ in files)
+
+    def wait(self, timeout=None):
+        """Return the set of paths changed within timeout seconds; empty when nothing happened."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+                name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0")
+                offset += _EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    changed.update(self.roots)
+                    continue
+                directory = self.dirs.get(wd)
+                if mask & IN_IGNORED:
+                    self.dirs.pop(wd, None)
+                    continue
+                if directory is None:
+                    continue
+                path = os.path.join(directory, os.fsdecode(name)) if name else directory
+                changed.add(path)
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files may land in a new directory before its watch exists
+                    self._add_tree(path, changed)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Reports changed paths by comparing size and mtime snapshots of the trees every interval seconds."""
+
+    def __init__(self, roots, interval=0.5):
+        self.roots = list(roots)
+        self.interval = interval
+        self.snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for root in self.roots:
+            for entry in scan_tree(root, stat=True):
+                snapshot[entry.path] = (entry.stat.st_size, entry.stat.st_mtime_ns)
+        return snapshot
+
+    def wait(self, timeout=None):
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        snapshot = self._scan()
+        changed = {path for path, state in snapshot.items() if self.snapshot.get(path) != state}
+        changed.update(path for path in self.snapshot if path not in snapshot)
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+def make_watcher(roots):
+    """An InotifyWatcher where inotify works, a PollingWatcher otherwise."""
+    try:
+        return InotifyWatcher(roots)
+    except (OSError, AttributeError) as e:
+        print(f"inotify unavailable ({e}), polling for changes")
+        return PollingWatcher(roots)
+
+
+def _edited_rel_paths(paths, edited_dir, manifest):
+    """
+    Turn changed paths under edited/ into the input files they affect.
+
+    A changed directory, e.g. one renamed or deleted, stands for the files
+    under it now and those the manifest remembers from before.
+    """
+    known = set(manifest.get("convert", {}))
+    known.update(rel_path for rel_path, record in manifest.get("outputs", {}).items() if record["stage"] == "p3d")
+    rel_paths = set()
+    for path in paths:
+        rel_path = os.path.relpath(path, edited_dir)
+        if rel_path == ".":
+            rel_paths.update(known)
+            rel_path = ""
+        if os.path.isdir(path):
+            rel_paths.update(os.path.join(rel_path, entry.rel_path) for entry in scan_tree(path))
+        prefix = rel_path + os.sep if rel_path else ""
+        rel_paths.update(known_path for known_path in known if known_path.startswith(prefix))
+        if os.path.isfile(path) or rel_path in known:
+            rel_paths.add(rel_path)
+    return sorted(p for p in rel_paths if p.endswith((".png", ".p3d")))
+
+
+def watch(base_dir, debounce=0.15, pack=False):
+    """
+    Keep patched/ in sync with edited/ and raw/ until interrupted.
+
+    Events are collected until debounce seconds pass without another, so an
+    editor's burst of writes and renames for one save is handled once.
+
+    :param pack: also repack build/patched.pbo after each update
+    """
+    source_dir = os.path.join(base_dir, "raw")
+    edited_dir = os.path.join(base_dir, "edited")
+    patched_dir = os.path.join(base_dir, "patched")
+    pbo_path = os.path.join(base_dir, "build", "patched.pbo")
+    os.makedirs(edited_dir, exist_ok=True)
+
+    manifest = Manifest(os.path.join(base_dir, "build", BUILD_MANIFEST_NAME))
+    build(base_dir, manifest=manifest).print_summary()
+
+    watcher = make_watcher([os.path.abspath(edited_dir), os.path.abspath(source_dir)])
+    edited_root, source_root = watcher.roots
+    print(f"Watching {edited_dir} and {source_dir}, Ctrl+C to stop")
+    pending = set()
+    first_event = last_event = None
+    try:
+        while True:
+            timeout = None if not pending else max(0.0, last_event + debounce - time.perf_counter())
+            changed = watcher.wait(timeout)
+            now = time.perf_counter()
+            if changed:
+                if not pending:
+                    first_event = now
+                pending.update(changed)
+                last_event = now
+                continue
+            if not pending:
+                continue
+
+            raw_changed = any(path == source_root or path.startswith(source_root + os.sep) for path in pending)
+            edited = [path for path in pending if path == edited_root or path.startswith(edited_root + os.sep)]
+            pending = set()
+            with tracing.span("watch.update"):
+                if raw_changed:
+                    report = build(base_dir, manifest=manifest)
+                else:
+                    report = BuildReport()
+                    for rel_path in _edited_rel_paths(edited, edited_root, manifest):
+                        try:
+                            update_edited_files(base_dir, [rel_path], manifest, report)
+                        except Exception as e:
+                            # e.g. a PNG read while still being written; its next save retries it
+                            print(f"[failed] {rel_path}: {type(e).__name__}: {e}")
+                latency = time.perf_counter() - first_event
+                manifest.save()
+            if report.actions or report.failed:
+                report.print_summary()
+                print(f"patched/ updated {latency * 1000:.0f} ms after the first change"
+                      + (" (raw/ changed, full sync)" if raw_changed else ""))
+                if pack:
+                    pack_pbo(patched_dir, pbo_path, previous=pbo_path)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        manifest.save()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild patched/ as files in edited/ and raw/ change.")
+    parser.add_argument("--debounce", type=float, default=0.15, help="quiet seconds before handling a burst of changes")
+    parser.add_argument("--pack", action="store_true", help="repack build/patched.pbo after each update")
+    args = parser.parse_args()
+
+    base_dir = os.path.dirname(os.path.realpath(__file__))
+    watch(base_dir, debounce=args.debounce, pack=args.pack)